@@ -0,0 +1,101 @@
+"""Compares the speed and accuracy of the registered backbones: images/s
+of the frozen and fine-tuning training epochs and of inference, and the
+validation metrics after a short training on a fixed sample.
+
+The sample is the train and validation directories of --sample_dir
+(e.g. a subset of --builder_storage_dir), or synthetic icons with random
+content (whose metrics are meaningless, for speed only).
+
+Usage:
+    PYTHONPATH=$PYTHONPATH:. python benchmarks/backbone_benchmark.py \\
+        --backbones=mobilenet_v2,efficientnet_b0,resnet50 --sample_dir=./data_sample \\
+        --benchmark_epochs=3 --loader_threads=8 --intra_op_threads=16
+
+The batch size, icon dimension, precision policy, loader and thread flags
+are those of betel/main.py.
+"""
+
+import time
+import tempfile
+import pathlib
+import pandas as pd
+from absl import app
+from absl import flags
+from tensorflow import keras
+from test import icon_builder
+from betel import main as betel_main
+from betel.backbones import BACKBONES
+from betel.classifier_sequence import ClassifierSequence
+from betel.model_training import define_model, train_model, TrainingConfig
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_list('backbones', list(BACKBONES), 'Backbones to compare.')
+flags.DEFINE_string('sample_dir', None, 'Directory with the train and validation samples.')
+flags.DEFINE_integer('num_icons', 256, 'Number of synthetic icons per data set.')
+flags.DEFINE_integer('benchmark_epochs', 2, 'Epochs of every training phase.')
+flags.DEFINE_bool('pretrained', True, 'Start from the ImageNet weights (else random weights).')
+
+
+def _images_per_second(phase_summary: dict, icons_no: int) -> float:
+    return phase_summary["trained_epochs"] * icons_no / phase_summary["time"]
+
+
+def benchmark_backbone(name: str, sample_dir: pathlib.Path) -> dict:
+    """Trains and evaluates the model with a backbone on the sample."""
+    model, base_model = define_model(FLAGS.precision_policy, name, FLAGS.target_img_dim,
+                                     "imagenet" if FLAGS.pretrained else None)
+
+    train_seq, val_seq = [ClassifierSequence(sample_dir / data_set, FLAGS.batch_size,
+                                             FLAGS.target_img_dim, shuffle=data_set == "train",
+                                             num_threads=FLAGS.loader_threads,
+                                             prefetch_batches=FLAGS.prefetch_batches)
+                          for data_set in ("train", "validation")]
+
+    config = TrainingConfig(frozen_epochs=FLAGS.benchmark_epochs,
+                            epochs=2 * FLAGS.benchmark_epochs,
+                            jit_compile=FLAGS.jit_compile, tensorboard=False)
+    summary = train_model(model, base_model, train_seq, val_seq, config)
+
+    model.predict_on_batch(val_seq[0][0])  # traces the inference function
+    start = time.perf_counter()
+    for idx in range(len(val_seq)):
+        model.predict_on_batch(val_seq[idx][0])
+    inference_images_per_second = len(val_seq) * FLAGS.batch_size / (time.perf_counter() - start)
+
+    metrics = model.evaluate(val_seq, return_dict=True, verbose=0)
+    icons_no = len(train_seq) * FLAGS.batch_size
+
+    return {
+        "backbone": name,
+        "parameters": base_model.count_params(),
+        "frozen_images_per_s": _images_per_second(summary["frozen"], icons_no),
+        "fine_tuning_images_per_s": _images_per_second(summary["fine_tuning"], icons_no),
+        "inference_images_per_s": inference_images_per_second,
+        **{f"val_{metric}": value for metric, value in metrics.items()}
+    }
+
+
+def main(argv):
+    betel_main.configure_threads()
+
+    with tempfile.TemporaryDirectory() as synthetic_dir:
+        if FLAGS.sample_dir is not None:
+            sample_dir = pathlib.Path(FLAGS.sample_dir)
+        else:
+            sample_dir = pathlib.Path(synthetic_dir)
+            for data_set in ("train", "validation"):
+                (sample_dir / data_set).mkdir()
+                builder = icon_builder.IconBuilder(sample_dir / data_set, random_content=True)
+                builder.create_icons(FLAGS.num_icons, num_categories=2)
+
+        rows = []
+        for name in FLAGS.backbones:
+            rows.append(benchmark_backbone(name, sample_dir))
+            keras.backend.clear_session()
+
+    print(pd.DataFrame(rows).to_string(index=False))
+
+
+if __name__ == "__main__":
+    app.run(main)
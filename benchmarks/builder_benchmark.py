@@ -0,0 +1,83 @@
+"""Compares building the classifier data sets row by row and in bulk,
+and times the split methods (shuffled, hashed and stratified hashed).
+
+A synthetic scraper output (apps file and small distinct icons) is
+generated first. The row by row build is only run when --row_build is
+set, since it is very slow for large inputs.
+
+Usage:
+    PYTHONPATH=$PYTHONPATH:. python benchmarks/builder_benchmark.py --num_apps=1000000 \
+        --classes=category0,category1
+
+The builder is configured by the --classes, --builder_threads,
+--split_method and --stratify flags of betel/main.py.
+"""
+
+import time
+import tempfile
+import pathlib
+import numpy as np
+import pandas as pd
+from absl import app
+from absl import flags
+import betel.main  # defines the flags shared with betel/main.py
+from betel import utils
+from betel import info_files_helpers
+from betel.classifier_data_set_builder import ClassifierDataSetBuilder
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('num_apps', 100000, 'Number of apps in the synthetic scraper output.')
+flags.DEFINE_integer('num_categories', 30, 'Number of categories of the synthetic apps.')
+flags.DEFINE_bool('row_build', False, 'Also run the row by row build.')
+
+
+def _create_scraper_output(input_dir: pathlib.Path) -> None:
+    app_ids = [f"com.benchmark.app{i}" for i in range(FLAGS.num_apps)]
+    categories = np.random.randint(FLAGS.num_categories, size=FLAGS.num_apps)
+
+    apps = pd.DataFrame({"app_id": app_ids,
+                         "category": [f"category{category}" for category in categories]})
+    apps.to_csv(input_dir / utils.SCRAPER_INFO_FILE_NAME, index=False)
+
+    for app_id in app_ids:
+        (input_dir / utils.get_app_icon_name(app_id)).write_bytes(app_id.encode())
+
+
+def _run(input_dir: pathlib.Path, storage_dir: pathlib.Path, bulk: bool) -> float:
+    builder = ClassifierDataSetBuilder(input_dir, storage_dir, classes=FLAGS.classes,
+                                       bulk=bulk, num_threads=FLAGS.builder_threads,
+                                       split_method=FLAGS.split_method, stratify=FLAGS.stratify)
+
+    start = time.perf_counter()
+    builder.split_and_build_data_sets()
+    return time.perf_counter() - start
+
+
+def main(argv):
+    with tempfile.TemporaryDirectory() as directory:
+        directory = pathlib.Path(directory)
+        input_dir = directory / "input"
+        input_dir.mkdir()
+
+        _create_scraper_output(input_dir)
+
+        app_list = info_files_helpers.read_csv_file(input_dir / utils.SCRAPER_INFO_FILE_NAME)
+        for split_method, stratify in [("shuffle", False), ("hash", False), ("hash", True)]:
+            builder = ClassifierDataSetBuilder(input_dir, directory / "split",
+                                               classes=FLAGS.classes, split_method=split_method,
+                                               stratify=stratify)
+            start = time.perf_counter()
+            builder.split(app_list)
+            print(f"{split_method} split{' (stratified)' if stratify else ''}: "
+                  f"{time.perf_counter() - start:.2f}s")
+
+        modes = {"bulk": True, "row": False} if FLAGS.row_build else {"bulk": True}
+        for name, bulk in modes.items():
+            elapsed = _run(input_dir, directory / name, bulk)
+            print(f"{name}: {FLAGS.num_apps} apps in {elapsed:.2f}s "
+                  f"({FLAGS.num_apps / elapsed:.0f} apps/s)")
+
+
+if __name__ == "__main__":
+    app.run(main)
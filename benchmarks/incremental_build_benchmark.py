@@ -0,0 +1,121 @@
+"""Compares rebuilding the classifier data sets incrementally (from the
+build manifest) and fully after a small change of the scraper output.
+
+A synthetic scraper output (apps file and small distinct icons) is
+generated and built incrementally first. A delta of --delta_share of the
+apps is then applied: new apps are added, and as many apps are removed,
+moved to another category and given a new icon. The rebuild is timed
+incrementally, and in full (bulk) on a copy of the first build. The full
+rebuild only adds the new apps (the apps already built are skipped, and
+moved or removed apps are left as they were); a correct full rebuild has
+to start from scratch, like the first build.
+
+Usage:
+    PYTHONPATH=$PYTHONPATH:. python benchmarks/incremental_build_benchmark.py \\
+        --num_apps=1000000 --delta_share=0.01
+
+The builder is configured by the --classes, --builder_threads,
+--split_method and --stratify flags of betel/main.py.
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import pathlib
+import numpy as np
+import pandas as pd
+from absl import app
+from absl import flags
+import betel.main  # defines the flags shared with betel/main.py
+from betel import utils
+from betel.classifier_data_set_builder import ClassifierDataSetBuilder
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('num_apps', 100000, 'Number of apps in the synthetic scraper output.')
+flags.DEFINE_integer('num_categories', 30, 'Number of categories of the synthetic apps.')
+flags.DEFINE_float('delta_share', 0.01, 'Share of the apps added (and removed, moved, changed).')
+
+
+def _write_icons(input_dir: pathlib.Path, app_ids: pd.Series, content: str = "") -> None:
+    # the icons are replaced, as by the scraper, since the built ones are
+    # hard linked into the icon store
+    for app_id in app_ids:
+        icon = input_dir / utils.get_app_icon_name(app_id)
+        icon.unlink(missing_ok=True)
+        icon.write_bytes(f"{app_id}{content}".encode())
+
+
+def _create_scraper_output(input_dir: pathlib.Path) -> pd.DataFrame:
+    categories = np.random.randint(FLAGS.num_categories, size=FLAGS.num_apps)
+    apps = pd.DataFrame({"app_id": [f"com.benchmark.app{i}" for i in range(FLAGS.num_apps)],
+                         "category": [f"category{category}" for category in categories]})
+    apps.to_csv(input_dir / utils.SCRAPER_INFO_FILE_NAME, index=False)
+    _write_icons(input_dir, apps["app_id"])
+    return apps
+
+
+def _apply_delta(input_dir: pathlib.Path, apps: pd.DataFrame) -> None:
+    delta_size = int(FLAGS.delta_share * len(apps))
+    removed, moved, changed = np.split(np.random.permutation(len(apps))[:3 * delta_size], 3)
+
+    for app_id in apps["app_id"].iloc[removed]:
+        (input_dir / utils.get_app_icon_name(app_id)).unlink()
+    _write_icons(input_dir, apps["app_id"].iloc[changed], "changed")
+
+    apps = apps.copy()
+    apps.iloc[moved, apps.columns.get_loc("category")] = "category_moved"
+    added = pd.DataFrame({"app_id": [f"com.benchmark.new{i}" for i in range(delta_size)],
+                          "category": "category0"})
+    _write_icons(input_dir, added["app_id"])
+
+    apps = pd.concat([apps.drop(apps.index[removed]), added])
+    apps.to_csv(input_dir / utils.SCRAPER_INFO_FILE_NAME, index=False)
+
+
+def _create_builder(input_dir: pathlib.Path, storage_dir: pathlib.Path) -> ClassifierDataSetBuilder:
+    return ClassifierDataSetBuilder(input_dir, storage_dir, classes=FLAGS.classes, bulk=True,
+                                    num_threads=FLAGS.builder_threads,
+                                    split_method=FLAGS.split_method, stratify=FLAGS.stratify)
+
+
+def _time(build) -> float:
+    start = time.perf_counter()
+    build()
+    return time.perf_counter() - start
+
+
+def main(argv):
+    with tempfile.TemporaryDirectory() as directory:
+        directory = pathlib.Path(directory)
+        input_dir = directory / "input"
+        input_dir.mkdir()
+        incremental_dir = directory / "incremental"
+
+        apps = _create_scraper_output(input_dir)
+
+        elapsed = _time(_create_builder(input_dir, incremental_dir).update_data_sets)
+        print(f"first build: {FLAGS.num_apps} apps in {elapsed:.2f}s")
+
+        # the full rebuild starts from the same data sets (icons linked, info
+        # files copied, since they are appended to), without manifest
+        full_dir = directory / "full"
+        info_dir = utils.CLASSIFIER_DATA_BUILDER_INFO_DIR
+        shutil.copytree(incremental_dir, full_dir, copy_function=os.link,
+                        ignore=shutil.ignore_patterns(info_dir))
+        shutil.copytree(incremental_dir / info_dir, full_dir / info_dir)
+        (full_dir / utils.CLASSIFIER_DATA_BUILDER_MANIFEST_FILE_NAME).unlink()
+
+        _apply_delta(input_dir, apps)
+
+        incremental_builder = _create_builder(input_dir, incremental_dir)
+        elapsed = _time(lambda: print(incremental_builder.update_data_sets()))
+        print(f"incremental rebuild: {elapsed:.2f}s")
+
+        elapsed = _time(_create_builder(input_dir, full_dir).split_and_build_data_sets)
+        print(f"full rebuild (adding the new apps only): {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    app.run(main)
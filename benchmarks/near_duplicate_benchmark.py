@@ -0,0 +1,69 @@
+"""Measures the speed of the near-duplicate detection of the builder: the
+icons/s of the perceptual hashing of synthetic PNG icons, and the time to
+group synthetic hashes, a share of which are planted near duplicates (with
+the share of them found).
+
+Usage:
+    PYTHONPATH=$PYTHONPATH:. python benchmarks/near_duplicate_benchmark.py --num_icons=2000 \\
+        --num_hashes=1000000 --builder_threads=16
+
+The hashing threads are set by the --builder_threads flag of betel/main.py.
+"""
+
+import time
+import tempfile
+import pathlib
+import numpy as np
+from absl import app
+from absl import flags
+from test import icon_builder
+import betel.main  # defines the flags shared with betel/main.py
+from betel import near_duplicates
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('num_icons', 1000, 'Number of synthetic icons hashed.')
+flags.DEFINE_integer('icon_dim', 512, 'Dimension of the synthetic (square) icons.')
+flags.DEFINE_integer('num_hashes', 1000000, 'Number of synthetic hashes grouped.')
+flags.DEFINE_float('duplicate_share', 0.01, 'Share of the hashes with a planted near duplicate.')
+flags.DEFINE_integer('max_distance', 4, 'Maximum distance of near duplicates.')
+
+
+def _plant_near_duplicates(hashes: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    duplicates = hashes.copy()
+    for _ in range(FLAGS.max_distance):
+        bits = rng.integers(near_duplicates.HASH_BITS, size=len(hashes)).astype(np.uint64)
+        duplicates ^= np.uint64(1) << bits
+    return duplicates
+
+
+def main(argv):
+    for hash_function in near_duplicates.HASH_FUNCTIONS:
+        with tempfile.TemporaryDirectory() as input_dir:
+            builder = icon_builder.IconBuilder(pathlib.Path(input_dir),
+                                               (FLAGS.icon_dim, FLAGS.icon_dim),
+                                               random_content=True)
+            builder.create_icons(FLAGS.num_icons)
+            icons = list((pathlib.Path(input_dir) / "category0").iterdir())
+
+            start = time.perf_counter()
+            near_duplicates.hash_icons(icons, hash_function, FLAGS.builder_threads)
+            print(f"{hash_function}: {len(icons) / (time.perf_counter() - start):.1f} icons/s")
+
+    rng = np.random.default_rng()
+    hashes = rng.integers(np.iinfo(np.int64).max, size=FLAGS.num_hashes).astype(np.uint64)
+    hashes ^= rng.integers(2, size=FLAGS.num_hashes).astype(np.uint64) << np.uint64(63)
+    originals = rng.choice(FLAGS.num_hashes, int(FLAGS.duplicate_share * FLAGS.num_hashes),
+                           replace=False)
+    hashes = np.concatenate([hashes, _plant_near_duplicates(hashes[originals], rng)])
+
+    start = time.perf_counter()
+    groups = near_duplicates.find_duplicate_groups(hashes, FLAGS.max_distance)
+    print(f"grouping {len(hashes)} hashes: {time.perf_counter() - start:.1f} s")
+
+    found = groups[originals] == groups[FLAGS.num_hashes:]
+    print(f"planted near duplicates found: {100 * found.mean():.2f}%")
+
+
+if __name__ == "__main__":
+    app.run(main)
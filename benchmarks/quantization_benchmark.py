@@ -0,0 +1,49 @@
+"""Compares the accuracy and latency of an exported classifier with its
+quantized TFLite versions on a data set.
+
+The quantized models are created (in --model_dir) if they do not exist
+yet, calibrating the int8 model on the training set.
+
+Usage:
+    PYTHONPATH=$PYTHONPATH:. python benchmarks/quantization_benchmark.py --model_dir=./model \
+        --builder_storage_dir=./data_set --quantization=float16,dynamic,int8 --batch_size=64
+
+The model, data set, batch size, loader and TFLite thread flags
+(--intra_op_threads) are those of betel/main.py.
+"""
+
+import pathlib
+from absl import app
+from absl import flags
+from betel import main as betel_main
+from betel.classifier_sequence import ClassifierSequence
+from betel.inference import IconClassifier
+from betel.quantization import TFLiteIconClassifier, compare_classifiers, quantize_model, \
+    get_tflite_model_file
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('data_set', 'test', 'Data set on which the classifiers are compared.')
+
+
+def main(argv):
+    betel_main.configure_threads()
+    model_dir = pathlib.Path(FLAGS.model_dir)
+
+    classifiers = {"float": IconClassifier.load(model_dir)}
+    for mode in FLAGS.quantization or ["float16", "dynamic", "int8"]:
+        if not get_tflite_model_file(model_dir, mode).exists():
+            quantize_model(model_dir, mode, betel_main.initialise_calibration_sequence(),
+                           FLAGS.calibration_batches)
+        classifiers[mode] = TFLiteIconClassifier.load(model_dir, mode,
+                                                      FLAGS.intra_op_threads or None)
+
+    sequence = ClassifierSequence(pathlib.Path(FLAGS.builder_storage_dir) / FLAGS.data_set,
+                                  FLAGS.batch_size, FLAGS.target_img_dim, shuffle=False,
+                                  num_threads=max(1, FLAGS.loader_threads))
+
+    print(compare_classifiers(classifiers, sequence).to_string(index=False))
+
+
+if __name__ == "__main__":
+    app.run(main)
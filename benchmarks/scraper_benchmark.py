@@ -0,0 +1,52 @@
+"""Compares the throughput of the process-based PlayAppPageScraper and the
+AsyncPlayAppPageScraper against a local stub of the Play Store.
+
+Usage:
+    PYTHONPATH=$PYTHONPATH:. python benchmarks/scraper_benchmark.py --num_apps=2000 --latency=0.05
+
+The async scraper is configured by the --max_concurrency and
+--per_host_limit flags of betel/main.py.
+"""
+
+import time
+import tempfile
+import pathlib
+from absl import app
+from absl import flags
+from test import play_store_stub
+import betel.main  # defines the flags shared with betel/main.py
+from betel.app_page_scraper import PlayAppPageScraper
+from betel.async_app_page_scraper import AsyncPlayAppPageScraper
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('num_apps', 1000, 'Number of app ids to scrape.')
+flags.DEFINE_float('latency', 0.05, 'Simulated latency (in seconds) of every request.')
+
+
+def _run(scraper, app_ids) -> float:
+    start = time.perf_counter()
+    scraper.store_apps_info(app_ids)
+    return time.perf_counter() - start
+
+
+def main(argv):
+    app_ids = [f"com.benchmark.app{i}" for i in range(FLAGS.num_apps)]
+
+    with play_store_stub.PlayStoreStub(latency=FLAGS.latency) as stub, \
+            tempfile.TemporaryDirectory() as storage_dir:
+        scrapers = {
+            "parmap": PlayAppPageScraper(stub.store_url, pathlib.Path(storage_dir) / "parmap"),
+            "async": AsyncPlayAppPageScraper(stub.store_url, pathlib.Path(storage_dir) / "async",
+                                             max_concurrency=FLAGS.max_concurrency,
+                                             per_host_limit=FLAGS.per_host_limit)
+        }
+
+        for name, scraper in scrapers.items():
+            elapsed = _run(scraper, app_ids)
+            print(f"{name}: {len(app_ids)} apps in {elapsed:.2f}s "
+                  f"({len(app_ids) / elapsed:.1f} apps/s)")
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,100 @@
+"""Measures the throughput (in images per second) of ClassifierSequence
+with sequential decoding, with parallel, prefetching decoding and with
+the memory-mapped tensor cache (whose one-time build is timed separately),
+and of the equivalent tf.data pipeline (without and with its cache), over
+the icon files and over their record shards (whose export is timed).
+
+Synthetic PNG icons with random content are generated first.
+
+Usage:
+    PYTHONPATH=$PYTHONPATH:. python benchmarks/sequence_benchmark.py --num_icons=2000 \\
+        --loader_threads=8 --prefetch_batches=4
+"""
+
+import time
+import tempfile
+import pathlib
+import tensorflow as tf
+from absl import app
+from absl import flags
+from test import icon_builder
+import betel.main  # defines the flags shared with betel/main.py
+from betel.classifier_sequence import ClassifierSequence
+from betel.classifier_dataset import build_dataset
+from betel.record_shards import RecordSequence, build_record_dataset, export_data_set
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('num_icons', 1000, 'Number of synthetic icons.')
+flags.DEFINE_integer('icon_dim', 512, 'Dimension of the synthetic (square) icons.')
+
+
+def _measure(sequence: ClassifierSequence) -> float:
+    start = time.perf_counter()
+    for idx in range(len(sequence)):
+        sequence[idx]
+    return len(sequence) * FLAGS.batch_size / (time.perf_counter() - start)
+
+
+def _measure_dataset(dataset: tf.data.Dataset) -> float:
+    start = time.perf_counter()
+    batches_no = sum(1 for _ in dataset)
+    return batches_no * FLAGS.batch_size / (time.perf_counter() - start)
+
+
+def main(argv):
+    with tempfile.TemporaryDirectory() as input_dir:
+        builder = icon_builder.IconBuilder(pathlib.Path(input_dir),
+                                           (FLAGS.icon_dim, FLAGS.icon_dim), random_content=True)
+        builder.create_icons(FLAGS.num_icons, num_categories=2)
+
+        loaders = {
+            "sequential": (0, 0),
+            "parallel": (max(1, FLAGS.loader_threads), FLAGS.prefetch_batches)
+        }
+
+        for name, (num_threads, prefetch_batches) in loaders.items():
+            sequence = ClassifierSequence(pathlib.Path(input_dir), FLAGS.batch_size,
+                                          FLAGS.target_img_dim, shuffle=False,
+                                          num_threads=num_threads,
+                                          prefetch_batches=prefetch_batches)
+            print(f"{name}: {_measure(sequence):.1f} images/s")
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            start = time.perf_counter()
+            sequence = ClassifierSequence(pathlib.Path(input_dir), FLAGS.batch_size,
+                                          FLAGS.target_img_dim, shuffle=False,
+                                          num_threads=max(1, FLAGS.loader_threads),
+                                          cache_dir=pathlib.Path(cache_dir))
+            print(f"cache build: {time.perf_counter() - start:.1f} s")
+            print(f"cached: {_measure(sequence):.1f} images/s")
+
+        dataset = build_dataset(pathlib.Path(input_dir), FLAGS.batch_size, FLAGS.target_img_dim,
+                                shuffle=False)
+        print(f"tf.data: {_measure_dataset(dataset):.1f} images/s")
+
+        dataset = build_dataset(pathlib.Path(input_dir), FLAGS.batch_size, FLAGS.target_img_dim,
+                                shuffle=False, cache="")
+        print(f"tf.data (first epoch, filling the cache): {_measure_dataset(dataset):.1f} images/s")
+        print(f"tf.data (cached): {_measure_dataset(dataset):.1f} images/s")
+
+        with tempfile.TemporaryDirectory() as records_dir:
+            start = time.perf_counter()
+            export_data_set(pathlib.Path(input_dir), pathlib.Path(records_dir),
+                            num_threads=max(1, FLAGS.loader_threads))
+            print(f"record export: {time.perf_counter() - start:.1f} s")
+
+            for name, (num_threads, prefetch_batches) in loaders.items():
+                sequence = RecordSequence(pathlib.Path(records_dir), FLAGS.batch_size,
+                                          FLAGS.target_img_dim, shuffle=False,
+                                          num_threads=num_threads,
+                                          prefetch_batches=prefetch_batches)
+                print(f"records, {name}: {_measure(sequence):.1f} images/s")
+
+            dataset = build_record_dataset(pathlib.Path(records_dir), FLAGS.batch_size,
+                                           FLAGS.target_img_dim, shuffle=False)
+            print(f"records, tf.data: {_measure_dataset(dataset):.1f} images/s")
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -1,4 +1,5 @@
 import betel.app_page_scraper
+import betel.async_app_page_scraper
 import betel.betel_errors
 import betel.utils
 import betel.info_files_helpers
@@ -7,4 +8,3 @@ import betel.data_set_builder
 import betel.classifier_data_set_builder
 import betel.play_store_categories
 import betel.model_training
-import betel.main
@@ -1,13 +1,38 @@
+import os
+import math
 import pathlib
+import collections
+import dataclasses
 import urllib.error
 import urllib.request
 import logging
+from typing import Iterable, Optional, Tuple
 import bs4
 import parmap
-import pandas as pd
 from betel import utils
 from betel import info_files_helpers
 from betel import betel_errors
+from betel import work_ledger
+from betel import request_throttling
+from betel import icon_cache
+
+# the summaries of the runs are logged at INFO level whatever the level of
+# the root logger (e.g. configured before the scraper, in which case
+# basicConfig leaves it as is)
+_summary_logger = logging.getLogger(f"{__name__}.summary")
+_summary_logger.setLevel(logging.INFO)
+
+
+@dataclasses.dataclass
+class AppDetails:
+    """The info scraped from an app's Play Store details page.
+
+    Fields are None when they can't be found within the page.
+    """
+
+    app_id: str
+    category: Optional[str] = None
+    icon_url: Optional[str] = None
 
 
 class PlayAppPageScraper:
@@ -16,14 +41,23 @@ class PlayAppPageScraper:
 
     _ICON_CLASS = "T75of sHb2Xb"  # icon's tag's class
     _APP_CATEGORY_ITEMPROP = "genre"  # app's category's tag's itemprop
+    _DETAILS_CACHE_SIZE = 10000  # number of AppDetails kept in memory
+    _BATCH_SIZE = 100  # number of apps handled (and written) at once by a worker
+    _INFO_BUFFER_SIZE = _BATCH_SIZE  # number of info rows written at once
 
-    def __init__(self, base_url: str, storage_dir: pathlib.Path, category_filter: [str] = None):
+    def __init__(self, base_url: str, storage_dir: pathlib.Path, category_filter: [str] = None,
+                 retry_policy: Optional[request_throttling.RetryPolicy] = None,
+                 requests_per_second: Optional[float] = None):
         """Constructor.
 
         :param base_url: base url of the apps store.
         :param storage_dir: main storage directory for retrieved info.
         :param category_filter: a list of categories whose apps are stored
         (instead of the whole input)
+        :param retry_policy: when and how failed requests are retried
+        (default: no retries)
+        :param requests_per_second: request rate limit shared by all the
+        workers (default: no limit)
         """
         self._base_url = base_url
 
@@ -31,18 +65,77 @@ class PlayAppPageScraper:
         self._storage_dir.mkdir(exist_ok=True, parents=True)
 
         self._info_file = storage_dir / utils.SCRAPER_INFO_FILE_NAME
+        self._info_index = info_files_helpers.InfoFileIndex(self._info_file)
+        self._info_writer = info_files_helpers.BufferedInfoWriter(self._info_file,
+                                                                  self._INFO_BUFFER_SIZE)
+
+        self._ledger = work_ledger.WorkLedger(storage_dir / utils.SCRAPER_LEDGER_FILE_NAME)
+        self._icon_cache = icon_cache.IconCache(storage_dir / utils.SCRAPER_ICON_CACHE_FILE_NAME)
 
         self._log_file = storage_dir / utils.SCRAPER_LOG_FILE_NAME
-        logging.basicConfig(filename=self._log_file, filemode="a+")
+        logging.basicConfig(filename=self._log_file, filemode="a+", level=logging.INFO)
 
         self._category_filter = category_filter
 
+        self._details_cache = collections.OrderedDict()
+
+        self._retry_policy = retry_policy
+        self._rate_limiter = None
+        if requests_per_second:
+            rate_limiter_file = storage_dir / utils.SCRAPER_RATE_LIMITER_FILE_NAME
+            self._rate_limiter = request_throttling.TokenBucket(rate_limiter_file,
+                                                                requests_per_second)
+
     def _build_app_page_url(self, app_id: str) -> str:
         return self._base_url + "/details?id=" + app_id
 
     def _get_app_page(self, app_id: str) -> bs4.BeautifulSoup:
         url = self._build_app_page_url(app_id)
-        return _get_html(url)
+        return self._request(lambda: _get_html(url))
+
+    def _request(self, request):
+        return request_throttling.call_with_retries(request, self._retry_policy,
+                                                    self._rate_limiter)
+
+    def get_app_details(self, app_id: str) -> AppDetails:
+        """Scrapes all the info needed about an app from a single download
+        of its Play Store details page. The result is cached, so repeated
+        lookups of the same app don't download the page again.
+
+        :param app_id: the id of the app.
+        :return: the scraped details of the app
+        """
+        details = self._get_cached_app_details(app_id)
+        if details is not None:
+            return details
+
+        html = self._get_app_page(app_id)
+        details = self._scrape_app_details(app_id, html)
+        self._cache_app_details(details)
+
+        return details
+
+    def _get_cached_app_details(self, app_id: str) -> Optional[AppDetails]:
+        # a hit makes the app the most recently used one (evicted last)
+        if app_id not in self._details_cache:
+            return None
+        self._details_cache.move_to_end(app_id)
+        return self._details_cache[app_id]
+
+    def _cache_app_details(self, details: AppDetails) -> None:
+        self._details_cache[details.app_id] = details
+        if len(self._details_cache) > self._DETAILS_CACHE_SIZE:
+            self._details_cache.popitem(last=False)
+
+    def _scrape_app_details(self, app_id: str, html: bs4.BeautifulSoup) -> AppDetails:
+        icon = html.find(class_=self._ICON_CLASS)
+        category = html.find(itemprop=self._APP_CATEGORY_ITEMPROP)
+
+        return AppDetails(
+            app_id=app_id,
+            category=None if category is None else category.get_text().lower(),
+            icon_url=None if icon is None else icon["src"]
+        )
 
     def get_app_icon(self, app_id: str, subdir: pathlib.Path = "") -> None:
         """Scrapes the app icon URL from the app's Play Store details page,
@@ -53,24 +146,17 @@ class PlayAppPageScraper:
         :param subdir: icon storage subdirectory inside _storage_dir base
         directory.
         """
-        html = self._get_app_page(app_id)
-        src = self._scrape_icon_url(html)
+        details = self.get_app_details(app_id)
+        src = get_icon_url(details)
         self._download_icon(app_id, src, subdir)
-
-    def _scrape_icon_url(self, html: bs4.BeautifulSoup) -> str:
-        icon = html.find(class_=self._ICON_CLASS)
-        if icon is None:
-            raise betel_errors.PlayScrapingError("Icon class not found in html.")
-        return icon["src"]
+        self._icon_cache.flush()
 
     def _download_icon(self, app_id: str, source: str, directory: pathlib.Path) -> None:
         location = self._storage_dir / directory
         location.mkdir(exist_ok=True, parents=True)
 
-        try:
-            urllib.request.urlretrieve(source, location / utils.get_app_icon_name(app_id))
-        except (urllib.error.HTTPError, urllib.error.URLError) as exception:
-            raise betel_errors.AccessError("Can not retrieve icon.", exception)
+        destination = location / utils.get_app_icon_name(app_id)
+        self._request(lambda: _retrieve_icon(source, destination, self._icon_cache))
 
     def get_app_category(self, app_id: str) -> str:
         """Scrapes the app category from the app's Play Store details page.
@@ -78,14 +164,8 @@ class PlayAppPageScraper:
         :param app_id: the id of the app.
         :return: the category of the app in str format
         """
-        html = self._get_app_page(app_id)
-        return self._scrape_category(html).lower()
-
-    def _scrape_category(self, html: bs4.BeautifulSoup) -> str:
-        category = html.find(itemprop=self._APP_CATEGORY_ITEMPROP)
-        if category is None:
-            raise betel_errors.PlayScrapingError("Category itemprop not found in html.")
-        return category.get_text()
+        details = self.get_app_details(app_id)
+        return get_category(details)
 
     def store_app_info(self, app_id: str) -> None:
         """Adds an app to the data set by retrieving all the info
@@ -95,24 +175,54 @@ class PlayAppPageScraper:
 
         :param app_id: the id of the app.
         """
-        search_data_frame = utils.get_app_search_data_frame(app_id)
-        part_of_data_set = (
-            info_files_helpers.part_of_data_set(self._info_file, search_data_frame)
-        )
+        if app_id not in self._info_index:
+            self._store_new_apps_info([app_id])
 
+    def _store_new_apps_info(self, app_ids: [str]) -> Tuple[collections.Counter,
+                                                            collections.Counter]:
+        # returns the numbers of apps per outcome and the icon cache stats
+        entries = []
         try:
-            if not part_of_data_set:
-                category = self.get_app_category(app_id)
-                if self._category_filter is None or category in self._category_filter:
-                    self.get_app_icon(app_id)
-                    self._write_app_info(app_id, category)
+            for app_id in app_ids:
+                entries.append(self._store_new_app_info(app_id))
+        finally:
+            self._record(entries)
+        return count_states(entries), self._icon_cache.pop_stats()
+
+    def _record(self, entries: [work_ledger.LedgerEntry]) -> None:
+        # the ledger is only updated once the apps are in the info file
+        self._info_writer.flush()
+        self._icon_cache.flush()
+        self._ledger.record(entries)
+
+    def _store_new_app_info(self, app_id: str) -> work_ledger.LedgerEntry:
+        try:
+            details = self.get_app_details(app_id)
+            category = get_category(details)
+            if self._category_filter is None or category in self._category_filter:
+                self._download_icon(app_id, get_icon_url(details), "")
+                self._write_app_info(app_id, category)
+                return work_ledger.LedgerEntry(app_id, work_ledger.AppState.DONE, category)
+            return work_ledger.LedgerEntry(app_id, work_ledger.AppState.FILTERED, category)
         except betel_errors.BetelError as exception:
-            info = f"{app_id}, {getattr(exception, 'message', repr(exception))}"
-            logging.warning(info)
+            return handle_failure(app_id, exception)
 
     def _write_app_info(self, app_id: str, category: str) -> None:
-        app_info = _build_app_info_data_frame(app_id, category)
-        info_files_helpers.add_to_data(self._info_file, app_info)
+        self._info_writer.add({"app_id": app_id, "category": category})
+        self._info_index.add(app_id)
+
+    def _get_new_app_ids(self, app_ids: [str]) -> [str]:
+        app_ids = [app_id for app_id in set(app_ids) if app_id not in self._info_index]
+        return self._ledger.get_pending(app_ids, self._category_filter)
+
+    def _log_summary(self, states: collections.Counter,
+                     icon_cache_stats: collections.Counter) -> None:
+        # the outcomes of this run, then the ledger's totals (of all the runs)
+        for state in work_ledger.AppState:
+            _summary_logger.info("%s apps: %d", state.value, states[state])
+        for state, count in self._ledger.count_states().items():
+            _summary_logger.info("%s apps in total: %d", state.value, count)
+        _log_icon_cache_stats(icon_cache_stats)
 
     def store_apps_info(self, app_ids: [str]) -> None:
         """Adds the specified apps to the data set by retrieving all the info
@@ -120,8 +230,43 @@ class PlayAppPageScraper:
 
         :param app_ids: array of app ids.
         """
-        app_ids = set(app_ids)
-        parmap.map(self.store_app_info, app_ids)
+        # the stored (or otherwise finished) apps are filtered out here, so
+        # that the workers never need to load the index of the info file
+        # (their copies of it are unloaded, and ignore the apps they add)
+        app_ids = self._get_new_app_ids(app_ids)
+        results = parmap.map(self._store_new_apps_info, self._get_batches(app_ids))
+        # the apps were added to the info file by the worker processes
+        self._info_index.invalidate()
+        self._log_summary(sum((states for states, _ in results), collections.Counter()),
+                          sum((stats for _, stats in results), collections.Counter()))
+
+    def _get_batches(self, app_ids: [str]) -> [[str]]:
+        # small inputs are still spread over all the worker processes
+        batch_size = max(1, min(self._BATCH_SIZE, math.ceil(len(app_ids) / os.cpu_count())))
+        return [app_ids[i:i + batch_size] for i in range(0, len(app_ids), batch_size)]
+
+    def refresh_icons(self, app_ids: [str]) -> None:
+        """Downloads again the icons of the specified apps which are
+        already stored (e.g. for a periodic refresh). Icons unchanged
+        since the last download are neither transferred again (when the
+        server supports conditional requests) nor rewritten.
+
+        :param app_ids: array of app ids.
+        """
+        app_ids = [app_id for app_id in set(app_ids) if app_id in self._info_index]
+        icon_cache_stats = parmap.map(self._refresh_apps_icons, self._get_batches(app_ids))
+        _log_icon_cache_stats(sum(icon_cache_stats, collections.Counter()))
+
+    def _refresh_apps_icons(self, app_ids: [str]) -> collections.Counter:
+        try:
+            for app_id in app_ids:
+                try:
+                    self.get_app_icon(app_id)
+                except betel_errors.BetelError as exception:
+                    handle_failure(app_id, exception)
+        finally:
+            self._icon_cache.flush()
+        return self._icon_cache.pop_stats()
 
 
 def _get_html(url: str) -> bs4.BeautifulSoup:
@@ -133,6 +278,53 @@ def _get_html(url: str) -> bs4.BeautifulSoup:
         raise betel_errors.AccessError("Can not open URL.", exception)
 
 
-def _build_app_info_data_frame(app_id: str, category: str) -> pd.DataFrame:
-    dictionary = {"app_id": app_id, "category": category}
-    return pd.DataFrame([dictionary])
+def _retrieve_icon(source: str, destination: pathlib.Path, cache: icon_cache.IconCache) -> None:
+    headers = cache.get_conditional_headers(source, destination)
+    try:
+        with urllib.request.urlopen(urllib.request.Request(source, headers=headers)) as response:
+            cache.save(source, destination, response.read(), response.headers)
+    except urllib.error.HTTPError as exception:
+        if exception.code != 304:
+            raise betel_errors.AccessError("Can not retrieve icon.", exception)
+        cache.mark_not_modified()
+    except urllib.error.URLError as exception:
+        raise betel_errors.AccessError("Can not retrieve icon.", exception)
+
+
+def _log_icon_cache_stats(icon_cache_stats: collections.Counter) -> None:
+    not_modified = icon_cache_stats[icon_cache.IconCache.NOT_MODIFIED]
+    unchanged = icon_cache_stats[icon_cache.IconCache.UNCHANGED]
+    _summary_logger.info("icon cache: %d hits (%d not modified, %d unchanged), %d misses",
+                         not_modified + unchanged, not_modified, unchanged,
+                         icon_cache_stats[icon_cache.IconCache.DOWNLOADED])
+
+
+def count_states(entries: Iterable[work_ledger.LedgerEntry]) -> collections.Counter:
+    """Counts the apps of every outcome (AppState) of some ledger entries."""
+    return collections.Counter(entry.state for entry in entries)
+
+
+def handle_failure(app_id: str, exception: betel_errors.BetelError) -> work_ledger.LedgerEntry:
+    """Logs the error raised while scraping an app and builds its
+    ledger entry."""
+    message = getattr(exception, 'message', repr(exception))
+    logging.warning(f"{app_id}, {message}")
+    return work_ledger.LedgerEntry(app_id, work_ledger.get_failure_state(exception),
+                                   message=message)
+
+
+def get_category(details: AppDetails) -> str:
+    """Returns the scraped category, raising PlayScrapingError if it
+    wasn't found within the page."""
+    if details.category is None:
+        raise betel_errors.PlayScrapingError("Category itemprop not found in html.")
+    return details.category
+
+
+def get_icon_url(details: AppDetails) -> str:
+    """Returns the scraped icon URL, raising PlayScrapingError if it
+    wasn't found within the page."""
+    if details.icon_url is None:
+        raise betel_errors.PlayScrapingError("Icon class not found in html.")
+    return details.icon_url
+
@@ -0,0 +1,172 @@
+import sys
+import asyncio
+import collections
+import pathlib
+from typing import Iterator, List, Optional
+import aiohttp
+import bs4
+from betel import utils
+from betel import betel_errors
+from betel import work_ledger
+from betel import request_throttling
+from betel import icon_cache
+from betel import app_page_scraper
+
+
+class AsyncPlayAppPageScraper(app_page_scraper.PlayAppPageScraper):
+    """A PlayAppPageScraper which keeps many requests in flight at once
+    over a single pooled keep-alive HTTP session, instead of making one
+    blocking request at a time in every worker process."""
+
+    _REQUEST_TIMEOUT = 60  # total timeout (in seconds) of one request
+    # the info rows are only written with the recorded batches (off the event loop)
+    _INFO_BUFFER_SIZE = sys.maxsize
+
+    def __init__(self, base_url: str, storage_dir: pathlib.Path, category_filter: [str] = None,
+                 max_concurrency: int = 1000, per_host_limit: int = 100,
+                 retry_policy: Optional[request_throttling.RetryPolicy] = None,
+                 requests_per_second: Optional[float] = None):
+        """Constructor.
+
+        :param base_url: base url of the apps store.
+        :param storage_dir: main storage directory for retrieved info.
+        :param category_filter: a list of categories whose apps are stored
+        (instead of the whole input)
+        :param max_concurrency: maximum number of apps processed (and
+        connections opened) at the same time
+        :param per_host_limit: maximum number of simultaneous connections
+        to the same host
+        :param retry_policy: when and how failed requests are retried
+        (default: no retries)
+        :param requests_per_second: request rate limit (default: no limit)
+        """
+        super().__init__(base_url, storage_dir, category_filter, retry_policy,
+                         requests_per_second)
+
+        self._max_concurrency = max_concurrency
+        self._per_host_limit = per_host_limit
+
+    def store_apps_info(self, app_ids: [str]) -> None:
+        """Adds the specified apps to the data set by retrieving all the info
+        needed and appending them to the list of apps (kept in _info_file).
+
+        :param app_ids: array of app ids.
+        """
+        asyncio.run(self.store_apps_info_async(app_ids))
+
+    async def store_apps_info_async(self, app_ids: [str]) -> None:
+        """Coroutine version of store_apps_info, for callers already
+        running an event loop.
+
+        :param app_ids: array of app ids.
+        """
+        pending = iter(self._get_new_app_ids(app_ids))
+        # the workers fill a single batch of ledger entries, recorded (with
+        # the info rows and the icon cache) in a thread, one batch at a time
+        entries = []
+        record_lock = asyncio.Lock()
+        states = collections.Counter()
+
+        connector = aiohttp.TCPConnector(limit=self._max_concurrency,
+                                         limit_per_host=self._per_host_limit)
+        timeout = aiohttp.ClientTimeout(total=self._REQUEST_TIMEOUT)
+
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         raise_for_status=True) as session:
+            workers = [self._store_pending_apps_info(session, pending, entries, record_lock,
+                                                     states)
+                       for _ in range(self._max_concurrency)]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                await self._record_async(entries, record_lock, states)
+
+        self._log_summary(states, self._icon_cache.pop_stats())
+
+    async def _store_pending_apps_info(self, session: aiohttp.ClientSession,
+                                       pending: Iterator[str],
+                                       entries: List[work_ledger.LedgerEntry],
+                                       record_lock: asyncio.Lock,
+                                       states: collections.Counter) -> None:
+        # the workers share the same iterator, so every app id is
+        # handled exactly once without building one task per app
+        for app_id in pending:
+            entries.append(await self._store_app_info_async(session, app_id))
+            if len(entries) >= self._BATCH_SIZE:
+                await self._record_async(entries, record_lock, states)
+
+    async def _record_async(self, entries: List[work_ledger.LedgerEntry],
+                            record_lock: asyncio.Lock, states: collections.Counter) -> None:
+        # the batch is taken at once, and the other workers go on filling
+        # the next one while it is written
+        batch = entries.copy()
+        entries.clear()
+        async with record_lock:
+            await asyncio.to_thread(self._record, batch)
+        states.update(app_page_scraper.count_states(batch))
+
+    async def _store_app_info_async(self, session: aiohttp.ClientSession,
+                                    app_id: str) -> work_ledger.LedgerEntry:
+        try:
+            details = await self._get_app_details_async(session, app_id)
+            category = app_page_scraper.get_category(details)
+            if self._category_filter is None or category in self._category_filter:
+                src = app_page_scraper.get_icon_url(details)
+                await self._download_icon_async(session, app_id, src)
+                self._write_app_info(app_id, category)
+                return work_ledger.LedgerEntry(app_id, work_ledger.AppState.DONE, category)
+            return work_ledger.LedgerEntry(app_id, work_ledger.AppState.FILTERED, category)
+        except betel_errors.BetelError as exception:
+            return app_page_scraper.handle_failure(app_id, exception)
+
+    async def _get_app_details_async(self, session: aiohttp.ClientSession,
+                                     app_id: str) -> app_page_scraper.AppDetails:
+        details = self._get_cached_app_details(app_id)
+        if details is not None:
+            return details
+
+        html = await self._get_app_page_async(session, app_id)
+        details = self._scrape_app_details(app_id, html)
+        self._cache_app_details(details)
+
+        return details
+
+    async def _get_app_page_async(self, session: aiohttp.ClientSession,
+                                  app_id: str) -> bs4.BeautifulSoup:
+        url = self._build_app_page_url(app_id)
+        page = await self._request_async(lambda: _get_text(session, url))
+        return bs4.BeautifulSoup(page, 'html.parser')
+
+    async def _request_async(self, request):
+        return await request_throttling.call_with_retries_async(request, self._retry_policy,
+                                                                self._rate_limiter)
+
+    async def _download_icon_async(self, session: aiohttp.ClientSession, app_id: str,
+                                   source: str, directory: pathlib.Path = "") -> None:
+        location = self._storage_dir / directory
+        location.mkdir(exist_ok=True, parents=True)
+
+        destination = location / utils.get_app_icon_name(app_id)
+        await self._request_async(
+            lambda: _retrieve_icon(session, source, destination, self._icon_cache))
+
+
+async def _get_text(session: aiohttp.ClientSession, url: str) -> str:
+    try:
+        async with session.get(url) as response:
+            return await response.text()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as exception:
+        raise betel_errors.AccessError("Can not open URL.", exception)
+
+
+async def _retrieve_icon(session: aiohttp.ClientSession, source: str, destination: pathlib.Path,
+                         cache: icon_cache.IconCache) -> None:
+    headers = cache.get_conditional_headers(source, destination)
+    try:
+        async with session.get(source, headers=headers) as response:
+            if response.status == 304:
+                cache.mark_not_modified()
+            else:
+                cache.save(source, destination, await response.read(), response.headers)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as exception:
+        raise betel_errors.AccessError("Can not retrieve icon.", exception)
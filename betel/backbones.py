@@ -0,0 +1,52 @@
+"""Registry of the pretrained backbones the classifier can be built on,
+each with its matching input preprocessing."""
+
+import dataclasses
+from typing import Callable, Dict, Optional
+from tensorflow.keras.models import Model
+from tensorflow.keras.applications import efficientnet, efficientnet_v2, mobilenet_v2, resnet, \
+    resnet_v2
+
+DEFAULT_BACKBONE = "resnet152_v2"
+
+
+@dataclasses.dataclass(frozen=True)
+class Backbone:
+    """A Keras application used as backbone."""
+
+    build: Callable[..., Model]  # the application's constructor
+    preprocess_input: Callable  # maps RGB float inputs in [0, 255] to the backbone's inputs
+
+
+BACKBONES: Dict[str, Backbone] = {
+    "mobilenet_v2": Backbone(mobilenet_v2.MobileNetV2, mobilenet_v2.preprocess_input),
+    "efficientnet_b0": Backbone(efficientnet.EfficientNetB0, efficientnet.preprocess_input),
+    "efficientnet_b3": Backbone(efficientnet.EfficientNetB3, efficientnet.preprocess_input),
+    "efficientnet_v2_b0": Backbone(efficientnet_v2.EfficientNetV2B0,
+                                   efficientnet_v2.preprocess_input),
+    "efficientnet_v2_s": Backbone(efficientnet_v2.EfficientNetV2S,
+                                  efficientnet_v2.preprocess_input),
+    "resnet50": Backbone(resnet.ResNet50, resnet.preprocess_input),
+    "resnet152_v2": Backbone(resnet_v2.ResNet152V2, resnet_v2.preprocess_input),
+}
+
+
+def get_backbone(name: str) -> Backbone:
+    """The registered backbone of a name (a key of BACKBONES)."""
+    if name not in BACKBONES:
+        raise ValueError(f"Unknown backbone: {name} (available: {', '.join(BACKBONES)}).")
+    return BACKBONES[name]
+
+
+def build_backbone(name: str, input_dim: int = 192,
+                   weights: Optional[str] = "imagenet") -> Model:
+    """Builds a backbone without its classification top.
+
+    :param name: the backbone's name
+    :param input_dim: dimension of the (square) input icons
+    :param weights: "imagenet" for the pretrained weights, None for
+    random ones
+    :return: the backbone
+    """
+    return get_backbone(name).build(include_top=False, weights=weights,
+                                    input_shape=(input_dim, input_dim, 3))
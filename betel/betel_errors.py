@@ -10,3 +10,6 @@ class AccessError(BetelError):
     """Raise on URL or HTTP errors."""
     def __init__(self, message, exception):
         super(AccessError, self).__init__(message + (": %s" % exception))
+        # HTTP status and headers of the failed response (None for non-HTTP errors)
+        self.status = getattr(exception, "status", None)
+        self.headers = getattr(exception, "headers", None)
@@ -0,0 +1,137 @@
+"""Module for the manifest of the built classifier data sets: the data set,
+class and icon of every app, so that a rebuild only handles the apps
+added, changed or removed since."""
+
+import os
+import pathlib
+import dataclasses
+from typing import Optional
+import pandas as pd
+from betel import info_files_helpers
+
+# the icon's size and modification time tell whether it changed since it
+# was built, without reading it
+MANIFEST_COLUMNS = ["app_id", "data_set", "category", "content_hash", "icon_size",
+                    "icon_mtime_ns", "perceptual_hash"]
+_STAT_COLUMNS = ["icon_size", "icon_mtime_ns"]
+# the perceptual hash of a built icon ("<hash function>:<hex hash>"), when
+# known, matches the icons added later with their near duplicates
+PERCEPTUAL_HASH_COLUMN = "perceptual_hash"
+EXCLUDED = ""  # data set of the apps left out of the data sets (e.g. duplicates)
+_REMOVED = "removed"  # data set of the rows recording the removal of an app
+
+
+class BuildManifest:
+    """A CSV file listing the apps of the built data sets.
+
+    Updates append the rows of the changed apps (the last row of an app
+    wins), so that their cost doesn't depend on the number of apps; the
+    file is rewritten once most of its rows are outdated.
+    """
+
+    def __init__(self, file: pathlib.Path):
+        """Constructor.
+
+        :param file: the manifest file
+        """
+        self._file = file
+        self._rows_no: Optional[int] = None  # rows of the file, once loaded
+
+    def exists(self) -> bool:
+        """Whether the manifest was saved by a previous build."""
+        return self._file.exists()
+
+    def load(self) -> pd.DataFrame:
+        """Reads the manifest.
+
+        :return: the apps, with the MANIFEST_COLUMNS
+        """
+        rows = pd.read_csv(self._file, keep_default_na=False,
+                           dtype={column: str for column in MANIFEST_COLUMNS
+                                  if column not in _STAT_COLUMNS})
+        self._rows_no = len(rows)
+
+        if PERCEPTUAL_HASH_COLUMN not in rows:
+            # manifest of a previous version, rewritten by the next update
+            rows[PERCEPTUAL_HASH_COLUMN] = ""
+            self._rows_no = None
+
+        apps = rows.drop_duplicates(subset="app_id", keep="last")
+        return apps[apps["data_set"] != _REMOVED].reset_index(drop=True)
+
+    def discard(self) -> None:
+        """Deletes the manifest (e.g. when the data sets are built without
+        it), so that the next update rebuilds it."""
+        self._file.unlink(missing_ok=True)
+
+    def save(self, apps: pd.DataFrame) -> None:
+        """Replaces the manifest (written aside and renamed, so that a
+        crash never leaves it half written).
+
+        :param apps: the apps, with the MANIFEST_COLUMNS
+        """
+        temporary_file = self._file.with_name(f".{self._file.name}.{os.getpid()}")
+        apps[MANIFEST_COLUMNS].to_csv(temporary_file, index=False)
+        os.replace(temporary_file, self._file)
+        self._rows_no = len(apps)
+
+    def update(self, apps: pd.DataFrame, changed_app_ids: pd.Series) -> None:
+        """Records the changes of a build.
+
+        :param apps: all the apps after the build, with the MANIFEST_COLUMNS
+        :param changed_app_ids: the ids of the apps added, updated or
+        removed by the build
+        """
+        changed_apps = apps[apps["app_id"].isin(changed_app_ids)]
+        removed_app_ids = changed_app_ids[~changed_app_ids.isin(apps["app_id"])]
+        rows = pd.concat([changed_apps[MANIFEST_COLUMNS],
+                          pd.DataFrame({"app_id": removed_app_ids, "data_set": _REMOVED,
+                                        "category": "", "content_hash": "", "icon_size": 0,
+                                        "icon_mtime_ns": 0, PERCEPTUAL_HASH_COLUMN: ""})])
+
+        if self._rows_no is None or self._rows_no + len(rows) > 2 * len(apps):
+            self.save(apps)
+        elif not rows.empty:
+            info_files_helpers.add_to_data(self._file, rows)
+            self._rows_no += len(rows)
+
+
+@dataclasses.dataclass
+class ManifestDiff:
+    """The apps changed since the last build."""
+
+    added: pd.DataFrame  # the current apps (category and icon stats) not built yet
+    removed: pd.DataFrame  # the built apps (manifest rows) not found anymore
+    # the built apps whose class or icon changed: their manifest rows
+    # with the current category and icon stats
+    updated: pd.DataFrame
+    previous_categories: pd.Series  # the built category of the updated apps
+
+
+def diff(built_apps: pd.DataFrame, current_apps: pd.DataFrame) -> ManifestDiff:
+    """Compares the built apps with the current ones.
+
+    :param built_apps: the apps of the manifest
+    :param current_apps: the current apps (app_id, category, icon_size and
+    icon_mtime_ns columns)
+    :return: the added, removed and updated apps
+    """
+    both = built_apps.merge(current_apps, on="app_id", suffixes=("", "_current"))
+
+    changed = (both["category"] != both["category_current"]) | \
+        (both["icon_size"] != both["icon_size_current"]) | \
+        (both["icon_mtime_ns"] != both["icon_mtime_ns_current"])
+    updated = both[changed]
+
+    return ManifestDiff(
+        added=current_apps[~current_apps["app_id"].isin(built_apps["app_id"])],
+        removed=built_apps[~built_apps["app_id"].isin(current_apps["app_id"])],
+        updated=pd.DataFrame({
+            "app_id": updated["app_id"],
+            "data_set": updated["data_set"],
+            "category": updated["category_current"],
+            "content_hash": updated["content_hash"],
+            **{column: updated[f"{column}_current"] for column in _STAT_COLUMNS}
+        }).reset_index(drop=True),
+        previous_categories=updated["category"].reset_index(drop=True)
+    )
@@ -1,10 +1,19 @@
-import shutil
+import os
+import logging
 import pathlib
-from typing import List, Optional
+from concurrent import futures
+from typing import Dict, List, Optional, Set, Tuple
+import numpy as np
 import pandas as pd
 from betel import utils
 from betel import info_files_helpers
+from betel import icon_store
 from betel import data_set_builder
+from betel import near_duplicates
+from betel import build_manifest
+
+# the data set of the placed near duplicates of an app ("" if none)
+_JOINED_DATA_SET_COLUMN = "joined_data_set"
 
 
 class ClassifierDataSetBuilder(data_set_builder.DataSetBuilder):
@@ -12,7 +21,10 @@ class ClassifierDataSetBuilder(data_set_builder.DataSetBuilder):
 
     def __init__(self, input_dir: pathlib.Path, storage_dir: pathlib.Path,
                  split_ratio: (float, float, float) = (0.7, 0.15, 0.15),
-                 classes: Optional[List[str]] = None):
+                 classes: Optional[List[str]] = None, bulk: bool = False,
+                 num_threads: int = 16, near_duplicate_distance: Optional[int] = None,
+                 deduplicate: bool = False, hash_function: str = "dhash",
+                 split_method: str = "shuffle", stratify: bool = False):
         """Constructor.
 
         :param input_dir: data to be split (output of the scraper,
@@ -23,8 +35,22 @@ class ClassifierDataSetBuilder(data_set_builder.DataSetBuilder):
         :param classes: the classes desired for the classifier (should be
         Google Play Store categories); default: all categories found in
         the input data
+        :param bulk: whether every data set is built with DataFrame-wide
+        operations (instead of row by row)
+        :param num_threads: number of threads adding the icons to the data
+        sets (in bulk mode) and hashing the icons
+        :param near_duplicate_distance: the maximum number of different
+        bits of the perceptual hashes of near-duplicate icons, which are
+        then kept in the same data set; None: no near-duplicate detection
+        :param deduplicate: whether only one app of every group of near
+        duplicates (the smallest app id) is kept
+        :param hash_function: the perceptual hash of the icons ("dhash" or
+        "phash")
+        :param split_method: "shuffle" or "hash" (see DataSetBuilder)
+        :param stratify: whether the hash split is stratified by class
+        (after the categories outside the classes become "others")
         """
-        super().__init__(input_dir, storage_dir, split_ratio)
+        super().__init__(input_dir, storage_dir, split_ratio, split_method, stratify)
 
         # directory to store the info about the split
         self._info_dir = storage_dir / utils.CLASSIFIER_DATA_BUILDER_INFO_DIR
@@ -32,6 +58,347 @@ class ClassifierDataSetBuilder(data_set_builder.DataSetBuilder):
 
         self._classes = classes
 
+        # indexes of the apps already present in every category info file
+        self._info_indexes: Dict[str, info_files_helpers.InfoFileIndex] = {}
+        self._info_writers: Dict[str, info_files_helpers.BufferedInfoWriter] = {}
+
+        # every distinct icon is stored once and linked into the data sets
+        icon_store_dir = storage_dir / utils.CLASSIFIER_DATA_BUILDER_ICON_STORE_DIR
+        self._icon_store = icon_store.IconStore(icon_store_dir)
+        self._duplicate_icons = 0
+
+        self._bulk = bulk
+        self._num_threads = num_threads
+        self._input_icons: Optional[Set[str]] = None
+
+        self._near_duplicate_distance = near_duplicate_distance
+        self._deduplicate = deduplicate
+        self._hash_function = hash_function
+
+        self._manifest = build_manifest.BuildManifest(
+            storage_dir / utils.CLASSIFIER_DATA_BUILDER_MANIFEST_FILE_NAME)
+
+    def split_and_build_data_sets(self) -> None:
+        # the manifest doesn't follow full builds
+        self._manifest.discard()
+        super().split_and_build_data_sets()
+
+    def update_data_sets(self) -> Dict[str, int]:
+        """Brings the data sets up to date with the scraper output by only
+        handling the apps added, changed or removed since the last update,
+        as recorded in the build manifest: new apps are split and added,
+        apps whose class changed are moved (within their data set), apps
+        whose icon changed are relinked and apps no longer scraped (or
+        without icon) are removed, with their info rows.
+
+        The first update of data sets built without manifest relinks their
+        icons once to fill it. With near-duplicate detection, the new apps
+        are also compared with the built icons (whose perceptual hashes are
+        recorded in the manifest, computed once from the built icons): the
+        near duplicates of a built icon join its data set (or are left out,
+        when deduplicating).
+
+        :return: the numbers of added, updated and removed apps
+        """
+        built_apps = self._manifest.load() if self._manifest.exists() else self._read_built_apps()
+        changes = build_manifest.diff(built_apps, self._list_current_apps())
+
+        # the removed apps and the moved ones are unlinked at once
+        moved = changes.updated["category"] != changes.previous_categories
+        self._remove_apps(pd.concat([
+            changes.removed,
+            changes.updated[moved].assign(category=changes.previous_categories[moved])
+        ]))
+        updated = self._update_apps(changes.updated, moved)
+
+        changed_app_ids = pd.concat([changes.removed["app_id"], changes.updated["app_id"]])
+        kept = pd.concat([built_apps[~built_apps["app_id"].isin(changed_app_ids)], updated])
+        hashed_app_ids = pd.Series(dtype=str)
+        if self._near_duplicate_distance is not None:
+            kept, hashed_app_ids = self._hash_built_icons(kept)
+        # the new apps are split against the built ones (e.g. for the ratios
+        # of the stratified hash split and the near duplicates)
+        added = self._add_apps(changes.added, kept)
+
+        self._manifest.update(pd.concat([kept, added]),
+                              pd.concat([changed_app_ids, hashed_app_ids, added["app_id"]]))
+        # the blobs of the removed and replaced icons, unless still used
+        self._icon_store.release(pd.concat([changes.removed["content_hash"],
+                                            changes.updated["content_hash"]]))
+
+        logging.info("%d apps added, %d updated, %d removed",
+                     len(added), len(updated), len(changes.removed))
+        return {"added": len(added), "updated": len(updated), "removed": len(changes.removed)}
+
+    def _list_current_apps(self) -> pd.DataFrame:
+        apps = info_files_helpers.read_csv_file(self._input_file)
+        apps = apps[["app_id", "category"]].astype(str).drop_duplicates(subset="app_id")
+
+        if self._classes is not None:
+            in_classes = apps["category"].isin(self._classes)
+            apps = apps.assign(category=apps["category"].where(in_classes, "others"))
+
+        # a single listing of the input directory gives the stats of all the icons
+        icon_names, icon_sizes, icon_mtimes = [], [], []
+        with os.scandir(self._input_dir) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    icon_names.append(entry.name)
+                    icon_sizes.append(stat.st_size)
+                    icon_mtimes.append(stat.st_mtime_ns)
+
+        icon_stats = pd.DataFrame({"icon_size": icon_sizes, "icon_mtime_ns": icon_mtimes},
+                                  index=icon_names, dtype="int64")
+        icon_names = apps["app_id"].map(utils.get_app_icon_name)
+        apps = apps[icon_names.isin(icon_stats.index)]
+        return apps.join(icon_stats, on=icon_names[apps.index])
+
+    def _read_built_apps(self) -> pd.DataFrame:
+        # without manifest, the built apps are read from the info files, with
+        # unknown icons
+        info_files = [info_file for info_file in self._info_dir.iterdir()
+                      if not info_file.name.startswith(".")]
+        built_apps = [info_files_helpers.read_csv_file(info_file).astype(str)
+                      .assign(category=info_file.name) for info_file in info_files]
+        built_apps = pd.concat(
+            [pd.DataFrame(columns=["app_id", "data_set", "category"])] + built_apps
+        ).drop_duplicates(subset="app_id")
+        return built_apps.assign(content_hash="", icon_size=-1, icon_mtime_ns=-1,
+                                 **{build_manifest.PERCEPTUAL_HASH_COLUMN: ""})
+
+    def _remove_apps(self, apps: pd.DataFrame) -> None:
+        apps = apps[apps["data_set"] != build_manifest.EXCLUDED]
+        for data_set, category, icon_name in zip(apps["data_set"], apps["category"],
+                                                 apps["app_id"].map(utils.get_app_icon_name)):
+            (self._storage_dir / data_set / category / icon_name).unlink(missing_ok=True)
+
+        self._remove_info_rows(apps["app_id"], apps["category"])
+
+    def _update_apps(self, apps: pd.DataFrame, moved: pd.Series) -> pd.DataFrame:
+        built = apps["data_set"] != build_manifest.EXCLUDED
+        icon_names = apps["app_id"].map(utils.get_app_icon_name)
+
+        content_hashes = self._add_icons_to_data_set(
+            [(self._input_dir / icon_name, self._storage_dir / data_set / category / icon_name)
+             for data_set, category, icon_name in zip(apps.loc[built, "data_set"],
+                                                      apps.loc[built, "category"],
+                                                      icon_names[built])]
+        )
+        self._add_info_rows(apps[built & moved])
+
+        # the perceptual hashes of the new icons are computed when needed
+        apps = apps.assign(**{build_manifest.PERCEPTUAL_HASH_COLUMN: ""})
+        apps.loc[built, "content_hash"] = content_hashes
+        return apps
+
+    def _hash_built_icons(self, apps: pd.DataFrame) -> Tuple[pd.DataFrame, pd.Series]:
+        # the built icons without perceptual hash (of the hash function)
+        # are hashed from the data sets
+        unhashed = (apps["data_set"] != build_manifest.EXCLUDED) & \
+            ~self._is_hashed(apps[build_manifest.PERCEPTUAL_HASH_COLUMN])
+        if not unhashed.any():
+            return apps, pd.Series(dtype=str)
+
+        hashes = near_duplicates.hash_icons(
+            [self._storage_dir / data_set / category / utils.get_app_icon_name(app_id)
+             for app_id, data_set, category in zip(apps.loc[unhashed, "app_id"],
+                                                   apps.loc[unhashed, "data_set"],
+                                                   apps.loc[unhashed, "category"])],
+            self._hash_function, self._num_threads
+        )
+        apps = apps.copy()
+        apps.loc[unhashed, build_manifest.PERCEPTUAL_HASH_COLUMN] = \
+            self._format_perceptual_hashes(hashes)
+        return apps, apps.loc[unhashed, "app_id"]
+
+    def _is_hashed(self, perceptual_hashes: pd.Series) -> pd.Series:
+        # whether the recorded hashes are of the hash function
+        return perceptual_hashes.str.startswith(f"{self._hash_function}:")
+
+    def _format_perceptual_hashes(self, hashes: np.ndarray) -> List[str]:
+        return [f"{self._hash_function}:{perceptual_hash:016x}"
+                for perceptual_hash in hashes.tolist()]
+
+    def _parse_perceptual_hashes(self, perceptual_hashes: pd.Series) -> np.ndarray:
+        prefix_length = len(self._hash_function) + 1
+        return np.array([int(perceptual_hash[prefix_length:], 16)
+                         for perceptual_hash in perceptual_hashes], dtype=np.uint64)
+
+    def _add_apps(self, apps: pd.DataFrame, built_apps: pd.DataFrame) -> pd.DataFrame:
+        if apps.empty:
+            return apps.assign(data_set=build_manifest.EXCLUDED, content_hash="",
+                               **{build_manifest.PERCEPTUAL_HASH_COLUMN: ""})
+
+        added = []
+        for data_set, elements in self.split(apps, built_apps).items():
+            elements = elements.assign(data_set=data_set)
+            content_hashes = self._add_icons_to_data_set(
+                [(self._input_dir / icon_name, self._storage_dir / data_set / category / icon_name)
+                 for category, icon_name in zip(elements["category"],
+                                                elements["app_id"].map(utils.get_app_icon_name))]
+            )
+            self._add_info_rows(elements)
+            added.append(elements.assign(content_hash=content_hashes))
+
+        # the apps left out of the split (e.g. near duplicates) are recorded
+        # too, so that they are not added by the next update
+        excluded = apps[~apps["app_id"].isin(pd.concat([elements["app_id"]
+                                                        for elements in added]))]
+        added.append(excluded.assign(data_set=build_manifest.EXCLUDED, content_hash="",
+                                     **{build_manifest.PERCEPTUAL_HASH_COLUMN: ""}))
+        # the perceptual hashes are only computed with near-duplicate detection
+        return pd.concat(added).fillna({build_manifest.PERCEPTUAL_HASH_COLUMN: ""})
+
+    def _add_info_rows(self, apps: pd.DataFrame) -> None:
+        for category, category_apps in apps.groupby("category", sort=False):
+            info_files_helpers.add_to_data(self._info_dir / category,
+                                           category_apps[["app_id", "data_set"]])
+            self._info_indexes.pop(category, None)
+
+    def _remove_info_rows(self, app_ids: pd.Series, categories: pd.Series) -> None:
+        for category, category_app_ids in app_ids.groupby(categories.to_numpy(), sort=False):
+            info_file = self._info_dir / category
+            if info_file.exists():
+                info_files_helpers.remove_from_data(info_file, category_app_ids)
+            self._info_indexes.pop(category, None)
+
+    def split(self, data: pd.DataFrame,
+              placed: Optional[pd.DataFrame] = None) -> Dict[str, pd.DataFrame]:
+        if self._near_duplicate_distance is None:
+            return super().split(data, placed)
+
+        data = self._group_near_duplicates(data, placed)
+
+        # the near duplicates of placed apps join their data sets, the
+        # other apps are split
+        joined = data[_JOINED_DATA_SET_COLUMN] != ""
+        split = super().split(data[~joined], placed)
+        if self._deduplicate or not joined.any():
+            return split
+
+        return {data_set: pd.concat([elements,
+                                     data[data[_JOINED_DATA_SET_COLUMN] == data_set]])
+                for data_set, elements in split.items()}
+
+    def _group_near_duplicates(self, data: pd.DataFrame,
+                               placed: Optional[pd.DataFrame]) -> pd.DataFrame:
+        icon_names = data["app_id"].map(utils.get_app_icon_name)
+        apps = data.loc[icon_names.isin(self._get_input_icons()), "app_id"].drop_duplicates()
+        app_ids = apps.to_numpy(dtype=str)
+
+        hashes = near_duplicates.hash_icons(
+            [self._input_dir / utils.get_app_icon_name(app_id) for app_id in app_ids],
+            self._hash_function, self._num_threads
+        )
+
+        # the placed apps with a perceptual hash are grouped with the new ones
+        placed_apps = pd.DataFrame({"app_id": [], "data_set": []}, dtype=str)
+        if placed is not None and build_manifest.PERCEPTUAL_HASH_COLUMN in placed:
+            placed_apps = placed[(placed["data_set"] != build_manifest.EXCLUDED) &
+                                 ~placed["app_id"].isin(app_ids) &
+                                 self._is_hashed(placed[build_manifest.PERCEPTUAL_HASH_COLUMN])]
+        placed_hashes = self._parse_perceptual_hashes(
+            placed_apps.get(build_manifest.PERCEPTUAL_HASH_COLUMN, []))
+
+        groups = near_duplicates.find_duplicate_groups(np.concatenate([hashes, placed_hashes]),
+                                                       self._near_duplicate_distance)
+        app_groups, placed_groups = groups[:len(app_ids)], groups[len(app_ids):]
+        representatives = pd.Series(near_duplicates.get_group_representatives(app_groups,
+                                                                              app_ids),
+                                    index=app_ids)
+
+        # a group with placed apps goes to the data set of the smallest one
+        group_data_sets = placed_apps[["app_id", "data_set"]].assign(group=placed_groups) \
+            .sort_values("app_id").drop_duplicates(subset="group").set_index("group")["data_set"]
+        joined_data_sets = pd.Series(app_groups, index=app_ids).map(group_data_sets)
+
+        duplicates = representatives[representatives != representatives.index]
+        logging.info("%d near duplicates of %d icons, in %d groups, and %d near duplicates "
+                     "of placed icons", len(duplicates), len(app_ids), duplicates.nunique(),
+                     joined_data_sets.notna().sum())
+
+        # the apps without icon (left out of the data sets) are groups of their own
+        data = data.assign(**{
+            data_set_builder.GROUP_COLUMN: data["app_id"].map(representatives).fillna(data["app_id"]),
+            _JOINED_DATA_SET_COLUMN: data["app_id"].map(joined_data_sets).fillna(""),
+            build_manifest.PERCEPTUAL_HASH_COLUMN: data["app_id"].map(pd.Series(
+                self._format_perceptual_hashes(hashes), index=app_ids, dtype=str)).fillna("")
+        })
+
+        if self._deduplicate:
+            data = data[data["app_id"] == data[data_set_builder.GROUP_COLUMN]]
+
+        return data
+
+    def _build_set(self, data_set: str, elements: pd.DataFrame) -> None:
+        if self._bulk:
+            self._build_set_in_bulk(data_set, elements)
+        else:
+            try:
+                super()._build_set(data_set, elements)
+            finally:
+                for info_writer in self._info_writers.values():
+                    info_writer.flush()
+
+        logging.info("%s: %d icons identical to already stored ones",
+                     data_set, self._duplicate_icons)
+        self._duplicate_icons = 0
+
+    def _build_set_in_bulk(self, data_set: str, elements: pd.DataFrame) -> None:
+        apps = elements[["app_id", "category"]].drop_duplicates(subset="app_id")
+
+        if self._classes is not None:
+            in_classes = apps["category"].isin(self._classes)
+            apps = apps.assign(category=apps["category"].where(in_classes, "others"))
+
+        icon_names = apps["app_id"].map(utils.get_app_icon_name)
+        apps = apps.assign(icon_name=icon_names)[icon_names.isin(self._get_input_icons())]
+
+        for category, category_apps in apps.groupby("category", sort=False):
+            info_index = self._get_info_index(category)
+            new_apps = category_apps[~info_index.isin(category_apps["app_id"])]
+
+            if new_apps.empty:
+                continue
+
+            directory = self._storage_dir / data_set / category
+            directory.mkdir(exist_ok=True, parents=True)
+            self._add_icons_to_data_set(
+                [(self._input_dir / icon_name, directory / icon_name)
+                 for icon_name in new_apps["icon_name"]]
+            )
+
+            # the info file is only updated once the icons are in place
+            app_info = pd.DataFrame({"app_id": new_apps["app_id"], "data_set": data_set})
+            info_files_helpers.add_to_data(self._info_dir / category, app_info)
+            info_index.update(new_apps["app_id"])
+
+    def _add_icons_to_data_set(self, icons: List[Tuple[pathlib.Path, pathlib.Path]]) -> List[str]:
+        def add_icon(icon: Tuple[pathlib.Path, pathlib.Path]) -> Tuple[str, bool]:
+            app_icon, destination = icon
+            content_hash, duplicate = self._icon_store.ingest(app_icon)
+            self._icon_store.link(content_hash, destination)
+            return content_hash, duplicate
+
+        with futures.ThreadPoolExecutor(self._num_threads) as executor:
+            added_icons = list(executor.map(add_icon, icons))
+
+        self._duplicate_icons += sum(duplicate for _, duplicate in added_icons)
+        return [content_hash for content_hash, _ in added_icons]
+
+    def _get_input_icons(self) -> Set[str]:
+        # a single listing of the input directory replaces a stat() per app
+        if self._input_icons is None:
+            self._input_icons = {entry.name for entry in os.scandir(self._input_dir)
+                                 if entry.is_file()}
+        return self._input_icons
+
+    def _get_strata(self, app_list: pd.DataFrame) -> Optional[pd.Series]:
+        if self._classes is None:
+            return app_list["category"]
+        return app_list["category"].where(app_list["category"].isin(self._classes), "others")
+
     def _sort(self, app_list: pd.DataFrame) -> pd.DataFrame:
         return app_list.sort_values(by=["app_id"])
 
@@ -42,28 +409,32 @@ class ClassifierDataSetBuilder(data_set_builder.DataSetBuilder):
         if self._classes is not None:
             category = category if category in self._classes else "others"
 
-        info_file = self._info_dir / category
         icon_name = utils.get_app_icon_name(app_id)
         app_icon = self._input_dir / icon_name
 
-        search_data_frame = utils.get_app_search_data_frame(app_id)
-        part_of_data = (
-            info_files_helpers.part_of_data_set(info_file, search_data_frame)
-        )
+        info_index = self._get_info_index(category)
 
-        if not part_of_data and app_icon.exists():
-            app_info = _build_app_info_data_frame(app_id, data_set)
-            info_files_helpers.add_to_data(info_file, app_info)
+        if app_id not in info_index and app_icon.exists():
+            self._get_info_writer(category).add({"app_id": app_id, "data_set": data_set})
+            info_index.add(app_id)
 
             directory = self._storage_dir / data_set / category
-            _add_icon_to_data_set(app_icon, icon_name, directory)
-
+            self._add_icon_to_data_set(app_icon, icon_name, directory)
 
-def _build_app_info_data_frame(app_id: str, data_set: str) -> pd.DataFrame:
-    dictionary = {"app_id": app_id, "data_set": data_set}
-    return pd.DataFrame([dictionary])
+    def _add_icon_to_data_set(self, app_icon: pathlib.Path, icon_name: str,
+                              directory: pathlib.Path) -> None:
+        content_hash, duplicate = self._icon_store.ingest(app_icon)
+        self._duplicate_icons += duplicate
+        self._icon_store.link(content_hash, directory / icon_name)
 
+    def _get_info_index(self, category: str) -> info_files_helpers.InfoFileIndex:
+        if category not in self._info_indexes:
+            info_file = self._info_dir / category
+            self._info_indexes[category] = info_files_helpers.InfoFileIndex(info_file)
+        return self._info_indexes[category]
 
-def _add_icon_to_data_set(app_icon: pathlib.Path, icon_name: str, directory: pathlib.Path) -> None:
-    directory.mkdir(exist_ok=True, parents=True)
-    shutil.copy(app_icon, directory / icon_name)
+    def _get_info_writer(self, category: str) -> info_files_helpers.BufferedInfoWriter:
+        if category not in self._info_writers:
+            info_file = self._info_dir / category
+            self._info_writers[category] = info_files_helpers.BufferedInfoWriter(info_file)
+        return self._info_writers[category]
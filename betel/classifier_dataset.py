@@ -0,0 +1,94 @@
+"""tf.data input pipeline over the data set directories, an alternative
+to ClassifierSequence which decodes, caches and prefetches the icons in
+the TensorFlow runtime (outside the GIL)."""
+
+import pathlib
+from typing import Optional
+import tensorflow as tf
+from betel import classifier_sequence
+
+
+def build_dataset(input_dir: pathlib.Path, batch_size: int, target_img_dim: int,
+                  shuffle: bool = True, cache: Optional[str] = None,
+                  num_parallel_calls: int = tf.data.AUTOTUNE, num_shards: int = 1,
+                  shard_index: int = 0, shuffle_buffer: int = 10000) -> tf.data.Dataset:
+    """Builds a dataset of (uint8 icons, category ids) batches.
+
+    The icons, categories and batches are the same as those of a
+    ClassifierSequence over the same directory (without shuffling):
+    icons are listed in the same order, padded or cropped around their
+    center to the target dimension, and the last batch is completed with
+    the first icons.
+
+    :param input_dir: directory with input data
+    :param batch_size: the desired size of a batch
+    :param target_img_dim: target dimension (for square icons)
+    :param shuffle: whether the icons are shuffled on every epoch or not
+    :param cache: file caching the decoded icons after the first epoch
+    ("" caches them in memory; None disables caching)
+    :param num_parallel_calls: number of icons decoded in parallel
+    :param num_shards: number of shards the icons are split into (e.g.
+    one per worker of distributed training)
+    :param shard_index: the shard of icons in the dataset
+    :param shuffle_buffer: number of cached icons the shuffling picks from
+    (without cache, the file names are shuffled before decoding instead)
+    :return: the dataset
+    """
+    if not input_dir.exists():
+        raise ValueError(f"Input directory does not exist: {input_dir}.")
+
+    categories, app_icons = classifier_sequence.list_icons(input_dir)
+    category_name_to_id = {name: category_id for category_id, name in enumerate(categories)}
+
+    if num_shards > 1:
+        app_icons = classifier_sequence.shard_icons(app_icons, num_shards, shard_index)
+
+    # every batch is full, as in ClassifierSequence
+    icons_no = -len(app_icons) % batch_size + len(app_icons)
+    app_icons = [app_icons[index % len(app_icons)] for index in range(icons_no)]
+
+    files = [str(input_dir / category / icon_name) for icon_name, category in app_icons]
+    labels = [category_name_to_id[category] for _, category in app_icons]
+
+    dataset = tf.data.Dataset.from_tensor_slices((files, tf.constant(labels, tf.int64)))
+
+    if shuffle:
+        # the file names are shuffled, not the decoded icons, so that the
+        # first batch doesn't wait for the whole data set to be decoded; a
+        # cache replays the order of its first epoch, which is then mixed
+        # within a bounded buffer
+        dataset = dataset.shuffle(len(files), reshuffle_each_iteration=cache is None)
+
+    dataset = dataset.map(lambda file, label: (_load_icon(file, target_img_dim), label),
+                          num_parallel_calls=num_parallel_calls)
+
+    if cache is not None:
+        dataset = dataset.cache(cache)
+        if shuffle:
+            dataset = dataset.shuffle(shuffle_buffer, reshuffle_each_iteration=True)
+
+    return dataset.batch(batch_size, drop_remainder=True).prefetch(tf.data.AUTOTUNE)
+
+
+def _load_icon(file: tf.Tensor, target_img_dim: int) -> tf.Tensor:
+    icon = tf.io.decode_image(tf.io.read_file(file), channels=3, expand_animations=False)
+    return resize_icon(icon, target_img_dim)
+
+
+def resize_icon(icon: tf.Tensor, target_img_dim: int) -> tf.Tensor:
+    """Pads (with black) or crops an icon around its center to the target
+    dimension, like ClassifierSequence.
+
+    :param icon: the icon, as a (height, width, channels) tensor
+    :param target_img_dim: target dimension (for square icons)
+    :return: the resized icon
+    """
+    border = (target_img_dim - tf.shape(icon)[:2]) // 2
+    start = tf.maximum(-border, 0)
+    before = tf.maximum(border, 0)
+
+    icon = icon[start[0]:start[0] + target_img_dim, start[1]:start[1] + target_img_dim]
+    after = target_img_dim - before - tf.shape(icon)[:2]
+
+    icon = tf.pad(icon, [[before[0], after[0]], [before[1], after[1]], [0, 0]])
+    return tf.ensure_shape(icon, [target_img_dim, target_img_dim, 3])
@@ -1,23 +1,42 @@
 import pathlib
 import math
-from typing import Dict, Tuple, List
+import itertools
+from concurrent import futures
+from typing import Dict, Iterable, Tuple, List, Optional
 import numpy as np
 from tensorflow import keras
 from PIL import Image, ImageOps
+from betel import icon_tensor_cache
 
 
 class ClassifierSequence(keras.utils.Sequence):
     """A class for sequencing the classifier's input data."""
 
     def __init__(self, input_dir: pathlib.Path, batch_size: int,
-                 target_img_dim: int, shuffle: bool = True):
+                 target_img_dim: int, shuffle: bool = True,
+                 num_threads: int = 0, prefetch_batches: int = 0,
+                 cache_dir: Optional[pathlib.Path] = None,
+                 num_shards: int = 1, shard_index: int = 0):
         """Constructor.
 
         :param input_dir: directory with input data
         :param batch_size: the desired size of a batch
         :param target_img_dim: target dimension (for square icons)
         :param shuffle: whether the input data is shuffled on epoch end or not.
+        :param num_threads: number of threads decoding the icons of a batch
+        in parallel (into uint8 batches); 0 decodes them one at a time
+        :param prefetch_batches: number of following batches decoded in
+        the background (when num_threads > 0); the batches are expected to
+        be requested in order (e.g. fit(..., shuffle=False))
+        :param cache_dir: directory of a cache of the preprocessed (uint8)
+        icons, built on first use and rebuilt when the input files change;
+        batches are then read from the cache instead of decoding the icons
+        :param num_shards: number of shards the icons are split into (e.g.
+        one per worker of distributed training)
+        :param shard_index: the shard of icons sequenced
         """
+        super().__init__()
+
         if not input_dir.exists():
             raise ValueError(f"Input directory does not exist: {input_dir}.")
 
@@ -28,17 +47,38 @@ class ClassifierSequence(keras.utils.Sequence):
         self._target_icon_size = (target_img_dim, target_img_dim)
 
         categories = self._get_categories()
+        if num_shards > 1:
+            self._app_icons = shard_icons(self._app_icons, num_shards, shard_index)
 
         self.category_id_to_name: Dict[int, str] = dict(enumerate(categories))
         self.category_name_to_id: Dict[str, int] = {y: x for x, y in enumerate(categories)}
 
+        self._executor = futures.ThreadPoolExecutor(num_threads) if num_threads > 0 else None
+        self._prefetch_batches = prefetch_batches
+        self._pending_batches: Dict[int, Tuple[np.ndarray, np.ndarray, List[futures.Future]]] = {}
+
+        self._tensor_cache = None
+        if cache_dir is not None:
+            self._tensor_cache = self._open_tensor_cache(cache_dir)
+            self._cache_positions = {icon: position
+                                     for position, icon in enumerate(self._app_icons)}
+
     def __len__(self) -> int:
         return math.ceil(len(self._app_icons) / self._batch_size)
 
+    @property
+    def icons_no(self) -> int:
+        """The number of icons (without those completing the last batch)."""
+        return len(self._app_icons)
+
     def __getitem__(self, idx: int) -> Tuple[np.ndarray, np.ndarray]:
-        batch_app_icons = self._app_icons[idx * self._batch_size: (idx + 1) * self._batch_size]
+        if self._tensor_cache is not None:
+            return self._get_cached_batch(idx)
+
+        if self._executor is not None:
+            return self._get_batch_in_parallel(idx)
 
-        batch_app_icons = self._fit_to_batch_size(batch_app_icons)
+        batch_app_icons = self._get_batch_app_icons(idx)
 
         batch_x = []
         batch_y = []
@@ -55,6 +95,96 @@ class ClassifierSequence(keras.utils.Sequence):
         """Shuffle data after each epoch."""
         if self._shuffle:
             np.random.shuffle(self._app_icons)
+            self._discard_pending_batches()
+
+    def _get_batch_app_icons(self, idx: int) -> List:
+        batch_app_icons = self._app_icons[idx * self._batch_size: (idx + 1) * self._batch_size]
+        return self._fit_to_batch_size(batch_app_icons)
+
+    def _get_cached_batch(self, idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        positions = np.array([self._cache_positions[icon]
+                              for icon in self._get_batch_app_icons(idx)])
+        return self._tensor_cache.get_batch(positions), self._tensor_cache.labels[positions]
+
+    def _open_tensor_cache(self, cache_dir: pathlib.Path) -> icon_tensor_cache.IconTensorCache:
+        # the cache keeps the icons in listing order (before any shuffle)
+        tensor_cache = icon_tensor_cache.IconTensorCache(cache_dir)
+        fingerprint = self._compute_fingerprint()
+
+        if not tensor_cache.is_valid(fingerprint):
+            labels = np.array([self.category_name_to_id[category]
+                               for _, category in self._app_icons])
+            tensor_cache.build(fingerprint, labels, (*self._target_icon_size, 3),
+                               self._load_icons_into)
+
+        tensor_cache.open()
+        return tensor_cache
+
+    def _compute_fingerprint(self) -> str:
+        return icon_tensor_cache.compute_fingerprint(
+            self._input_dir,
+            [f"{category}/{icon_name}" for icon_name, category in self._app_icons],
+            self._target_icon_size,
+            self.category_id_to_name
+        )
+
+    def _load_icons_into(self, icons: np.ndarray, positions: range) -> None:
+        app_icons = self._app_icons[positions.start:positions.stop]
+        icon_names = [icon_name for icon_name, _ in app_icons]
+        categories = [category for _, category in app_icons]
+
+        if self._executor is None:
+            for position, (icon_name, category) in enumerate(app_icons):
+                self._load_icon_into(icons, position, icon_name, category)
+        else:
+            list(self._executor.map(self._load_icon_into, itertools.repeat(icons),
+                                    range(len(app_icons)), icon_names, categories))
+
+    def _get_batch_in_parallel(self, idx: int) -> Tuple[np.ndarray, np.ndarray]:
+        if idx not in self._pending_batches:
+            self._submit_batch(idx)
+
+        # batches prefetched for another order of requests (e.g. shuffled
+        # batch indices) are dropped, so that at most prefetch_batches
+        # batches are held besides the requested one
+        next_idxs = range(idx + 1, min(idx + 1 + self._prefetch_batches, len(self)))
+        self._discard_pending_batches(keep=[idx, *next_idxs])
+
+        for next_idx in next_idxs:
+            if next_idx not in self._pending_batches:
+                self._submit_batch(next_idx)
+
+        batch_x, batch_y, icon_futures = self._pending_batches.pop(idx)
+        for icon_future in icon_futures:
+            icon_future.result()
+
+        return batch_x, batch_y
+
+    def _submit_batch(self, idx: int) -> None:
+        batch_app_icons = self._get_batch_app_icons(idx)
+
+        # every icon is decoded straight into its slot of the batch
+        batch_x = np.empty((self._batch_size, *self._target_icon_size, 3), dtype=np.uint8)
+        batch_y = np.array([self.category_name_to_id[category]
+                            for _, category in batch_app_icons])
+
+        icon_futures = [self._executor.submit(self._load_icon_into, batch_x, position,
+                                              icon_name, category)
+                        for position, (icon_name, category) in enumerate(batch_app_icons)]
+
+        self._pending_batches[idx] = (batch_x, batch_y, icon_futures)
+
+    def _discard_pending_batches(self, keep: Iterable[int] = ()) -> None:
+        keep = set(keep)
+        for idx in [idx for idx in self._pending_batches if idx not in keep]:
+            _, _, icon_futures = self._pending_batches.pop(idx)
+            for icon_future in icon_futures:
+                icon_future.cancel()
+
+    def _load_icon_into(self, batch_x: np.ndarray, position: int,
+                        icon_name: str, category: str) -> None:
+        batch_x[position] = load_icon(self._input_dir / category / icon_name,
+                                      self._target_icon_size)
 
     def _load_icon(self, icon_name: str, category: str) -> np.ndarray:
         icon = self._input_dir / category / icon_name
@@ -68,16 +198,9 @@ class ClassifierSequence(keras.utils.Sequence):
         return icon
 
     def _get_categories(self) -> List[str]:
-        categories = []
-        for category in self._input_dir.iterdir():
-            categories.append(category.name)
-            self._add_icons(category)
+        categories, self._app_icons = list_icons(self._input_dir)
         return categories
 
-    def _add_icons(self, category: pathlib.Path) -> None:
-        icons = [(icon.name, category.name) for icon in category.iterdir()]
-        self._app_icons.extend(icons)
-
     def _fit_to_batch_size(self, batch: List) -> List:
         while self._batch_size != len(batch):
             missing_items_no = self._batch_size - len(batch)
@@ -85,13 +208,66 @@ class ClassifierSequence(keras.utils.Sequence):
         return batch
 
     def _resize_input(self, img: Image) -> Image:
-        border = tuple(np.floor_divide(np.subtract(self._target_icon_size, img.size), 2))
+        return resize_icon(img, self._target_icon_size)
 
-        if all(size > 0 for size in border):
-            resized_icon = ImageOps.expand(img, border=border, fill="black")
-        else:
-            resized_icon = img.crop((-border[0],
-                                     -border[1],
-                                     -border[0] + self._target_icon_size[0],
-                                     -border[1] + self._target_icon_size[1]))
-        return resized_icon
+
+def list_icons(input_dir: pathlib.Path) -> Tuple[List[str], List[Tuple[str, str]]]:
+    """Lists the categories and icons of a data set directory (one
+    subdirectory per category).
+
+    :param input_dir: directory with input data
+    :return: the category names and the (icon name, category) pairs, in
+    directory listing order
+    """
+    categories = []
+    app_icons = []
+    for category in input_dir.iterdir():
+        categories.append(category.name)
+        app_icons.extend((icon.name, category.name) for icon in category.iterdir())
+    return categories, app_icons
+
+
+def shard_icons(app_icons: List, num_shards: int, shard_index: int) -> List:
+    """Takes one shard of the icons: every num_shards-th icon, from the
+    shard_index-th one. Shards missing an icon are completed with their
+    first one, so that all the shards have the same number of batches.
+
+    :param app_icons: the icons
+    :param num_shards: the number of shards
+    :param shard_index: the index of the shard
+    :return: the icons of the shard
+    """
+    shard = app_icons[shard_index::num_shards]
+    shard_size = math.ceil(len(app_icons) / num_shards)
+    return shard + shard[:shard_size - len(shard)]
+
+
+def load_icon(file: pathlib.Path, target_icon_size: Tuple[int, int]) -> np.ndarray:
+    """Decodes an icon into a uint8 RGB array of the target size.
+
+    :param file: the icon file
+    :param target_icon_size: target (width, height)
+    :return: the icon
+    """
+    with Image.open(file) as img:
+        return np.asarray(resize_icon(img.convert("RGB"), target_icon_size))
+
+
+def resize_icon(img: Image, target_icon_size: Tuple[int, int]) -> Image:
+    """Pads (with black) or crops an icon around its center to the target
+    size.
+
+    :param img: the icon
+    :param target_icon_size: target (width, height)
+    :return: the resized icon
+    """
+    border = tuple(np.floor_divide(np.subtract(target_icon_size, img.size), 2))
+
+    if all(size > 0 for size in border):
+        resized_icon = ImageOps.expand(img, border=border, fill="black")
+    else:
+        resized_icon = img.crop((-border[0],
+                                 -border[1],
+                                 -border[0] + target_icon_size[0],
+                                 -border[1] + target_icon_size[1]))
+    return resized_icon
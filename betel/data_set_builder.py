@@ -1,11 +1,16 @@
+import math
 import pathlib
 import abc
-from typing import Dict
+from typing import Dict, List, Optional, Tuple
+import numpy as np
 import pandas as pd
-from sklearn import model_selection
 from betel import utils
 from betel import info_files_helpers
 
+GROUP_COLUMN = "group"  # optional column of the groups kept in the same data set
+SPLIT_METHODS = ("shuffle", "hash")
+DATA_SETS = ("train", "validation", "test")
+
 
 class DataSetBuilder(metaclass=abc.ABCMeta):
     """A class for splitting data into train-validation-test sets."""
@@ -13,7 +18,8 @@ class DataSetBuilder(metaclass=abc.ABCMeta):
     _RANDOM_SEED = 2579  # seed for random splitting
 
     def __init__(self, input_dir: pathlib.Path, storage_dir: pathlib.Path,
-                 split_ratio: (float, float, float) = (0.7, 0.15, 0.15)):
+                 split_ratio: (float, float, float) = (0.7, 0.15, 0.15),
+                 split_method: str = "shuffle", stratify: bool = False):
         """"Constructor.
 
         :param input_dir: data to be split (output of the scraper,
@@ -21,7 +27,18 @@ class DataSetBuilder(metaclass=abc.ABCMeta):
         describing the whole data set)
         :param storage_dir: storage directory for split data sets
         :param split_ratio: the ratio for train-validation-test data sets
+        :param split_method: "shuffle" (the sorted data is shuffled and
+        cut at the ratios) or "hash" (every app, or group, is placed by a
+        seeded hash of its id, so that it keeps its data set whatever
+        data is added)
+        :param stratify: whether the hash split keeps the ratios within
+        every stratum (e.g. class): the apps of a stratum are taken in the
+        order of their hashes and each goes to the data set furthest below
+        its ratio (counting the apps placed by previous splits)
         """
+        if split_method not in SPLIT_METHODS:
+            raise ValueError(f"Unknown split method: {split_method}.")
+
         self._storage_dir = storage_dir
         self._storage_dir.mkdir(exist_ok=True, parents=True)
 
@@ -31,22 +48,39 @@ class DataSetBuilder(metaclass=abc.ABCMeta):
         normalised_split_ratio = tuple(elem / sum(split_ratio) for elem in split_ratio)
         self._train_ratio, self._val_ratio, self._test_ratio = normalised_split_ratio
 
-    def split(self, data: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        self._split_method = split_method
+        self._stratify = stratify
+
+    def split(self, data: pd.DataFrame,
+              placed: Optional[pd.DataFrame] = None) -> Dict[str, pd.DataFrame]:
         """Randomly splits a list of data into 3
-        (train-validation-test).
+        (train-validation-test). When the data has a GROUP_COLUMN, the
+        elements of a group (e.g. near-duplicate icons) land in the same
+        data set.
 
         :param data: the list to be split
+        :param placed: the elements already placed in the data sets (e.g.
+        by a previous build), with a "data_set" column; the stratified
+        hash split places the data so that the ratios hold for them all
         :return: the train-validation-test split in Dict format
         """
+        if self._split_method == "hash":
+            return self._split_by_hash(data, placed)
+
         app_list = self._sort(data)
         app_list = app_list.sample(frac=1, random_state=self._RANDOM_SEED)
 
+        if GROUP_COLUMN in app_list:
+            return self._split_by_group(app_list)
+
         normalised_test_ratio = self._test_ratio / (self._val_ratio + self._test_ratio)
 
-        train, rest = model_selection.train_test_split(app_list, train_size=self._train_ratio,
-                                                       shuffle=False)
-        validation, test = model_selection.train_test_split(rest, test_size=normalised_test_ratio,
-                                                            shuffle=False)
+        # cut as sklearn's train_test_split does, but accepting empty data sets
+        # (e.g. when an update adds a few apps)
+        train_size = math.floor(self._train_ratio * len(app_list))
+        train, rest = app_list.iloc[:train_size], app_list.iloc[train_size:]
+        validation_size = len(rest) - math.ceil(normalised_test_ratio * len(rest))
+        validation, test = rest.iloc[:validation_size], rest.iloc[validation_size:]
 
         split = {
             "train": train,
@@ -56,6 +90,108 @@ class DataSetBuilder(metaclass=abc.ABCMeta):
 
         return split
 
+    def _split_by_group(self, app_list: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+        # the groups, in (random) order of appearance, are laid end to end and
+        # every group goes to the data set its middle falls in
+        group_sizes = app_list.groupby(GROUP_COLUMN, sort=False).size()
+        group_middles = (group_sizes.cumsum() - group_sizes / 2) / len(app_list)
+
+        data_sets = pd.Series("test", index=group_sizes.index)
+        data_sets[group_middles < self._train_ratio + self._val_ratio] = "validation"
+        data_sets[group_middles < self._train_ratio] = "train"
+
+        app_data_sets = app_list[GROUP_COLUMN].map(data_sets)
+        return {data_set: app_list[app_data_sets == data_set]
+                for data_set in ("train", "validation", "test")}
+
+    def _split_by_hash(self, app_list: pd.DataFrame,
+                       placed: Optional[pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+        # every key (app id or group) is placed at a position in [0, 1)
+        keys = app_list[GROUP_COLUMN] if GROUP_COLUMN in app_list else app_list["app_id"]
+        hashes = pd.util.hash_pandas_object(keys, index=False,
+                                            hash_key=f"{self._RANDOM_SEED:016d}").to_numpy()
+        positions = pd.Series((hashes >> np.uint64(11)) * 2.0 ** -53, index=app_list.index)
+
+        strata = self._get_strata(app_list) if self._stratify else None
+        if strata is not None:
+            data_sets = self._place_by_quotas(keys, positions, strata, placed)
+            return {data_set: app_list[data_sets == data_set] for data_set in DATA_SETS}
+
+        return {
+            "train": app_list[positions < self._train_ratio],
+            "validation": app_list[(positions >= self._train_ratio) &
+                                   (positions < self._train_ratio + self._val_ratio)],
+            "test": app_list[positions >= self._train_ratio + self._val_ratio]
+        }
+
+    def _place_by_quotas(self, keys: pd.Series, positions: pd.Series, strata: pd.Series,
+                         placed: Optional[pd.DataFrame]) -> np.ndarray:
+        # the keys of a stratum are taken in the order of their hashes, and
+        # every key goes to the data set furthest below its quota (counting
+        # the placed elements). Without groups, the numbers of elements of
+        # the data sets then only depend on the number of elements of the
+        # stratum, whether the data is split at once or in parts.
+        placed_counts = self._count_placed(placed)
+
+        units = pd.DataFrame({"key": keys.to_numpy(), "position": positions.to_numpy(),
+                              "stratum": strata.to_numpy(), "size": 1})
+        grouped = keys.duplicated().any()
+        if grouped:  # a group is in the stratum and at the position of its first element
+            units = units.groupby("key", sort=False) \
+                .agg(position=("position", "first"), stratum=("stratum", "first"),
+                     size=("size", "sum"))
+        units = units.sort_values("position", kind="stable")
+
+        unit_data_sets = np.empty(len(units), dtype=np.int64)
+        sizes = units["size"].to_numpy()
+        for stratum, stratum_units in units.groupby("stratum", sort=False).indices.items():
+            unit_data_sets[stratum_units] = self._fill_quotas(sizes[stratum_units],
+                                                              placed_counts.get(stratum, (0, 0, 0)))
+
+        unit_data_sets = np.array(DATA_SETS)[unit_data_sets]
+        if grouped:
+            return keys.map(pd.Series(unit_data_sets, index=units.index)).to_numpy()
+
+        data_sets = np.empty(len(units), dtype=unit_data_sets.dtype)
+        data_sets[units.index.to_numpy()] = unit_data_sets
+        return data_sets
+
+    def _fill_quotas(self, sizes: np.ndarray, counts: Tuple[int, int, int]) -> List[int]:
+        # unrolled over the 3 data sets, since it runs once per key
+        train_count, val_count, test_count = counts
+        total = train_count + val_count + test_count
+
+        data_sets = []
+        for size in sizes.tolist():
+            total += size
+            train_deficit = self._train_ratio * total - train_count
+            val_deficit = self._val_ratio * total - val_count
+            test_deficit = self._test_ratio * total - test_count
+
+            if train_deficit >= val_deficit and train_deficit >= test_deficit:
+                train_count += size
+                data_sets.append(0)
+            elif val_deficit >= test_deficit:
+                val_count += size
+                data_sets.append(1)
+            else:
+                test_count += size
+                data_sets.append(2)
+        return data_sets
+
+    def _count_placed(self, placed: Optional[pd.DataFrame]) -> Dict[str, Tuple[int, int, int]]:
+        if placed is None or placed.empty:
+            return {}
+        placed = placed[placed["data_set"].isin(DATA_SETS)]
+        counts = pd.crosstab(self._get_strata(placed), placed["data_set"]) \
+            .reindex(columns=list(DATA_SETS), fill_value=0)
+        return {stratum: tuple(row) for stratum, row in zip(counts.index, counts.to_numpy())}
+
+    def _get_strata(self, app_list: pd.DataFrame) -> Optional[pd.Series]:
+        """The stratum of every element of a list, for the stratified
+        split (None: not stratified)."""
+        return None
+
     def split_and_build_data_sets(self) -> None:
         """Splits the data into train-validation-test sets
         and builds the corresponding directory structures.
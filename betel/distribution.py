@@ -0,0 +1,215 @@
+"""Module for training on several (CPU) workers with
+MultiWorkerMirroredStrategy.
+
+Every worker runs the same program with its own TF_CONFIG environment
+variable describing the cluster and the worker's index, reads only its
+shard of the data sets and keeps its own replica of the model in sync
+with the others."""
+
+import os
+import sys
+import json
+import socket
+import subprocess
+from typing import Callable, Dict, List, Optional, Sequence
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+from tensorflow.keras.models import Model
+from betel import classifier_sequence
+
+
+def create_strategy() -> tf.distribute.Strategy:
+    """Creates the multi-worker strategy of the cluster in TF_CONFIG (to be
+    called before any other TensorFlow operation)."""
+    return tf.distribute.MultiWorkerMirroredStrategy()
+
+
+def get_worker_index() -> int:
+    """The index of this worker in the TF_CONFIG cluster (0 without
+    TF_CONFIG)."""
+    tf_config = json.loads(os.environ.get("TF_CONFIG", "{}"))
+    return tf_config.get("task", {}).get("index", 0)
+
+
+def is_chief() -> bool:
+    """Whether this worker is the one saving the model (the first one)."""
+    return get_worker_index() == 0
+
+
+def is_multi_worker(strategy: tf.distribute.Strategy) -> bool:
+    """Whether a strategy trains on several workers."""
+    return isinstance(strategy, tf.distribute.MultiWorkerMirroredStrategy)
+
+
+def distribute_input(strategy: tf.distribute.Strategy, global_batch_size: int,
+                     build_shard: Callable[[int, int, int], tf.data.Dataset]
+                     ) -> tf.distribute.DistributedDataset:
+    """Distributes a data set among the workers, every worker building
+    only its own shard of it.
+
+    :param strategy: the distribution strategy
+    :param global_batch_size: the batch size summed over all the workers
+    :param build_shard: function building the dataset of a shard, given
+    the per-worker batch size, the number of shards and the shard index;
+    all the shards must have the same number of batches
+    :return: the distributed dataset
+    """
+    def dataset_fn(input_context: tf.distribute.InputContext) -> tf.data.Dataset:
+        batch_size = input_context.get_per_replica_batch_size(global_batch_size)
+        return build_shard(batch_size, input_context.num_input_pipelines,
+                           input_context.input_pipeline_id)
+
+    return strategy.distribute_datasets_from_function(dataset_fn)
+
+
+def sequence_to_dataset(sequence: classifier_sequence.ClassifierSequence) -> tf.data.Dataset:
+    """Wraps a ClassifierSequence into a dataset (a new pass over the
+    sequence, shuffled if enabled, on every epoch).
+
+    :param sequence: the sequence
+    :return: the dataset of the sequence's batches
+    """
+    batch_x, batch_y = sequence[0]
+
+    def generate_batches():
+        for idx in range(len(sequence)):
+            yield sequence[idx]
+        sequence.on_epoch_end()
+
+    output_signature = (tf.TensorSpec((None, *batch_x.shape[1:]), batch_x.dtype),
+                        tf.TensorSpec((None,), np.asarray(batch_y).dtype))
+
+    return tf.data.Dataset.from_generator(generate_batches, output_signature=output_signature)
+
+
+def fit(model: Model, dataset: tf.distribute.DistributedDataset,
+        validation_data: Optional[tf.distribute.DistributedDataset] = None, epochs: int = 1,
+        initial_epoch: int = 0,
+        callbacks: Optional[List[keras.callbacks.Callback]] = None) -> keras.callbacks.History:
+    """Trains a model created and compiled under a multi-worker strategy,
+    like model.fit (whose metric reduction fails on several workers).
+
+    The model's train_step and test_step run on every replica (compiled
+    with XLA when the model was compiled with jit_compile, which needs
+    GPUs), and the
+    metrics are computed once per epoch from their variables summed over
+    the replicas (e.g. the counts of false positives of all the replicas,
+    or the pooled totals of a ratio).
+
+    :param model: the compiled model
+    :param dataset: the distributed training data
+    :param validation_data: the distributed validation data
+    :param epochs: the index of the last epoch
+    :param initial_epoch: the index of the first epoch
+    :param callbacks: the callbacks (called on every worker)
+    :return: the history of the epochs' metrics
+    """
+    if model.jit_compile and not tf.config.list_physical_devices("GPU"):
+        # the steps' gradients are all-reduced within the compiled step
+        raise ValueError("XLA compilation of multi-worker training needs GPUs (XLA has no "
+                         "collectives on CPUs): the model should not use jit_compile.")
+
+    strategy = model.distribute_strategy
+    with strategy.scope():
+        if not model.optimizer.built:
+            model.optimizer.build(model.trainable_variables)
+
+    def distribute_step(step: Callable) -> Callable:
+        # the step is XLA-compiled as in model.fit (e.g. with --jit_compile)
+        step = tf.function(step, jit_compile=model.jit_compile)
+
+        @tf.function
+        def distributed_step(data) -> None:
+            strategy.run(step, args=(data,))
+
+        return distributed_step
+
+    train_step = distribute_step(model.train_step)
+    test_step = distribute_step(model.test_step)
+
+    @tf.function
+    def get_metrics_result() -> Dict[str, tf.Tensor]:
+        # the metric variables are read (outside of the replicas) summed
+        # over all the replicas
+        return model.get_metrics_result()
+
+    def compute_logs() -> Dict[str, float]:
+        with strategy.scope():
+            return {name: float(value) for name, value in get_metrics_result().items()}
+
+    callback_list = keras.callbacks.CallbackList(callbacks, add_history=True, model=model)
+    model.stop_training = False
+    callback_list.on_train_begin()
+
+    for epoch in range(initial_epoch, epochs):
+        if model.stop_training:  # e.g. by early stopping
+            break
+
+        model.reset_metrics()
+        callback_list.on_epoch_begin(epoch)
+
+        for step, data in enumerate(dataset):
+            callback_list.on_train_batch_begin(step)
+            train_step(data)
+            callback_list.on_train_batch_end(step)
+
+        epoch_logs = compute_logs()
+
+        if validation_data is not None:
+            model.reset_metrics()
+            for data in validation_data:
+                test_step(data)
+            epoch_logs.update({f"val_{name}": value for name, value in compute_logs().items()})
+
+        callback_list.on_epoch_end(epoch, epoch_logs)
+
+    callback_list.on_train_end()
+    return model.history
+
+
+def get_free_ports(ports_no: int) -> List[int]:
+    """Finds free ports of localhost (for a local cluster)."""
+    sockets = [socket.socket() for _ in range(ports_no)]
+    try:
+        for sock in sockets:
+            sock.bind(("localhost", 0))
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+
+def build_tf_config(worker_addresses: Sequence[str], worker_index: int) -> str:
+    """Builds the TF_CONFIG of a worker of a cluster.
+
+    :param worker_addresses: the host:port address of every worker
+    :param worker_index: the worker's index (0 is the chief)
+    :return: the TF_CONFIG value
+    """
+    return json.dumps({
+        "cluster": {"worker": list(worker_addresses)},
+        "task": {"type": "worker", "index": worker_index}
+    })
+
+
+def launch_local_workers(workers_no: int, args: Sequence[str],
+                         env: dict = None) -> List[int]:
+    """Runs a Python program as a cluster of workers on localhost (e.g.
+    to try distributed training on one machine) and waits for them.
+
+    :param workers_no: the number of workers
+    :param args: the arguments of the Python interpreter (the program
+    and its arguments), the same for every worker
+    :param env: the environment of the workers (default: the current one)
+    :return: the exit codes of the workers
+    """
+    addresses = [f"localhost:{port}" for port in get_free_ports(workers_no)]
+    env = dict(os.environ if env is None else env)
+
+    processes = []
+    for worker_index in range(workers_no):
+        env["TF_CONFIG"] = build_tf_config(addresses, worker_index)
+        processes.append(subprocess.Popen([sys.executable, *args], env=dict(env)))
+
+    return [process.wait() for process in processes]
@@ -0,0 +1,103 @@
+import os
+import json
+import pathlib
+from typing import Optional, Tuple
+import numpy as np
+from tensorflow.keras.models import Model
+from betel import classifier_sequence
+from betel import icon_tensor_cache
+
+_META_FILE_NAME = "meta.json"
+_EMBEDDINGS_FILE_NAME = "embeddings.npy"
+_LABELS_FILE_NAME = "labels.npy"
+
+
+class EmbeddingCache:
+    """The embeddings (pooled backbone features) of a data set's icons and
+    their labels, saved on disk with the fingerprint of the icons and the
+    backbone they were computed from."""
+
+    def __init__(self, cache_dir: pathlib.Path):
+        """Constructor.
+
+        :param cache_dir: directory of the cache files
+        """
+        self._cache_dir = cache_dir
+
+    def load(self, fingerprint: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Loads the cached embeddings and labels.
+
+        :param fingerprint: fingerprint of the current icons and backbone
+        :return: the embeddings and labels; None if they are missing or
+        were computed from other icons or with another backbone
+        """
+        try:
+            meta = json.loads((self._cache_dir / _META_FILE_NAME).read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        if meta.get("fingerprint") != fingerprint:
+            return None
+
+        return (np.load(self._cache_dir / _EMBEDDINGS_FILE_NAME),
+                np.load(self._cache_dir / _LABELS_FILE_NAME))
+
+    def save(self, fingerprint: str, embeddings: np.ndarray, labels: np.ndarray) -> None:
+        """Saves the embeddings and labels of a data set.
+
+        :param fingerprint: fingerprint of the icons and backbone
+        :param embeddings: the embedding of every icon
+        :param labels: the label of every icon
+        """
+        self._cache_dir.mkdir(exist_ok=True, parents=True)
+        (self._cache_dir / _META_FILE_NAME).unlink(missing_ok=True)
+
+        np.save(self._cache_dir / _EMBEDDINGS_FILE_NAME, embeddings)
+        np.save(self._cache_dir / _LABELS_FILE_NAME, labels)
+
+        temporary_meta_file = self._cache_dir / (_META_FILE_NAME + ".tmp")
+        temporary_meta_file.write_text(json.dumps({"fingerprint": fingerprint}))
+        os.replace(temporary_meta_file, self._cache_dir / _META_FILE_NAME)
+
+
+def get_embeddings(feature_extractor: Model, backbone_name: str, input_dir: pathlib.Path,
+                   cache_dir: pathlib.Path, batch_size: int, target_img_dim: int,
+                   num_threads: int = 0,
+                   tensor_cache_dir: Optional[pathlib.Path] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """Computes (once) the embeddings of a data set's icons.
+
+    :param feature_extractor: model computing the embeddings of icons
+    :param backbone_name: name identifying the backbone and its weights
+    :param input_dir: directory with input data
+    :param cache_dir: directory of the embedding cache
+    :param batch_size: batch size of the feature extraction
+    :param target_img_dim: target dimension (for square icons)
+    :param num_threads: number of threads decoding the icons
+    :param tensor_cache_dir: directory of the preprocessed icons cache
+    (see ClassifierSequence)
+    :return: the embeddings and labels of the icons (in listing order)
+    """
+    categories, app_icons = classifier_sequence.list_icons(input_dir)
+    fingerprint = icon_tensor_cache.compute_fingerprint(
+        input_dir,
+        [f"{category}/{icon_name}" for icon_name, category in app_icons],
+        target_img_dim,
+        categories,
+        backbone_name
+    )
+
+    cache = EmbeddingCache(cache_dir)
+    cached = cache.load(fingerprint)
+    if cached is not None:
+        return cached
+
+    sequence = classifier_sequence.ClassifierSequence(input_dir, batch_size, target_img_dim,
+                                                      shuffle=False, num_threads=num_threads,
+                                                      cache_dir=tensor_cache_dir)
+
+    # the last batch is completed with the first icons, which are dropped
+    embeddings = feature_extractor.predict(sequence, verbose=0)[:len(app_icons)]
+    labels = np.array([sequence.category_name_to_id[category] for _, category in app_icons])
+
+    cache.save(fingerprint, embeddings, labels)
+    return embeddings, labels
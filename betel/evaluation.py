@@ -0,0 +1,121 @@
+"""Module for evaluating a trained classifier on a data set: per class
+metrics, confusion matrix and precision-recall curves, and the latency
+and throughput of the model."""
+
+import time
+import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from sklearn import metrics
+from betel import inference
+
+EVALUATION_REPORT_FILE_NAME = "evaluation_report.json"
+
+
+def evaluate_classifier(classifier: inference.IconClassifier,
+                        batches: Iterable[Tuple[np.ndarray, np.ndarray]], icons_no: int,
+                        curve_points: int = 101,
+                        categories: Optional[List[str]] = None) -> Dict:
+    """Classifies the (unshuffled) batches of a data set and reports the
+    classifier's quality and speed.
+
+    :param classifier: the classifier
+    :param batches: the (icons, category ids) batches, e.g. loaded in the
+    background by a ClassifierSequence
+    :param icons_no: the number of icons of the data set (the icons
+    completing the last batch are left out)
+    :param curve_points: the maximum number of points of every
+    precision-recall curve
+    :param categories: the category names of the batches' category ids,
+    which are then mapped by name to the classifier's ones (e.g. when the
+    data set's categories are listed in another order or some are
+    missing); default: the classifier's categories
+    :return: the report: the accuracy, the confusion matrix (rows: true
+    categories, columns: predicted categories), the metrics and the
+    precision-recall curve of every category, the percentiles of the
+    model's batch latency (in milliseconds) and the throughput (icons/s)
+    of the model and of the whole evaluation (including loading)
+    """
+    outputs = []
+    labels = []
+    latencies = []
+
+    start = time.perf_counter()
+    for batch_x, batch_y in batches:
+        batch_start = time.perf_counter()
+        outputs.append(classifier.predict(batch_x))
+        latencies.append(time.perf_counter() - batch_start)
+        labels.append(np.asarray(batch_y))
+    elapsed = time.perf_counter() - start
+
+    probabilities = _get_probabilities(np.concatenate(outputs)[:icons_no])
+    labels = np.concatenate(labels)[:icons_no].astype(int)
+    if categories is not None:
+        labels = _get_category_ids(classifier, categories)[labels]
+    predictions = probabilities.argmax(axis=1)
+    category_ids = list(range(len(classifier.categories)))
+
+    report = metrics.classification_report(labels, predictions, labels=category_ids,
+                                           target_names=classifier.categories,
+                                           output_dict=True, zero_division=0)
+
+    categories = {}
+    for category_id, category in enumerate(classifier.categories):
+        relevant = labels == category_id
+        categories[category] = {
+            "precision": report[category]["precision"],
+            "recall": report[category]["recall"],
+            "f1": report[category]["f1-score"],
+            "support": int(report[category]["support"]),
+            "average_precision": (
+                float(metrics.average_precision_score(relevant, probabilities[:, category_id]))
+                if relevant.any() else None),
+            "pr_curve": _get_pr_curve(relevant, probabilities[:, category_id], curve_points)
+        }
+
+    latencies_ms = 1000 * np.array(latencies)
+
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "icons": int(icons_no),
+        "accuracy": float(np.mean(predictions == labels)),
+        "confusion_matrix": metrics.confusion_matrix(labels, predictions,
+                                                     labels=category_ids).tolist(),
+        "categories": categories,
+        "latency_ms": {f"p{percentile}": float(np.percentile(latencies_ms, percentile))
+                       for percentile in (50, 90, 95, 99)},
+        "model_icons_per_s": icons_no / sum(latencies),
+        "icons_per_s": icons_no / elapsed
+    }
+
+
+def _get_category_ids(classifier: inference.IconClassifier, categories: List[str]) -> np.ndarray:
+    unknown_categories = set(categories) - set(classifier.categories)
+    if unknown_categories:
+        raise ValueError(f"Categories unknown to the classifier: {sorted(unknown_categories)}.")
+
+    category_ids = {category: category_id
+                    for category_id, category in enumerate(classifier.categories)}
+    return np.array([category_ids[category] for category in categories], dtype=int)
+
+
+def _get_probabilities(outputs: np.ndarray) -> np.ndarray:
+    if outputs.shape[1] == 1:  # sigmoid output: probability of category 1
+        return np.concatenate([1 - outputs, outputs], axis=1)
+    return outputs
+
+
+def _get_pr_curve(relevant: np.ndarray, scores: np.ndarray,
+                  curve_points: int) -> Dict[str, List[float]]:
+    if not relevant.any():
+        return {"precision": [], "recall": [], "thresholds": []}
+
+    precision, recall, thresholds = metrics.precision_recall_curve(relevant, scores)
+    # the last (precision 1, recall 0) point has no threshold
+    indices = np.unique(np.linspace(0, len(thresholds) - 1, curve_points).round().astype(int))
+
+    return {
+        "precision": precision[indices].tolist(),
+        "recall": recall[indices].tolist(),
+        "thresholds": thresholds[indices].tolist()
+    }
@@ -0,0 +1,146 @@
+import os
+import sqlite3
+import pathlib
+import threading
+import collections
+from typing import Dict, NamedTuple, Optional
+from betel import utils
+
+
+class CachedIcon(NamedTuple):
+    """The validators and content hash of a previously downloaded icon."""
+
+    etag: Optional[str]
+    last_modified: Optional[str]
+    content_hash: str
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS icons (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT NOT NULL
+)
+"""
+
+
+class IconCache:
+    """A persistent (SQLite) cache of the icons downloaded by the scraper,
+    keyed by icon URL, used for skipping the icons unchanged since an
+    earlier crawl.
+
+    The cache provides the headers of conditional requests (ETag and
+    Last-Modified validators) and skips writing icons whose content hash
+    matches the stored one. New entries are kept in memory until flush(),
+    and every process opens its own connection on first use.
+    """
+
+    _TIMEOUT = 60  # seconds to wait for other processes' write locks
+
+    NOT_MODIFIED = "not modified"  # 304 response
+    UNCHANGED = "unchanged"  # downloaded again, same content
+    DOWNLOADED = "downloaded"  # new or changed icon
+
+    def __init__(self, file: pathlib.Path):
+        """Constructor.
+
+        :param file: the SQLite database file
+        """
+        self._file = file
+        self._connection = None
+        self._pending: Dict[str, CachedIcon] = {}
+        self.stats = collections.Counter()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        state["_pending"] = {}
+        state["stats"] = collections.Counter()
+        return state
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            # the async scraper flushes the cache from another thread
+            self._connection = sqlite3.connect(self._file, timeout=self._TIMEOUT,
+                                               check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(_SCHEMA)
+        return self._connection
+
+    def get(self, url: str) -> Optional[CachedIcon]:
+        """Looks up an icon.
+
+        :param url: the icon URL
+        :return: the cache entry; None if the icon was never downloaded
+        """
+        if url in self._pending:
+            return self._pending[url]
+
+        row = self._connect().execute(
+            "SELECT etag, last_modified, content_hash FROM icons WHERE url = ?", (url,)
+        ).fetchone()
+        return None if row is None else CachedIcon(*row)
+
+    def get_conditional_headers(self, url: str, destination: pathlib.Path) -> Dict[str, str]:
+        """Builds the headers of a conditional request for an icon.
+
+        :param url: the icon URL
+        :param destination: where the icon is saved
+        :return: the validator headers (empty if the icon isn't saved yet)
+        """
+        cached_icon = self.get(url)
+        if cached_icon is None or not destination.exists():
+            return {}
+
+        headers = {}
+        if cached_icon.etag is not None:
+            headers["If-None-Match"] = cached_icon.etag
+        if cached_icon.last_modified is not None:
+            headers["If-Modified-Since"] = cached_icon.last_modified
+        return headers
+
+    def mark_not_modified(self) -> None:
+        """Counts an icon for which the server answered 304 Not Modified."""
+        self.stats[self.NOT_MODIFIED] += 1
+
+    def save(self, url: str, destination: pathlib.Path, content: bytes, headers) -> None:
+        """Saves a downloaded icon, unless the saved one has the same content.
+
+        :param url: the icon URL
+        :param destination: where the icon is saved
+        :param content: the downloaded icon
+        :param headers: the response headers
+        """
+        content_hash = utils.get_content_hash(content)
+        cached_icon = self.get(url)
+
+        if (cached_icon is not None and cached_icon.content_hash == content_hash
+                and destination.exists()):
+            self.stats[self.UNCHANGED] += 1
+        else:
+            # written aside and renamed, since the saved icon may be hard
+            # linked (e.g. into the data sets' icon store)
+            temporary_file = destination.with_name(
+                f".{destination.name}.{os.getpid()}.{threading.get_ident()}")
+            temporary_file.write_bytes(content)
+            os.replace(temporary_file, destination)
+            self.stats[self.DOWNLOADED] += 1
+
+        self._pending[url] = CachedIcon(headers.get("ETag"), headers.get("Last-Modified"),
+                                        content_hash)
+
+    def flush(self) -> None:
+        """Writes the new cache entries to the database."""
+        if self._pending:
+            # the entries added while writing (e.g. by the async scraper's
+            # requests) are kept for the next flush
+            pending, self._pending = self._pending, {}
+            rows = [(url, *cached_icon) for url, cached_icon in pending.items()]
+            with self._connect() as connection:
+                connection.executemany("INSERT OR REPLACE INTO icons VALUES (?, ?, ?, ?)", rows)
+
+    def pop_stats(self) -> collections.Counter:
+        """Returns and resets the hit and miss counters."""
+        stats, self.stats = self.stats, collections.Counter()
+        return stats
@@ -0,0 +1,113 @@
+import os
+import shutil
+import pathlib
+import threading
+from typing import Iterable, Tuple
+from betel import utils
+
+
+class IconStore:
+    """A content-addressed store of icons.
+
+    Every distinct icon is kept once, as a blob named by the hash of its
+    content, and the data sets' icon files are hard links to the blobs,
+    so identical icons (e.g. of white-label apps) share their storage
+    and building a data set mostly consists of creating links. The blobs
+    are themselves hard links to the ingested icons, so an icon is not
+    stored twice either (the icons must then be replaced, not rewritten
+    in place).
+    """
+
+    def __init__(self, root: pathlib.Path):
+        """Constructor.
+
+        :param root: directory of the blobs
+        """
+        self._root = root
+        self._root.mkdir(exist_ok=True, parents=True)
+
+    def get_blob(self, content_hash: str) -> pathlib.Path:
+        """Locates the blob of an icon.
+
+        :param content_hash: the hash of the icon
+        :return: the path of the blob
+        """
+        return self._root / content_hash[:2] / content_hash
+
+    def ingest(self, icon: pathlib.Path) -> Tuple[str, bool]:
+        """Adds an icon to the store (as a hard link, or as a copy when
+        the file system doesn't support linking).
+
+        :param icon: the icon file
+        :return: the hash of the icon and whether an identical icon was
+        already stored
+        """
+        # the icon is linked aside first and hashed through the link, so
+        # that the blob has the hashed content even if the icon is replaced
+        temporary_blob = self._root / f".{icon.name}.{os.getpid()}.{threading.get_ident()}"
+        _link(icon, temporary_blob)
+
+        try:
+            content_hash = utils.get_content_hash(temporary_blob.read_bytes())
+            blob = self.get_blob(content_hash)
+
+            if blob.exists():
+                return content_hash, True
+
+            try:
+                os.replace(temporary_blob, blob)
+            except FileNotFoundError:
+                blob.parent.mkdir(exist_ok=True)
+                os.replace(temporary_blob, blob)
+
+            return content_hash, False
+        finally:
+            temporary_blob.unlink(missing_ok=True)
+
+    def link(self, content_hash: str, destination: pathlib.Path) -> None:
+        """Makes a stored icon available at destination (as a hard link,
+        or as a copy when the file system doesn't support linking).
+
+        :param content_hash: the hash of the icon
+        :param destination: the path of the new icon file
+        """
+        blob = self.get_blob(content_hash)
+        try:
+            _link(blob, destination)
+        except FileNotFoundError:
+            destination.parent.mkdir(exist_ok=True, parents=True)
+            _link(blob, destination)
+
+    def release(self, content_hashes: Iterable[str]) -> int:
+        """Deletes the blobs of icons no longer found anywhere else (e.g.
+        after they were removed from the data sets or relinked): the blobs
+        left with a single link.
+
+        :param content_hashes: the hashes of the icons (empty ones are
+        skipped)
+        :return: the number of deleted blobs
+        """
+        deleted = 0
+        for content_hash in set(content_hashes) - {""}:
+            blob = self.get_blob(content_hash)
+            try:
+                if blob.stat().st_nlink == 1:
+                    blob.unlink()
+                    deleted += 1
+            except FileNotFoundError:
+                pass
+        return deleted
+
+
+def _link(source: pathlib.Path, destination: pathlib.Path) -> None:
+    try:
+        os.link(source, destination)
+    except FileExistsError:
+        destination.unlink()
+        os.link(source, destination)
+    except FileNotFoundError:
+        raise
+    except OSError:
+        # e.g. the file system doesn't support hard links, or they are on
+        # different file systems
+        shutil.copy(source, destination)
@@ -0,0 +1,132 @@
+import os
+import json
+import hashlib
+import pathlib
+from typing import Callable, List, Optional, Tuple
+import numpy as np
+
+_META_FILE_NAME = "meta.json"
+_LABELS_FILE_NAME = "labels.npy"
+_FORMAT_VERSION = 1
+
+
+class IconTensorCache:
+    """A cache of preprocessed icons (already resized to the target
+    dimension), stored as memory-mapped uint8 shard files, plus the array
+    of their labels.
+
+    The cache is identified by a fingerprint of its source files, so it
+    can be checked for staleness and rebuilt when the source data set
+    changes. Batches of consecutive icons within a shard are served as
+    views of the memory map (without copying).
+    """
+
+    def __init__(self, cache_dir: pathlib.Path):
+        """Constructor.
+
+        :param cache_dir: directory of the cache files
+        """
+        self._cache_dir = cache_dir
+        self._shards: List[np.ndarray] = []
+        self._shard_size = 0
+        self.labels: Optional[np.ndarray] = None
+
+    def is_valid(self, fingerprint: str) -> bool:
+        """Checks whether the cache was completely built from the
+        source files with the given fingerprint.
+
+        :param fingerprint: fingerprint of the current source files
+        :return: whether the cache is up to date
+        """
+        try:
+            meta = json.loads((self._cache_dir / _META_FILE_NAME).read_text())
+        except (FileNotFoundError, json.JSONDecodeError):
+            return False
+        return meta.get("fingerprint") == fingerprint and meta.get("version") == _FORMAT_VERSION
+
+    def build(self, fingerprint: str, labels: np.ndarray, icon_shape: Tuple[int, int, int],
+              load_icons: Callable[[np.ndarray, range], None], shard_size: int = 4096) -> None:
+        """(Re)builds the cache.
+
+        :param fingerprint: fingerprint of the source files
+        :param labels: the label of every icon
+        :param icon_shape: shape of a preprocessed icon
+        :param load_icons: function preprocessing the icons at the given
+        positions into the given array (one array element per position)
+        :param shard_size: number of icons per shard file
+        """
+        self._cache_dir.mkdir(exist_ok=True, parents=True)
+        # the metadata is removed first and written last, so an
+        # interrupted build is never mistaken for a valid cache
+        (self._cache_dir / _META_FILE_NAME).unlink(missing_ok=True)
+        for old_shard in self._cache_dir.glob("shard_*.npy"):
+            old_shard.unlink()
+
+        num_icons = len(labels)
+        shards_no = 0
+        for start in range(0, num_icons, shard_size):
+            positions = range(start, min(start + shard_size, num_icons))
+            shard = np.lib.format.open_memmap(self._get_shard_file(shards_no), mode="w+",
+                                              dtype=np.uint8,
+                                              shape=(len(positions), *icon_shape))
+            load_icons(shard, positions)
+            shard.flush()
+            del shard
+            shards_no += 1
+
+        np.save(self._cache_dir / _LABELS_FILE_NAME, labels)
+
+        meta = {"version": _FORMAT_VERSION, "fingerprint": fingerprint,
+                "shard_size": shard_size, "shards": shards_no, "icons": num_icons}
+        temporary_meta_file = self._cache_dir / (_META_FILE_NAME + ".tmp")
+        temporary_meta_file.write_text(json.dumps(meta))
+        os.replace(temporary_meta_file, self._cache_dir / _META_FILE_NAME)
+
+    def open(self) -> None:
+        """Memory-maps the cache files."""
+        meta = json.loads((self._cache_dir / _META_FILE_NAME).read_text())
+
+        self._shard_size = meta["shard_size"]
+        self._shards = [np.load(self._get_shard_file(shard_index), mmap_mode="r")
+                        for shard_index in range(meta["shards"])]
+        self.labels = np.load(self._cache_dir / _LABELS_FILE_NAME)
+
+    def get_batch(self, positions: np.ndarray) -> np.ndarray:
+        """Reads the preprocessed icons at the given positions.
+
+        :param positions: positions of the icons in the cache
+        :return: the batch of icons; a view of the memory map if the
+        positions are consecutive and within a single shard
+        """
+        shard_indexes, offsets = np.divmod(positions, self._shard_size)
+
+        first, last = offsets[0], offsets[-1]
+        if (shard_indexes[0] == shard_indexes[-1] and last - first == len(positions) - 1
+                and np.all(np.diff(offsets) == 1)):
+            return self._shards[shard_indexes[0]][first:last + 1]
+
+        batch = np.empty((len(positions), *self._shards[0].shape[1:]), dtype=np.uint8)
+        for shard_index in np.unique(shard_indexes):
+            in_shard = shard_indexes == shard_index
+            batch[in_shard] = self._shards[shard_index][offsets[in_shard]]
+        return batch
+
+    def _get_shard_file(self, shard_index: int) -> pathlib.Path:
+        return self._cache_dir / f"shard_{shard_index:05d}.npy"
+
+
+def compute_fingerprint(root: pathlib.Path, files: List[str], *parameters) -> str:
+    """Fingerprints a list of source files (their order, paths, sizes and
+    modification times) and the preprocessing parameters.
+
+    :param root: directory of the source files
+    :param files: the paths of the source files (relative to root), in
+    cache order
+    :param parameters: preprocessing parameters (e.g. the icon dimension)
+    :return: the fingerprint
+    """
+    digest = hashlib.sha256(json.dumps([_FORMAT_VERSION, *parameters]).encode())
+    for file in files:
+        stat = (root / file).stat()
+        digest.update(f"{file}\0{stat.st_size}\0{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
@@ -0,0 +1,287 @@
+"""Module for exporting the trained classifier and classifying (large
+numbers of) new icons with it."""
+
+import os
+import json
+import time
+import logging
+import pathlib
+import itertools
+import collections
+from concurrent import futures
+from typing import Iterable, Iterator, List, Tuple
+import numpy as np
+import pandas as pd
+from tensorflow import keras
+from betel import utils
+from betel import classifier_sequence
+
+MODEL_FILE_NAME = "model.keras"
+SAVED_MODEL_DIR_NAME = "saved_model"
+METADATA_FILE_NAME = "metadata.json"
+
+
+def export_model(model: keras.Model, model_dir: pathlib.Path, categories: List[str],
+                 target_img_dim: int) -> None:
+    """Saves a trained model (as a Keras model and as a TensorFlow
+    SavedModel, e.g. for serving) and the metadata needed for inference.
+
+    :param model: the trained model
+    :param model_dir: the output directory
+    :param categories: the category names, indexed by category id
+    :param target_img_dim: dimension of the (square) input icons
+    """
+    model_dir.mkdir(exist_ok=True, parents=True)
+
+    model.save(model_dir / MODEL_FILE_NAME)
+    model.export(str(model_dir / SAVED_MODEL_DIR_NAME), verbose=False)
+
+    metadata = {"categories": categories, "target_img_dim": target_img_dim}
+    (model_dir / METADATA_FILE_NAME).write_text(json.dumps(metadata))
+
+
+def load_metadata(model_dir: pathlib.Path) -> dict:
+    """Loads the metadata saved by export_model."""
+    return json.loads((model_dir / METADATA_FILE_NAME).read_text())
+
+
+class IconClassifier:
+    """Classifies icons in batches with a trained model."""
+
+    def __init__(self, model: keras.Model, categories: List[str], target_img_dim: int):
+        """Constructor.
+
+        :param model: the trained model
+        :param categories: the category names, indexed by category id
+        :param target_img_dim: dimension of the (square) input icons
+        """
+        self._model = model
+        self.categories = categories
+        self.target_img_dim = target_img_dim
+
+    @classmethod
+    def load(cls, model_dir: pathlib.Path) -> "IconClassifier":
+        """Loads a model saved by export_model.
+
+        :param model_dir: the directory of the exported model
+        :return: the classifier
+        """
+        metadata = load_metadata(model_dir)
+        model = keras.models.load_model(model_dir / MODEL_FILE_NAME)
+
+        return cls(model, metadata["categories"], metadata["target_img_dim"])
+
+    def predict(self, icons: np.ndarray) -> np.ndarray:
+        """Computes the model's output for a batch of uint8 icons.
+
+        :param icons: the batch of icons
+        :return: the outputs (one row per icon)
+        """
+        return np.asarray(self._model.predict_on_batch(icons))
+
+    def classify(self, icons: np.ndarray) -> Tuple[List[str], np.ndarray]:
+        """Classifies a batch of uint8 icons.
+
+        :param icons: the batch of icons
+        :return: the predicted category of every icon and its probability
+        """
+        outputs = self.predict(icons)
+
+        if outputs.shape[1] == 1:  # sigmoid output: probability of category 1
+            category_ids = (outputs[:, 0] >= 0.5).astype(int)
+            scores = np.where(category_ids == 1, outputs[:, 0], 1 - outputs[:, 0])
+        else:
+            category_ids = outputs.argmax(axis=1)
+            scores = outputs.max(axis=1)
+
+        return [self.categories[category_id] for category_id in category_ids], scores
+
+    def classify_all(self, icons: Iterable[Tuple[str, pathlib.Path]], key_column: str,
+                     batch_size: int = 256, num_threads: int = 8,
+                     prefetch_batches: int = 2) -> Iterator[pd.DataFrame]:
+        """Classifies a stream of icons, decoding the next batches in the
+        background while the model runs.
+
+        :param icons: (key, icon file) pairs, e.g. app ids and their icons
+        :param key_column: name of the keys' column
+        :param batch_size: number of icons classified at once
+        :param num_threads: number of threads decoding the icons
+        :param prefetch_batches: number of batches decoded ahead
+        :return: the predictions of every batch, as DataFrames with
+        <key_column, category, score> columns
+        """
+        for keys, batch in load_batches(icons, batch_size, self.target_img_dim,
+                                        num_threads, prefetch_batches):
+            categories, scores = self.classify(batch)
+            yield pd.DataFrame({key_column: keys, "category": categories, "score": scores})
+
+
+def load_batches(icons: Iterable[Tuple[str, pathlib.Path]], batch_size: int, target_img_dim: int,
+                 num_threads: int = 8,
+                 prefetch_batches: int = 2) -> Iterator[Tuple[List[str], np.ndarray]]:
+    """Decodes a stream of icons into uint8 batches on a thread pool.
+
+    Icons which can not be decoded are logged and left out of their batch.
+
+    :param icons: (key, icon file) pairs
+    :param batch_size: the number of icons of a batch
+    :param target_img_dim: target dimension (for square icons)
+    :param num_threads: number of threads decoding the icons
+    :param prefetch_batches: number of batches decoded ahead
+    :return: the keys and icons of every batch
+    """
+    icons = iter(icons)
+    target_icon_size = (target_img_dim, target_img_dim)
+    pending = collections.deque()
+
+    with futures.ThreadPoolExecutor(max(1, num_threads)) as executor:
+        def submit_batch() -> None:
+            batch = list(itertools.islice(icons, batch_size))
+            if batch:
+                batch_x = np.empty((len(batch), *target_icon_size, 3), dtype=np.uint8)
+                icon_futures = [executor.submit(_load_icon_into, batch_x, position, file,
+                                                target_icon_size)
+                                for position, (_, file) in enumerate(batch)]
+                pending.append((batch, batch_x, icon_futures))
+
+        for _ in range(prefetch_batches + 1):
+            submit_batch()
+
+        while pending:
+            batch, batch_x, icon_futures = pending.popleft()
+            submit_batch()
+
+            loaded = []
+            for (_, file), icon_future in zip(batch, icon_futures):
+                exception = icon_future.exception()
+                if exception is not None:
+                    logging.warning("Can not load icon %s: %s", file, exception)
+                loaded.append(exception is None)
+
+            if all(loaded):
+                yield [key for key, _ in batch], batch_x
+            elif any(loaded):
+                yield [key for (key, _), ok in zip(batch, loaded) if ok], batch_x[loaded]
+
+
+def _load_icon_into(batch_x: np.ndarray, position: int, file: pathlib.Path,
+                    target_icon_size: Tuple[int, int]) -> None:
+    batch_x[position] = classifier_sequence.load_icon(file, target_icon_size)
+
+
+def list_icon_files(icon_dir: pathlib.Path) -> Iterator[Tuple[str, pathlib.Path]]:
+    """Lists (lazily) the icons of a directory and its subdirectories.
+
+    :param icon_dir: the directory
+    :return: the (path relative to icon_dir, icon file) pairs
+    """
+    for file in icon_dir.rglob("*"):
+        if file.is_file():
+            yield str(file.relative_to(icon_dir)), file
+
+
+def list_app_icon_files(app_ids: Iterable[str],
+                        icon_dir: pathlib.Path) -> Iterator[Tuple[str, pathlib.Path]]:
+    """Lists the icons of apps (e.g. downloaded by the scraper).
+
+    :param app_ids: the app ids
+    :param icon_dir: the directory of the icons
+    :return: the (app id, icon file) pairs
+    """
+    for app_id in app_ids:
+        yield app_id, icon_dir / utils.get_app_icon_name(app_id)
+
+
+class PredictionWriter:
+    """Writes predictions to a CSV file or to a Parquet file (requires
+    pyarrow), appending every batch to a file kept open, so that the
+    predictions are never all held in memory. The file is synced to disk
+    on close."""
+
+    def __init__(self, file: pathlib.Path):
+        """Constructor.
+
+        :param file: the output file (.parquet for Parquet, CSV otherwise)
+        """
+        self._file = file
+        self._parquet = file.suffix == ".parquet"
+        self._csv_file = None
+        self._parquet_writer = None
+
+        file.unlink(missing_ok=True)
+
+    def write(self, predictions: pd.DataFrame) -> None:
+        """Writes the predictions of a batch."""
+        if self._parquet:
+            self._write_parquet(predictions)
+        else:
+            header = self._csv_file is None
+            if header:
+                self._csv_file = open(self._file, "w", newline="")
+            predictions.to_csv(self._csv_file, index=False, header=header)
+
+    def _write_parquet(self, predictions: pd.DataFrame) -> None:
+        import pyarrow
+        import pyarrow.parquet
+
+        table = pyarrow.Table.from_pandas(predictions, preserve_index=False)
+        if self._parquet_writer is None:
+            self._parquet_writer = pyarrow.parquet.ParquetWriter(self._file, table.schema)
+        self._parquet_writer.write_table(table)
+
+    def close(self) -> None:
+        """Completes the output file."""
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+            _sync(self._file)
+
+        if self._csv_file is not None:
+            self._csv_file.flush()
+            os.fsync(self._csv_file.fileno())
+            self._csv_file.close()
+            self._csv_file = None
+
+    def __enter__(self) -> "PredictionWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+def _sync(file: pathlib.Path) -> None:
+    file_descriptor = os.open(file, os.O_RDONLY)
+    try:
+        os.fsync(file_descriptor)
+    finally:
+        os.close(file_descriptor)
+
+
+def classify_icons(classifier: IconClassifier, icons: Iterable[Tuple[str, pathlib.Path]],
+                   output_file: pathlib.Path, key_column: str, batch_size: int = 256,
+                   num_threads: int = 8, prefetch_batches: int = 2) -> int:
+    """Classifies a stream of icons and writes the predictions to a file,
+    logging the throughput.
+
+    :param classifier: the classifier
+    :param icons: (key, icon file) pairs, e.g. app ids and their icons
+    :param output_file: the output file (.parquet for Parquet, CSV otherwise)
+    :param key_column: name of the keys' column
+    :param batch_size: number of icons classified at once
+    :param num_threads: number of threads decoding the icons
+    :param prefetch_batches: number of batches decoded ahead
+    :return: the number of classified icons
+    """
+    start = time.perf_counter()
+    icons_no = 0
+
+    with PredictionWriter(output_file) as writer:
+        for predictions in classifier.classify_all(icons, key_column, batch_size, num_threads,
+                                                   prefetch_batches):
+            writer.write(predictions)
+            icons_no += len(predictions)
+
+    elapsed = time.perf_counter() - start
+    logging.info("classified %d icons in %.1f s (%.1f icons/s)", icons_no, elapsed,
+                 icons_no / elapsed if elapsed > 0 else 0.0)
+    return icons_no
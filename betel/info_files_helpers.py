@@ -1,32 +1,134 @@
+import os
+import fcntl
+import atexit
+import contextlib
 import pathlib
+from typing import Dict, Iterable, Iterator, List, Set
 import pandas as pd
 
 
 def add_to_data(file: pathlib.Path, data: pd.DataFrame) -> None:
     """Adds data to file in CSV format.
 
+    The rows are appended with a single write, under an exclusive lock
+    (held on a separate lock file), so that concurrent writers (e.g. the
+    scraper's worker processes) never interleave rows or write the header
+    twice.
+
     :param file: file to which data is added
     :param data: data to be added
     """
-    with open(file, "a+") as csv_file:
-        data.to_csv(csv_file, index=False, header=(file.stat().st_size == 0))
+    with _lock_file(file), open(file, "ab+") as csv_file:
+        size = os.fstat(csv_file.fileno()).st_size
+        text = data.to_csv(index=False, header=(size == 0))
+
+        if size > 0 and not _ends_with_newline(csv_file.fileno(), size):
+            # the last write was cut short (e.g. by a crash), so the
+            # torn row is terminated instead of being merged with ours
+            text = "\n" + text
+
+        os.write(csv_file.fileno(), text.encode())
+        os.fsync(csv_file.fileno())
 
 
-def part_of_data_set(file: pathlib.Path, data: pd.DataFrame) -> bool:
-    """Checks if the data is already written in the CSV file.
+def remove_from_data(file: pathlib.Path, values: Iterable[str], key: str = "app_id") -> None:
+    """Removes the rows whose key is one of the values from a CSV file.
 
-    :param file: file to check
-    :param data: DataFrame to be found
-    :return: if the data is already part of the data set
+    The file is rewritten aside and renamed, under the same lock as
+    add_to_data, so that it is never seen half written and no rows are
+    appended to the replaced file.
+
+    :param file: file from which rows are removed
+    :param values: the keys of the removed rows
+    :param key: the key column
     """
-    try:
-        apps_details = pd.read_csv(file)
-        for key in data.columns:
-            if not (apps_details[key].values == data[key].values).any():
-                return False
-        return True
-    except FileNotFoundError:
-        return False
+    with _lock_file(file):
+        data = pd.read_csv(file, dtype=str, keep_default_na=False)
+        kept_data = data[~data[key].isin(set(values))]
+
+        temporary_file = file.with_name(f".{file.name}.{os.getpid()}")
+        kept_data.to_csv(temporary_file, index=False)
+        os.replace(temporary_file, file)
+
+
+@contextlib.contextmanager
+def _lock_file(file: pathlib.Path) -> Iterator[None]:
+    # the lock is held on a separate hidden file: a lock on the file itself
+    # is lost when remove_from_data replaces it, and a writer blocked on the
+    # replaced file would then append its rows to it
+    with open(file.with_name(f".{file.name}.lock"), "ab") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _ends_with_newline(file_descriptor: int, size: int) -> bool:
+    return os.pread(file_descriptor, 1, size - 1) == b"\n"
+
+
+class BufferedInfoWriter:
+    """A writer collecting rows in memory and appending them to a CSV
+    info file in bulk (through add_to_data), instead of opening the file
+    once per row.
+
+    The buffer is flushed when it is full, when the writer is closed (it
+    can be used as a context manager) and when the interpreter exits.
+    Rows still buffered when a process is killed are lost, but rows are
+    never partially written: every flush is a single locked append.
+    """
+
+    def __init__(self, file: pathlib.Path, buffer_size: int = 1000):
+        """Constructor.
+
+        :param file: file to which rows are added
+        :param buffer_size: number of rows collected before writing them
+        """
+        self._file = file
+        self._buffer_size = buffer_size
+        self._rows: List[Dict[str, str]] = []
+
+        atexit.register(self.flush)
+
+    def __enter__(self) -> "BufferedInfoWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __getstate__(self) -> dict:
+        # copies sent to other processes start with an empty buffer
+        state = self.__dict__.copy()
+        state["_rows"] = []
+        return state
+
+    def add(self, row: Dict[str, str]) -> None:
+        """Buffers a row to be appended to the file.
+
+        :param row: the row, as a column name to value mapping
+        """
+        self._rows.append(row)
+        if len(self._rows) >= self._buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Appends all the buffered rows to the file."""
+        if self._rows:
+            # the rows added while writing (e.g. from another thread) are
+            # kept for the next flush
+            rows, self._rows = self._rows, []
+            try:
+                add_to_data(self._file, pd.DataFrame(rows))
+            except BaseException:
+                self._rows = rows + self._rows
+                raise
+
+    def close(self) -> None:
+        """Flushes the buffered rows; the writer should not be used
+        afterwards."""
+        self.flush()
+        atexit.unregister(self.flush)
 
 
 def read_csv_file(file: pathlib.Path) -> pd.DataFrame:
@@ -37,3 +139,80 @@ def read_csv_file(file: pathlib.Path) -> pd.DataFrame:
     """
     apps_details = pd.read_csv(file)
     return apps_details
+
+
+class InfoFileIndex:
+    """An in-memory hash set of the values found in one column of a CSV
+    info file, for constant-time membership checks.
+
+    The file is read once, on the first lookup, and the index is then
+    kept up to date through add() as rows are appended. When pickled
+    (e.g. when sent to worker processes), only the file location is
+    kept and every process loads its own copy of the index on first use.
+    Values added before the index is loaded are not tracked (e.g. by the
+    worker processes, which never look values up): they are expected to
+    be in the file by the time it is read.
+    """
+
+    def __init__(self, file: pathlib.Path, key: str = "app_id"):
+        """Constructor.
+
+        :param file: the indexed CSV file
+        :param key: the indexed column
+        """
+        self._file = file
+        self._key = key
+        self._values = None
+
+    def __contains__(self, value: str) -> bool:
+        return value in self._get_values()
+
+    def __len__(self) -> int:
+        return len(self._get_values())
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_values"] = None
+        return state
+
+    def add(self, value: str) -> None:
+        """Marks a value as present in the file.
+
+        :param value: value appended to the indexed column
+        """
+        if self._values is not None:
+            self._values.add(value)
+
+    def isin(self, values: pd.Series) -> pd.Series:
+        """Vectorised membership check.
+
+        :param values: the values to look up
+        :return: a boolean Series telling which values are present
+        """
+        return values.isin(self._get_values())
+
+    def update(self, values: Iterable[str]) -> None:
+        """Marks several values as present in the file.
+
+        :param values: values appended to the indexed column
+        """
+        if self._values is not None:
+            self._values.update(values)
+
+    def invalidate(self) -> None:
+        """Drops the loaded values (e.g. after other processes appended
+        to the file), so that the file is read again on the next lookup."""
+        self._values = None
+
+    def _get_values(self) -> Set[str]:
+        if self._values is None:
+            self._values = _read_column(self._file, self._key)
+        return self._values
+
+
+def _read_column(file: pathlib.Path, key: str) -> Set[str]:
+    try:
+        column = pd.read_csv(file, usecols=[key], dtype=str)[key]
+        return set(column.dropna())
+    except (FileNotFoundError, pd.errors.EmptyDataError):
+        return set()
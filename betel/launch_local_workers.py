@@ -0,0 +1,37 @@
+"""Runs main.py as a cluster of distributed training workers on this
+machine, every worker being a process with its own TF_CONFIG (on several
+machines, start main.py --distributed on each of them with their
+TF_CONFIG instead).
+
+The arguments after -- are those of main.py (--distributed is added).
+
+Usage:
+    PYTHONPATH=$PYTHONPATH:. python betel/launch_local_workers.py --num_workers=2 \\
+        -- --noscrape --nobuild --input_pipeline=tf_data --intra_op_threads=4
+"""
+
+import sys
+import logging
+import pathlib
+from absl import app
+from absl import flags
+from betel.distribution import launch_local_workers
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer('num_workers', 2, 'Number of workers.')
+
+
+def main(argv):
+    logging.getLogger().setLevel(logging.INFO)
+
+    main_file = pathlib.Path(__file__).parent / "main.py"
+    exit_codes = launch_local_workers(FLAGS.num_workers,
+                                      [str(main_file), "--distributed", *argv[1:]])
+
+    logging.info("worker exit codes: %s", exit_codes)
+    sys.exit(max(exit_codes, key=abs))
+
+
+if __name__ == "__main__":
+    app.run(main)
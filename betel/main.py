@@ -1,12 +1,31 @@
+import json
+import logging
 import pathlib
-from typing import Tuple
+from typing import List, Optional, Tuple
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.models import Model
 from absl import app
 from absl import flags
 from betel.app_page_scraper import PlayAppPageScraper
+from betel.async_app_page_scraper import AsyncPlayAppPageScraper
+from betel.request_throttling import RetryPolicy
 from betel.info_files_helpers import read_csv_file
 from betel.classifier_data_set_builder import ClassifierDataSetBuilder
 from betel.classifier_sequence import ClassifierSequence
-from betel.model_training import define_model, train_model
+from betel.classifier_dataset import build_dataset
+from betel.record_shards import RecordSequence, build_record_dataset, export_data_set, \
+    read_metadata
+from betel.model_training import define_model, train_model, get_feature_extractor, TrainingConfig, \
+    TRAINING_SUMMARY_FILE_NAME
+from betel.embedding_cache import get_embeddings
+from betel.backbones import BACKBONES, DEFAULT_BACKBONE
+from betel.classifier_sequence import list_icons
+from betel.inference import export_model, IconClassifier
+from betel.evaluation import evaluate_classifier, EVALUATION_REPORT_FILE_NAME
+from betel.quantization import quantize_model
+from betel.distribution import create_strategy, distribute_input, sequence_to_dataset, \
+    get_worker_index, is_chief
 
 FLAGS = flags.FLAGS
 PLAY_STORE_BASE_URL = "https://play.google.com/store/apps"
@@ -16,24 +35,115 @@ flags.DEFINE_bool('build', True, 'Build data set.')
 flags.DEFINE_string('input_file', None, 'CSV file with app ids (scraper input).')
 flags.DEFINE_string('scraper_storage_dir', './app_details', 'Directory for storing retrieved info.')
 flags.DEFINE_list('category_filter', None, 'List of categories whose apps to keep.')
+flags.DEFINE_bool('async_scraping', False, 'Scrape with asyncio over pooled connections.')
+flags.DEFINE_integer('max_concurrency', 1000, 'Maximum number of requests in flight (async).')
+flags.DEFINE_integer('per_host_limit', 100, 'Maximum number of connections per host (async).')
+flags.DEFINE_bool('refresh_icons', False, 'Download again the icons of already stored apps.')
+flags.DEFINE_float('requests_per_second', None, 'Request rate limit shared by all scrapers.')
+flags.DEFINE_integer('max_retries', 5, 'Maximum retries of failed requests without HTTP status.')
+flags.DEFINE_list('retry_statuses', ['429:8', '500:3', '502:3', '503:8', '504:3'],
+                  'HTTP statuses to retry, as status:max_retries pairs.')
+flags.DEFINE_float('retry_base_delay', 1.0, 'Base delay (in seconds) of the retry backoff.')
+flags.DEFINE_float('retry_max_delay', 60.0, 'Maximum delay (in seconds) of the retry backoff.')
 flags.DEFINE_string('builder_storage_dir', './data_set', 'Directory for split data sets.')
 flags.DEFINE_list('classes', None, 'Classifier classes.')
+flags.DEFINE_bool('bulk_build', False, 'Build the data sets with DataFrame-wide operations.')
+flags.DEFINE_integer('builder_threads', 16, 'Threads adding icons to the data sets (bulk build).')
+flags.DEFINE_integer('near_duplicate_distance', None,
+                     'Maximum hash distance of near-duplicate icons, kept in the same data set.')
+flags.DEFINE_bool('deduplicate', False, 'Keep one app of every group of near-duplicate icons.')
+flags.DEFINE_enum('near_duplicate_hash', 'dhash', ['dhash', 'phash'],
+                  'Perceptual hash of the near-duplicate detection.')
+flags.DEFINE_enum('split_method', 'shuffle', ['shuffle', 'hash'],
+                  'Data set split: shuffled, or by a seeded hash of the app ids.')
+flags.DEFINE_bool('stratify', False, 'Stratify the hash split by class.')
+flags.DEFINE_bool('incremental_build', False,
+                  'Only handle the apps changed since the last build (build manifest).')
 flags.DEFINE_integer('batch_size', 32, 'Batch size.')
 flags.DEFINE_integer('target_img_dim', 192, 'Image dimension(for square icons).')
 flags.DEFINE_bool('shuffle', True, 'Shuffling after each epoch.')
+flags.DEFINE_integer('loader_threads', 0, 'Threads decoding the icons of a batch (0: sequential).')
+flags.DEFINE_integer('prefetch_batches', 0, 'Batches decoded in the background (loader_threads > 0).')
+flags.DEFINE_string('tensor_cache_dir', None, 'Directory caching the preprocessed icons.')
+flags.DEFINE_enum('input_pipeline', 'sequence', ['sequence', 'tf_data'],
+                  'Input pipeline: ClassifierSequence or tf.data.')
+flags.DEFINE_string('tf_data_cache', None, 'tf.data cache file prefix ("" caches in memory).')
+flags.DEFINE_string('record_dir', None,
+                    'Directory of the data sets packed into record shards, read instead of the '
+                    'data set directories.')
+flags.DEFINE_bool('export_records', False, 'Pack the built data sets into --record_dir.')
+flags.DEFINE_integer('record_shard_size', 256, 'Size (in MB) of the record shards.')
+flags.DEFINE_integer('frozen_epochs', 60, 'Epochs training the head with a frozen backbone.')
+flags.DEFINE_integer('epochs', 120, 'Total number of epochs (including the frozen ones).')
+flags.DEFINE_string('embedding_cache_dir', None,
+                    'Directory caching the backbone embeddings (the frozen phase trains on them).')
+flags.DEFINE_enum('backbone', DEFAULT_BACKBONE, list(BACKBONES),
+                  'Pretrained backbone of the classifier.')
+flags.DEFINE_enum('precision_policy', 'float32', ['float32', 'mixed_float16', 'mixed_bfloat16'],
+                  'Keras dtype policy of the model (the output stays in float32).')
+flags.DEFINE_bool('jit_compile', False, 'XLA-compile the training steps.')
+flags.DEFINE_float('learning_rate', 0.00001, 'Learning rate (of a single worker).')
+flags.DEFINE_bool('distributed', False,
+                  'Train on the multi-worker cluster described by TF_CONFIG (one process per worker).')
+flags.DEFINE_string('checkpoint_dir', None,
+                    'Directory of the training checkpoints, from which training resumes.')
+flags.DEFINE_string('monitor', 'val_loss',
+                    'Validation metric of the best model, early stopping and plateaus.')
+flags.DEFINE_integer('frozen_patience', None,
+                     'Epochs without improvement ending the frozen phase (default: never).')
+flags.DEFINE_integer('patience', None,
+                     'Epochs without improvement ending the fine-tuning (default: never).')
+flags.DEFINE_float('min_delta', 0.0, 'Minimum change of the monitored metric to improve.')
+flags.DEFINE_integer('reduce_lr_patience', None,
+                     'Epochs without improvement reducing the learning rate (default: never).')
+flags.DEFINE_float('reduce_lr_factor', 0.1, 'Factor reducing the learning rate on plateaus.')
+flags.DEFINE_string('model_dir', './model', 'Directory where the trained model is exported.')
+flags.DEFINE_bool('evaluate', True, 'Evaluate the exported model on the test set.')
+flags.DEFINE_list('quantization', None, 'TFLite versions of the model to export (float16,dynamic,int8).')
+flags.DEFINE_integer('calibration_batches', 100, 'Training batches calibrating the int8 model.')
+flags.DEFINE_integer('intra_op_threads', 0, 'Threads of a TensorFlow op (0: system default).')
+flags.DEFINE_integer('inter_op_threads', 0, 'Concurrent TensorFlow ops (0: system default).')
+
+
+def get_retry_policy() -> RetryPolicy:
+    """Builds the scrapers' retry policy from the flags."""
+    status_retries = dict(map(int, pair.split(':')) for pair in FLAGS.retry_statuses)
+
+    return RetryPolicy(
+        max_retries=FLAGS.max_retries,
+        base_delay=FLAGS.retry_base_delay,
+        max_delay=FLAGS.retry_max_delay,
+        status_retries=status_retries
+    )
 
 
 def scrape_info() -> None:
     """Scrapes the necessary info from the Google Play Store."""
-    scraper = PlayAppPageScraper(
-        PLAY_STORE_BASE_URL,
-        pathlib.Path(FLAGS.scraper_storage_dir),
-        FLAGS.category_filter
-    )
+    if FLAGS.async_scraping:
+        scraper = AsyncPlayAppPageScraper(
+            PLAY_STORE_BASE_URL,
+            pathlib.Path(FLAGS.scraper_storage_dir),
+            FLAGS.category_filter,
+            FLAGS.max_concurrency,
+            FLAGS.per_host_limit,
+            get_retry_policy(),
+            FLAGS.requests_per_second
+        )
+    else:
+        scraper = PlayAppPageScraper(
+            PLAY_STORE_BASE_URL,
+            pathlib.Path(FLAGS.scraper_storage_dir),
+            FLAGS.category_filter,
+            get_retry_policy(),
+            FLAGS.requests_per_second
+        )
 
     app_ids = read_csv_file(
         pathlib.Path(FLAGS.input_file)).values.flatten()
 
+    if FLAGS.refresh_icons:
+        scraper.refresh_icons(app_ids)
+
     scraper.store_apps_info(app_ids)
 
 
@@ -42,53 +152,293 @@ def build_data_set() -> None:
     builder = ClassifierDataSetBuilder(
         pathlib.Path(FLAGS.scraper_storage_dir),
         pathlib.Path(FLAGS.builder_storage_dir),
-        classes=FLAGS.classes
+        classes=FLAGS.classes,
+        bulk=FLAGS.bulk_build,
+        num_threads=FLAGS.builder_threads,
+        near_duplicate_distance=FLAGS.near_duplicate_distance,
+        deduplicate=FLAGS.deduplicate,
+        hash_function=FLAGS.near_duplicate_hash,
+        split_method=FLAGS.split_method,
+        stratify=FLAGS.stratify
     )
 
-    builder.split_and_build_data_sets()
+    if FLAGS.incremental_build:
+        builder.update_data_sets()
+    else:
+        builder.split_and_build_data_sets()
+
+
+def configure_threads() -> None:
+    """Sets the TensorFlow thread pools' sizes from the flags."""
+    tf.config.threading.set_intra_op_parallelism_threads(FLAGS.intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(FLAGS.inter_op_threads)
+
+
+def get_tensor_cache_dir(data_set: str) -> Optional[pathlib.Path]:
+    """The tensor cache directory of a data set (None if not cached)."""
+    if FLAGS.tensor_cache_dir is None:
+        return None
+    return pathlib.Path(FLAGS.tensor_cache_dir) / data_set
 
 
 def initialise_generators() -> Tuple:
-    """Initialises generators for the train-validation-test data sets."""
-    train_gen = ClassifierSequence(
-        pathlib.Path(FLAGS.builder_storage_dir) / "train",
-        FLAGS.batch_size,
+    """Initialises generators for the train-validation-test data sets (the
+    test set is not shuffled)."""
+    return (initialise_generator("train", FLAGS.shuffle),
+            initialise_generator("validation", FLAGS.shuffle),
+            initialise_generator("test", False))
+
+
+def initialise_generator(data_set: str, shuffle: bool):
+    """Initialises the generator of a data set, with the input pipeline
+    selected by --input_pipeline."""
+    if FLAGS.input_pipeline == 'tf_data':
+        return initialise_dataset(data_set, shuffle)
+
+    return create_sequence(data_set, FLAGS.batch_size, shuffle, get_tensor_cache_dir(data_set))
+
+
+def initialise_dataset(data_set: str, shuffle: bool) -> tf.data.Dataset:
+    """Initialises the tf.data pipeline of a data set."""
+    cache = FLAGS.tf_data_cache
+    if cache:
+        cache = f"{cache}_{data_set}"
+
+    return create_dataset(data_set, FLAGS.batch_size, shuffle, cache)
+
+
+def get_input_dir(data_set: str) -> pathlib.Path:
+    """The directory a data set is read from: its record shards (with
+    --record_dir) or its directory."""
+    if FLAGS.record_dir is not None:
+        return pathlib.Path(FLAGS.record_dir) / data_set
+    return pathlib.Path(FLAGS.builder_storage_dir) / data_set
+
+
+def create_sequence(data_set: str, batch_size: int, shuffle: bool,
+                    tensor_cache_dir: Optional[pathlib.Path], num_shards: int = 1,
+                    shard_index: int = 0) -> ClassifierSequence:
+    """Creates the sequence of a data set, over its record shards (with
+    --record_dir) or its directory."""
+    sequence_class = ClassifierSequence if FLAGS.record_dir is None else RecordSequence
+    return sequence_class(
+        get_input_dir(data_set),
+        batch_size,
         FLAGS.target_img_dim,
-        FLAGS.shuffle
+        shuffle,
+        FLAGS.loader_threads,
+        FLAGS.prefetch_batches,
+        tensor_cache_dir,
+        num_shards,
+        shard_index
     )
-    val_gen = ClassifierSequence(
-        pathlib.Path(FLAGS.builder_storage_dir) / "validation",
-        FLAGS.batch_size,
-        FLAGS.target_img_dim,
-        FLAGS.shuffle)
-    test_gen = ClassifierSequence(
-        pathlib.Path(FLAGS.builder_storage_dir) / "test",
+
+
+def create_dataset(data_set: str, batch_size: int, shuffle: bool, cache: Optional[str],
+                   num_shards: int = 1, shard_index: int = 0) -> tf.data.Dataset:
+    """Creates the tf.data pipeline of a data set, over its record shards
+    (with --record_dir) or its directory."""
+    dataset_builder = build_dataset if FLAGS.record_dir is None else build_record_dataset
+    return dataset_builder(get_input_dir(data_set), batch_size, FLAGS.target_img_dim, shuffle,
+                           cache, num_shards=num_shards, shard_index=shard_index)
+
+
+def close_input(generator) -> None:
+    """Closes the shard files of a sequence over record shards (the other
+    inputs hold no open files)."""
+    if isinstance(generator, RecordSequence):
+        generator.close()
+
+
+def list_categories(data_set: str) -> Tuple[List[str], int]:
+    """The categories (in category id order) and the number of icons of a
+    data set."""
+    if FLAGS.record_dir is not None:
+        metadata = read_metadata(get_input_dir(data_set))
+        return metadata["categories"], metadata["icons"]
+
+    categories, app_icons = list_icons(get_input_dir(data_set))
+    return categories, len(app_icons)
+
+
+def export_records() -> None:
+    """Packs the built data sets into record shards."""
+    if FLAGS.record_dir is None:
+        raise ValueError("--export_records needs --record_dir.")
+
+    for data_set in ("train", "validation", "test"):
+        icons_no = export_data_set(pathlib.Path(FLAGS.builder_storage_dir) / data_set,
+                                   pathlib.Path(FLAGS.record_dir) / data_set,
+                                   FLAGS.record_shard_size * 2 ** 20, FLAGS.builder_threads)
+        logging.info("%s: %d icons exported", data_set, icons_no)
+
+
+def compute_embeddings(data_set: str, feature_extractor: Model,
+                       backbone_name: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Computes (or loads from the cache) the embeddings of a data set."""
+    return get_embeddings(
+        feature_extractor,
+        backbone_name,
+        pathlib.Path(FLAGS.builder_storage_dir) / data_set,
+        pathlib.Path(FLAGS.embedding_cache_dir) / data_set,
         FLAGS.batch_size,
         FLAGS.target_img_dim,
-        FLAGS.shuffle
+        FLAGS.loader_threads,
+        get_tensor_cache_dir(data_set)
     )
 
-    return train_gen, val_gen, test_gen
+
+def initialise_distributed_input(strategy: tf.distribute.Strategy,
+                                 data_set: str) -> tf.distribute.DistributedDataset:
+    """Initialises the input of a data set for distributed training, every
+    worker reading its own shard of it."""
+    def build_shard(batch_size: int, num_shards: int, shard_index: int) -> tf.data.Dataset:
+        if FLAGS.input_pipeline == 'tf_data':
+            cache = FLAGS.tf_data_cache
+            if cache:
+                cache = f"{cache}_{data_set}_shard{shard_index}"
+
+            return create_dataset(data_set, batch_size, FLAGS.shuffle, cache,
+                                  num_shards, shard_index)
+
+        tensor_cache_dir = get_tensor_cache_dir(data_set)
+        if tensor_cache_dir is not None:
+            tensor_cache_dir = tensor_cache_dir / f"shard{shard_index}"
+
+        return sequence_to_dataset(create_sequence(data_set, batch_size, FLAGS.shuffle,
+                                                   tensor_cache_dir, num_shards, shard_index))
+
+    global_batch_size = FLAGS.batch_size * strategy.num_replicas_in_sync
+    return distribute_input(strategy, global_batch_size, build_shard)
 
 
 def train() -> None:
     """Model training on the generated data sets."""
-    model, backbone = define_model()
+    if FLAGS.distributed and FLAGS.embedding_cache_dir is not None:
+        raise ValueError("--embedding_cache_dir is not supported by distributed training.")
+
+    # --batch_size and --learning_rate are those of one worker, and are
+    # scaled linearly with the number of workers
+    strategy = create_strategy() if FLAGS.distributed else tf.distribute.get_strategy()
+    workers_no = strategy.num_replicas_in_sync
+
+    with strategy.scope():
+        model, backbone = define_model(FLAGS.precision_policy, FLAGS.backbone,
+                                       FLAGS.target_img_dim)
+
+    if FLAGS.distributed:
+        train_gen = initialise_distributed_input(strategy, "train")
+        val_gen = initialise_distributed_input(strategy, "validation")
+    else:
+        train_gen, val_gen = initialise_generator("train", FLAGS.shuffle), \
+            initialise_generator("validation", FLAGS.shuffle)
+
+    config = TrainingConfig(
+        frozen_epochs=FLAGS.frozen_epochs,
+        epochs=FLAGS.epochs,
+        batch_size=FLAGS.batch_size,
+        jit_compile=FLAGS.jit_compile,
+        learning_rate=FLAGS.learning_rate * workers_no,
+        checkpoint_dir=FLAGS.checkpoint_dir,
+        monitor=FLAGS.monitor,
+        frozen_patience=FLAGS.frozen_patience,
+        patience=FLAGS.patience,
+        min_delta=FLAGS.min_delta,
+        reduce_lr_patience=FLAGS.reduce_lr_patience,
+        reduce_lr_factor=FLAGS.reduce_lr_factor
+    )
+    if FLAGS.distributed:
+        config.log_dir = f"logs/fit/worker{get_worker_index()}"
+        if FLAGS.checkpoint_dir is not None and not is_chief():
+            # every worker saves (the same) checkpoints, the other workers
+            # in subdirectories of the chief's
+            worker_dir = pathlib.Path(FLAGS.checkpoint_dir) / f"worker{get_worker_index()}"
+            config.checkpoint_dir = str(worker_dir)
+
+    if FLAGS.embedding_cache_dir is None:
+        summary = train_model(model, backbone, train_gen, val_gen, config)
+    else:
+        feature_extractor = get_feature_extractor(model)
+        backbone_name = f"{backbone.name}:{FLAGS.precision_policy}"
+        summary = train_model(model, backbone, train_gen, val_gen, config,
+                              compute_embeddings("train", feature_extractor, backbone_name),
+                              compute_embeddings("validation", feature_extractor, backbone_name))
+    close_input(train_gen)
+    close_input(val_gen)
+
+    if not is_chief():
+        return
+
+    categories, _ = list_categories("train")
+    export_model(model, pathlib.Path(FLAGS.model_dir), categories, FLAGS.target_img_dim)
+    (pathlib.Path(FLAGS.model_dir) / TRAINING_SUMMARY_FILE_NAME).write_text(
+        json.dumps(summary, indent=2))
+
+    for mode in FLAGS.quantization or []:
+        calibration_gen = initialise_calibration_sequence()
+        quantize_model(pathlib.Path(FLAGS.model_dir), mode, calibration_gen,
+                       FLAGS.calibration_batches)
+        close_input(calibration_gen)
+
+
+def evaluate_model() -> None:
+    """Evaluates the exported model on the test set, writing the report
+    next to the model."""
+    model_dir = pathlib.Path(FLAGS.model_dir)
+    classifier = IconClassifier.load(model_dir)
+    test_gen = initialise_generator("test", False)
+
+    # the test labels are numbered by the test set's own listing of the
+    # categories, and mapped by name to the model's
+    if isinstance(test_gen, tf.data.Dataset):
+        batches = test_gen.as_numpy_iterator()
+        categories, icons_no = list_categories("test")
+    else:
+        batches = (test_gen[idx] for idx in range(len(test_gen)))
+        categories = [test_gen.category_id_to_name[category_id]
+                      for category_id in range(len(test_gen.category_id_to_name))]
+        icons_no = test_gen.icons_no
 
-    train_gen, val_gen, _ = initialise_generators()
+    report = evaluate_classifier(classifier, batches, icons_no, categories=categories)
+    close_input(test_gen)
+    report.update(backbone=FLAGS.backbone, precision_policy=FLAGS.precision_policy,
+                  batch_size=FLAGS.batch_size)
 
-    train_model(model, backbone, train_gen, val_gen)
+    (model_dir / EVALUATION_REPORT_FILE_NAME).write_text(json.dumps(report, indent=2))
+    logging.info("test accuracy %.4f, p95 batch latency %.1f ms, %.1f icons/s",
+                 report["accuracy"], report["latency_ms"]["p95"], report["icons_per_s"])
+
+
+def initialise_calibration_sequence() -> ClassifierSequence:
+    """Initialises the (shuffled) training batches calibrating int8 models."""
+    calibration_gen = create_sequence("train", FLAGS.batch_size, True,
+                                      get_tensor_cache_dir("train"))
+    calibration_gen.on_epoch_end()  # mixes the categories
+
+    return calibration_gen
 
 
 def main(argv):
+    configure_threads()
+
+    if FLAGS.distributed and (FLAGS.scrape or FLAGS.build or FLAGS.export_records):
+        raise ValueError("Distributed training needs built data sets "
+                         "(--noscrape --nobuild --noexport_records).")
+
     if FLAGS.scrape:
         scrape_info()
 
     if FLAGS.build:
         build_data_set()
 
+    if FLAGS.export_records:
+        export_records()
+
     train()
 
+    if FLAGS.evaluate and is_chief():
+        evaluate_model()
+
 
 if __name__ == "__main__":
     app.run(main)
@@ -1,34 +1,219 @@
 """Module for defining and training the classifier.
 Commented lines represent different things tried during the project."""
 
+import time
+import logging
+import pathlib
 import datetime
-from typing import Tuple
+import functools
+import dataclasses
+from typing import Dict, List, Optional, Tuple
+import numpy as np
 import tensorflow as tf
+from tensorflow.keras import ops
+from tensorflow.keras import mixed_precision
 from tensorflow.keras import optimizers
 from tensorflow.keras.models import Model
 from tensorflow.keras import callbacks
 from tensorflow.keras import metrics
-# from tensorflow.keras.appgit slications.mobilenet_v2 import MobileNetV2, preprocess_input
-# from tensorflow.keras.applications.resnet50 import ResNet50, preprocess_input
-from tensorflow.keras.applications.resnet_v2 import ResNet152V2, preprocess_input
 from tensorflow.keras.layers import Input, Dense, GlobalAveragePooling2D, \
     BatchNormalization, ReLU, LayerNormalization
 from betel import classifier_sequence
+from betel import distribution
+from betel import backbones
 
+EMBEDDING_LAYER_NAME = "embedding"
+HEAD_MODEL_NAME = "head"
 
-def define_model() -> Tuple[Model, Model]:
-    """Defines the architecture of the model."""
-    i = Input([None, None, 3], dtype=tf.uint8)
-    x = tf.cast(i, tf.float32)
-    x = preprocess_input(x)
+FROZEN_PHASE = 0
+FINE_TUNING_PHASE = 1
+BEST_CHECKPOINT_NAME = "best"
+TRAINING_SUMMARY_FILE_NAME = "training_summary.json"
 
-    # base_model = MobileNetV2(include_top=False, weights='imagenet', input_shape=(192, 192, 3))
-    # base_model = ResNet50(include_top=False, weights='imagenet', input_shape=(192, 192, 3))
-    base_model = ResNet152V2(include_top=False, weights='imagenet', input_shape=(192, 192, 3))
+
+@dataclasses.dataclass
+class TrainingConfig:
+    """The training schedule: frozen_epochs epochs training only the head
+    (with a frozen backbone), then fine-tuning of the whole model up to
+    epochs.
+
+    With a patience, a phase ends once the monitored validation metric
+    stops improving (the frozen phase then hands off to fine-tuning).
+    """
+
+    frozen_epochs: int = 60
+    epochs: int = 120
+    batch_size: int = 32  # batch size of the head trained on cached embeddings
+    jit_compile: bool = False  # XLA compilation of the training steps
+    learning_rate: float = 0.00001
+    tensorboard: bool = True
+    log_dir: Optional[str] = None  # TensorBoard logs (default: logs/fit/<start time>)
+    checkpoint_dir: Optional[str] = None  # training state, to resume an interrupted training
+    monitor: str = "val_loss"  # validation metric of the best model, early stopping and plateaus
+    frozen_patience: Optional[int] = None  # epochs without improvement ending the frozen phase
+    patience: Optional[int] = None  # epochs without improvement ending the fine-tuning
+    min_delta: float = 0.0  # minimum change of the monitored metric counted as an improvement
+    reduce_lr_patience: Optional[int] = None  # epochs without improvement reducing the rate
+    reduce_lr_factor: float = 0.1
+
+
+class EpochTimer(callbacks.Callback):
+    """Measures the duration of every training epoch and its mean step
+    time, logging them and adding them to the epoch logs (so they are also
+    recorded by the History and TensorBoard callbacks)."""
+
+    def __init__(self):
+        super().__init__()
+        self._start = 0.0
+        self._steps = 0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._start = time.perf_counter()
+        self._steps = 0
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._steps += 1
+
+    def on_epoch_end(self, epoch, logs=None):
+        epoch_time = time.perf_counter() - self._start
+        step_time = epoch_time / max(1, self._steps)
+        logging.info("epoch %d: %.1f s, %.1f ms/step", epoch + 1, epoch_time, 1000 * step_time)
+
+        if logs is not None:
+            logs["epoch_time"] = epoch_time
+            logs["step_time"] = step_time
+
+
+class TrainingCheckpoint(callbacks.Callback):
+    """Saves the training state (model weights, optimizer state, phase and
+    epoch) at the end of every epoch, from which an interrupted training
+    resumes, and the weights of the best model by a validation metric."""
+
+    def __init__(self, checkpoint_dir: pathlib.Path, model: Model, monitor: str = "val_loss",
+                 max_to_keep: int = 2):
+        """Constructor.
+
+        :param checkpoint_dir: the directory of the checkpoints
+        :param model: the trained model (whose weights are saved)
+        :param monitor: the validation metric of the best model; accuracy,
+        precision and recall are maximized, other metrics minimized
+        :param max_to_keep: the number of checkpoints kept
+        """
+        super().__init__()
+        self._checkpoint_dir = checkpoint_dir
+        # the weights are saved as a list, whose order (unlike the model's
+        # checkpoint dependencies) does not depend on the frozen layers
+        self._weights = model.weights
+        self._monitor = monitor
+        self._sign = -1.0 if any(name in monitor for name in ("acc", "precision", "recall")) else 1.0
+        self._max_to_keep = max_to_keep
+        self._manager = None
+
+        self._phase = tf.Variable(FROZEN_PHASE, dtype=tf.int64, trainable=False)
+        self._epoch = tf.Variable(0, dtype=tf.int64, trainable=False)
+        self._best = tf.Variable(np.inf, dtype=tf.float64, trainable=False)
+
+    @property
+    def best_checkpoint(self) -> pathlib.Path:
+        """The checkpoint (prefix) of the best model's weights."""
+        return self._checkpoint_dir / BEST_CHECKPOINT_NAME
+
+    def load_state(self) -> Tuple[int, int]:
+        """Loads the progress of the last checkpoint.
+
+        :return: the phase and the number of completed epochs (the frozen
+        phase and 0 without checkpoint)
+        """
+        latest = tf.train.latest_checkpoint(str(self._checkpoint_dir))
+        if latest is not None:
+            tf.train.Checkpoint(phase=self._phase, epoch=self._epoch,
+                                best=self._best).restore(latest).expect_partial()
+            logging.info("resuming from %s (phase %d, epoch %d)", latest, int(self._phase),
+                         int(self._epoch))
+
+        return int(self._phase), int(self._epoch)
+
+    def start_phase(self, phase: int, fit_model: Model) -> None:
+        """Starts checkpointing a training phase. The first phase of the
+        run restores the model's weights from the last checkpoint, and the
+        optimizer's state if it is from the same phase. Switching phases is
+        checkpointed at once, so that a training interrupted before the
+        first epoch of the new phase ends (e.g. right after the frozen phase
+        stopped early) resumes the new phase.
+
+        :param phase: FROZEN_PHASE or FINE_TUNING_PHASE
+        :param fit_model: the compiled model trained in this phase (the
+        model or its head)
+        """
+        latest = tf.train.latest_checkpoint(str(self._checkpoint_dir))
+        if latest is not None and self._manager is None:
+            if int(self._phase) == phase:
+                restored = tf.train.Checkpoint(weights=self._weights, optimizer=fit_model.optimizer)
+            else:
+                restored = tf.train.Checkpoint(weights=self._weights)
+            restored.restore(latest).expect_partial()
+
+        switched = int(self._phase) != phase
+        self._phase.assign(phase)
+        checkpoint = tf.train.Checkpoint(weights=self._weights, optimizer=fit_model.optimizer,
+                                         phase=self._phase, epoch=self._epoch, best=self._best)
+        self._manager = tf.train.CheckpointManager(checkpoint, str(self._checkpoint_dir),
+                                                   self._max_to_keep)
+        if switched:
+            # replaces the checkpoint of the last epoch of the previous phase
+            self._manager.save(checkpoint_number=int(self._epoch))
+
+    def restore_best_weights(self) -> None:
+        """Loads the best model's weights (if any) into the model."""
+        if self.best_checkpoint.with_suffix(".index").exists():
+            tf.train.Checkpoint(weights=self._weights).read(str(self.best_checkpoint)).expect_partial()
+
+    def on_epoch_end(self, epoch, logs=None):
+        value = (logs or {}).get(self._monitor)
+        if value is not None and self._sign * value < float(self._best):
+            self._best.assign(self._sign * value)
+            tf.train.Checkpoint(weights=self._weights).write(str(self.best_checkpoint))
+            logging.info("epoch %d: best %s %.4f", epoch + 1, self._monitor, value)
+
+        self._epoch.assign(epoch + 1)
+        self._manager.save(checkpoint_number=epoch + 1)
+
+
+def define_model(precision_policy: str = "float32", backbone: str = backbones.DEFAULT_BACKBONE,
+                 input_dim: int = 192, weights: Optional[str] = "imagenet") -> Tuple[Model, Model]:
+    """Defines the architecture of the model.
+
+    :param precision_policy: the Keras dtype policy of the model's layers,
+    e.g. "mixed_bfloat16" (on CPUs with bfloat16 support) or
+    "mixed_float16"; the output stays in float32
+    :param backbone: the name of the backbone (see backbones.BACKBONES)
+    :param input_dim: dimension of the (square) input icons
+    :param weights: the backbone's weights ("imagenet" or None)
+    :return: the model and its backbone
+    """
+    mixed_precision.set_global_policy(precision_policy)
+
+    i = Input([None, None, 3], dtype="uint8")
+    x = ops.cast(i, "float32")
+    x = backbones.get_backbone(backbone).preprocess_input(x)
+
+    base_model = backbones.build_backbone(backbone, input_dim, weights)
     x = base_model(x)
 
-    x = GlobalAveragePooling2D()(x)
-    x = Dense(512, kernel_regularizer='l2')(x)
+    x = GlobalAveragePooling2D(name=EMBEDDING_LAYER_NAME)(x)
+    predictions = define_head(x.shape[-1])(x)
+
+    model = Model(inputs=[i], outputs=predictions)
+
+    return model, base_model
+
+
+def define_head(embedding_dim: int) -> Model:
+    """Defines the classification head, which takes the pooled backbone
+    features (embeddings) as input."""
+    i = Input([embedding_dim])
+
+    x = Dense(512, kernel_regularizer='l2')(i)
     x = BatchNormalization()(x)
     x = ReLU()(x)
     # x = LayerNormalization()(x)
@@ -40,49 +225,152 @@ def define_model() -> Tuple[Model, Model]:
     x = BatchNormalization()(x)
     x = ReLU()(x)
     # x = LayerNormalization()(x)
-    predictions = Dense(1, activation='sigmoid', kernel_regularizer='l2')(x)
+    predictions = Dense(1, activation='sigmoid', kernel_regularizer='l2', dtype='float32')(x)
 
-    model = Model(inputs=[i], outputs=predictions)
+    return Model(inputs=[i], outputs=predictions, name=HEAD_MODEL_NAME)
 
-    return model, base_model
+
+def get_feature_extractor(model: Model) -> Model:
+    """The part of the model computing the embeddings (the backbone and
+    the pooling)."""
+    return Model(inputs=model.inputs, outputs=model.get_layer(EMBEDDING_LAYER_NAME).output)
 
 
 def train_model(model: Model, base_model: Model, train_gen: classifier_sequence.ClassifierSequence,
-                val_gen: classifier_sequence.ClassifierSequence) -> None:
-    """Trains the model on the given data sets."""
+                val_gen: classifier_sequence.ClassifierSequence,
+                config: Optional[TrainingConfig] = None,
+                train_embeddings: Optional[Tuple[np.ndarray, np.ndarray]] = None,
+                val_embeddings: Optional[Tuple[np.ndarray, np.ndarray]] = None) -> Dict:
+    """Trains the model on the given data sets.
+
+    If the (embeddings, labels) of the data sets are given, the frozen
+    phase trains only the head on them, instead of running the frozen
+    backbone on every icon in every epoch.
+
+    A model created under a multi-worker strategy is trained on the
+    distributed datasets of distribution.distribute_input.
+
+    With a checkpoint directory, the training resumes from its last
+    checkpoint and the model ends with the weights of the best epoch.
+
+    :return: the summary of the phases run ("frozen" and "fine_tuning"):
+    their scheduled and trained epochs, whether they stopped early, their
+    duration and the time saved by stopping early (estimated from their
+    mean epoch time, in seconds), and the total saved time
+    """
+    config = config or TrainingConfig()
+
+    # the batches are requested in order (the sequences shuffle their
+    # icons themselves), so that the batches they prefetch are used
+    fit = functools.partial(model.fit, shuffle=False)
+    if distribution.is_multi_worker(model.distribute_strategy):
+        fit = functools.partial(distribution.fit, model)
+
     for layer in base_model.layers:
         layer.trainable = False
 
-    opt = optimizers.SGD(learning_rate=0.00001, momentum=0.8, clipnorm=1)
-    # opt = optimizers.Adam(learning_rate=0.000001)
+    fit_callbacks = [EpochTimer()]
+    if config.tensorboard:
+        log_dir = config.log_dir or "logs/fit/" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        fit_callbacks.append(callbacks.TensorBoard(log_dir=log_dir, histogram_freq=1))
+    if config.reduce_lr_patience is not None:
+        fit_callbacks.append(callbacks.ReduceLROnPlateau(monitor=config.monitor,
+                                                         factor=config.reduce_lr_factor,
+                                                         patience=config.reduce_lr_patience,
+                                                         min_delta=config.min_delta))
+
+    checkpoint = None
+    phase, initial_epoch = FROZEN_PHASE, 0
+    if config.checkpoint_dir is not None:
+        checkpoint = TrainingCheckpoint(pathlib.Path(config.checkpoint_dir), model,
+                                        config.monitor)
+        phase, initial_epoch = checkpoint.load_state()
+        fit_callbacks.append(checkpoint)
+
+    summary = {}
+
+    if phase == FROZEN_PHASE and initial_epoch < config.frozen_epochs:
+        frozen_callbacks = fit_callbacks + _early_stopping(config.frozen_patience, config)
 
-    model.compile(optimizer=opt,
-                  loss='binary_crossentropy',
-                  metrics=['accuracy', metrics.Recall(),
-                           metrics.Precision(), metrics.FalsePositives(),
-                           metrics.FalseNegatives()])
+        if train_embeddings is not None and val_embeddings is not None:
+            head = model.get_layer(HEAD_MODEL_NAME)
+            _compile(head, config)
+            if checkpoint is not None:
+                checkpoint.start_phase(FROZEN_PHASE, head)
 
-    log_dir = "logs/fit/" + datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
-    tensorboard_callback = callbacks.TensorBoard(log_dir=log_dir, histogram_freq=1)
+            history = head.fit(*train_embeddings,
+                               batch_size=config.batch_size,
+                               validation_data=val_embeddings,
+                               epochs=config.frozen_epochs,
+                               initial_epoch=initial_epoch,
+                               callbacks=frozen_callbacks)
+        else:
+            _compile(model, config)
+            if checkpoint is not None:
+                checkpoint.start_phase(FROZEN_PHASE, model)
 
-    model.fit(train_gen,
-              validation_data=val_gen,
-              epochs=60,
-              callbacks=[tensorboard_callback])
+            history = fit(train_gen,
+                          validation_data=val_gen,
+                          epochs=config.frozen_epochs,
+                          initial_epoch=initial_epoch,
+                          callbacks=frozen_callbacks)
+
+        summary["frozen"] = _summarize_phase(history, config.frozen_epochs - initial_epoch)
+        initial_epoch += len(history.epoch)
 
     for layer in base_model.layers:
         layer.trainable = True
 
-    opt = optimizers.SGD(learning_rate=0.00001, momentum=0.8, clipnorm=1)
+    _compile(model, config)
+    if checkpoint is not None:
+        checkpoint.start_phase(FINE_TUNING_PHASE, model)
+
+    # the fine-tuning starts as soon as the frozen phase ends
+    history = fit(train_gen,
+                  validation_data=val_gen,
+                  epochs=config.epochs,
+                  initial_epoch=initial_epoch,
+                  callbacks=fit_callbacks + _early_stopping(config.patience, config))
+    summary["fine_tuning"] = _summarize_phase(history, config.epochs - initial_epoch)
+
+    if checkpoint is not None:
+        checkpoint.restore_best_weights()
+
+    summary["saved_time"] = sum(phase_summary["saved_time"] for phase_summary in summary.values())
+    logging.info("training summary: %s", summary)
+    return summary
+
+
+def _early_stopping(patience: Optional[int], config: TrainingConfig) -> List[callbacks.Callback]:
+    if patience is None:
+        return []
+    return [callbacks.EarlyStopping(monitor=config.monitor, patience=patience,
+                                    min_delta=config.min_delta)]
+
+
+def _summarize_phase(history: callbacks.History, scheduled_epochs: int) -> Dict:
+    epoch_times = history.history.get("epoch_time", [])
+    trained_epochs = len(history.epoch)
+    mean_epoch_time = float(np.mean(epoch_times)) if epoch_times else 0.0
+
+    return {
+        "scheduled_epochs": scheduled_epochs,
+        "trained_epochs": trained_epochs,
+        "stopped_early": trained_epochs < scheduled_epochs,
+        "time": float(np.sum(epoch_times)),
+        "saved_time": max(0, scheduled_epochs - trained_epochs) * mean_epoch_time
+    }
+
 
-    model.compile(optimizer=opt,
-                  loss='binary_crossentropy',
-                  metrics=['accuracy', metrics.Recall(),
-                           metrics.Precision(), metrics.FalsePositives(),
-                           metrics.FalseNegatives()])
+def _compile(model: Model, config: TrainingConfig) -> None:
+    with model.distribute_strategy.scope():
+        opt = optimizers.SGD(learning_rate=config.learning_rate, momentum=0.8, clipnorm=1)
+        # opt = optimizers.Adam(learning_rate=0.000001)
 
-    model.fit(train_gen,
-              validation_data=val_gen,
-              epochs=120,
-              initial_epoch=60,
-              callbacks=[tensorboard_callback])
+        model.compile(optimizer=opt,
+                      loss='binary_crossentropy',
+                      metrics=['accuracy', metrics.Recall(name="recall"),
+                               metrics.Precision(name="precision"),
+                               metrics.FalsePositives(name="false_positives"),
+                               metrics.FalseNegatives(name="false_negatives")],
+                      jit_compile=True if config.jit_compile else "auto")
@@ -0,0 +1,77 @@
+"""Classifies new icons with a model exported by main.py.
+
+The icons are either all the files of --icon_dir (and its subdirectories)
+or the icons of the apps listed in --input_file, as downloaded by the
+scraper in --scraper_storage_dir. The icons are decoded by
+--loader_threads threads, --prefetch_batches batches ahead of the model.
+
+Usage:
+    PYTHONPATH=$PYTHONPATH:. python betel/predict.py --model_dir=./model \\
+        --icon_dir=path/to/icons --output_file=predictions.csv
+    PYTHONPATH=$PYTHONPATH:. python betel/predict.py --model_dir=./model \\
+        --input_file=app_ids.csv --scraper_storage_dir=./app_details \\
+        --output_file=predictions.parquet --batch_size=256 --loader_threads=8
+"""
+
+import logging
+import pathlib
+import tensorflow as tf
+from absl import app
+from absl import flags
+from betel.info_files_helpers import read_csv_file
+from betel.inference import IconClassifier, classify_icons, list_icon_files, list_app_icon_files
+from betel.quantization import QUANTIZATION_MODES, TFLiteIconClassifier
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('model_dir', './model', 'Directory of the exported model.')
+flags.DEFINE_string('icon_dir', None, 'Directory of the icons to classify.')
+flags.DEFINE_string('input_file', None, 'CSV file with the ids of the apps to classify.')
+flags.DEFINE_string('scraper_storage_dir', './app_details', 'Directory of the scraped icons.')
+flags.DEFINE_string('output_file', 'predictions.csv', 'Output file (CSV, or Parquet if .parquet).')
+flags.DEFINE_enum('tflite_mode', None, QUANTIZATION_MODES,
+                  'Classify with this quantized TFLite model instead of the float model.')
+flags.DEFINE_integer('batch_size', 256, 'Number of icons classified at once.')
+flags.DEFINE_integer('loader_threads', 8, 'Threads decoding the icons.')
+flags.DEFINE_integer('prefetch_batches', 2, 'Batches decoded ahead of the model.')
+flags.DEFINE_integer('intra_op_threads', 0, 'Threads of a TensorFlow op (0: system default).')
+flags.DEFINE_integer('inter_op_threads', 0, 'Concurrent TensorFlow ops (0: system default).')
+
+
+def configure_threads() -> None:
+    """Sets the TensorFlow thread pools' sizes from the flags."""
+    tf.config.threading.set_intra_op_parallelism_threads(FLAGS.intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(FLAGS.inter_op_threads)
+
+
+def main(argv):
+    logging.getLogger().setLevel(logging.INFO)
+    configure_threads()
+
+    if FLAGS.tflite_mode is None:
+        classifier = IconClassifier.load(pathlib.Path(FLAGS.model_dir))
+    else:
+        classifier = TFLiteIconClassifier.load(pathlib.Path(FLAGS.model_dir), FLAGS.tflite_mode,
+                                               FLAGS.intra_op_threads or None)
+
+    if FLAGS.icon_dir is not None:
+        icons = list_icon_files(pathlib.Path(FLAGS.icon_dir))
+        key_column = "icon"
+    else:
+        app_ids = read_csv_file(pathlib.Path(FLAGS.input_file)).values.flatten()
+        icons = list_app_icon_files(app_ids, pathlib.Path(FLAGS.scraper_storage_dir))
+        key_column = "app_id"
+
+    classify_icons(
+        classifier,
+        icons,
+        pathlib.Path(FLAGS.output_file),
+        key_column,
+        FLAGS.batch_size,
+        max(1, FLAGS.loader_threads),
+        FLAGS.prefetch_batches
+    )
+
+
+if __name__ == "__main__":
+    app.run(main)
@@ -0,0 +1,151 @@
+"""Module for quantizing an exported classifier into a TFLite model (for
+CPU-only inference) and comparing it with the float model."""
+
+import time
+import pathlib
+from typing import Dict, Iterator, List, Optional
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from betel import inference
+from betel import classifier_sequence
+
+try:
+    from ai_edge_litert.interpreter import Interpreter
+except ImportError:  # the LiteRT package is optional
+    Interpreter = tf.lite.Interpreter
+
+QUANTIZATION_MODES = ("float16", "dynamic", "int8")
+
+
+def get_tflite_model_file(model_dir: pathlib.Path, mode: str) -> pathlib.Path:
+    """The file of an exported model's quantized version."""
+    return model_dir / f"model_{mode}.tflite"
+
+
+def quantize_model(model_dir: pathlib.Path, mode: str,
+                   calibration_sequence: Optional[classifier_sequence.ClassifierSequence] = None,
+                   calibration_batches: int = 100) -> pathlib.Path:
+    """Converts a model exported by inference.export_model into a
+    quantized TFLite model, saved next to it.
+
+    :param model_dir: the directory of the exported model
+    :param mode: "float16" (float16 weights), "dynamic" (int8 weights)
+    or "int8" (int8 weights and activations, calibrated on sample icons)
+    :param calibration_sequence: icons whose activation ranges calibrate
+    the int8 model (e.g. shuffled training batches)
+    :param calibration_batches: maximum number of calibration batches
+    :return: the TFLite model file
+    """
+    if mode not in QUANTIZATION_MODES:
+        raise ValueError(f"Unknown quantization mode: {mode}.")
+    if mode == "int8" and calibration_sequence is None:
+        raise ValueError("int8 quantization needs a calibration sequence.")
+
+    converter = tf.lite.TFLiteConverter.from_saved_model(
+        str(model_dir / inference.SAVED_MODEL_DIR_NAME))
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if mode == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif mode == "int8":
+        # ops without int8 kernels are kept in float
+        converter.representative_dataset = lambda: _get_calibration_data(calibration_sequence,
+                                                                          calibration_batches)
+
+    tflite_model_file = get_tflite_model_file(model_dir, mode)
+    tflite_model_file.write_bytes(converter.convert())
+    return tflite_model_file
+
+
+def _get_calibration_data(sequence: classifier_sequence.ClassifierSequence,
+                          batches_no: int) -> Iterator[List[np.ndarray]]:
+    for idx in range(min(batches_no, len(sequence))):
+        batch_x, _ = sequence[idx]
+        for icon in batch_x.astype(np.uint8):
+            yield [icon[np.newaxis]]
+
+
+class TFLiteIconClassifier(inference.IconClassifier):
+    """An IconClassifier running a quantized TFLite model."""
+
+    def __init__(self, interpreter: Interpreter, categories: List[str], target_img_dim: int):
+        """Constructor.
+
+        :param interpreter: the interpreter of the TFLite model
+        :param categories: the category names, indexed by category id
+        :param target_img_dim: dimension of the (square) input icons
+        """
+        super().__init__(interpreter, categories, target_img_dim)
+
+        self._input = interpreter.get_input_details()[0]["index"]
+        self._output = interpreter.get_output_details()[0]["index"]
+        self._input_shape = None
+
+    @classmethod
+    def load(cls, model_dir: pathlib.Path, mode: str = "int8",
+             num_threads: Optional[int] = None) -> "TFLiteIconClassifier":
+        """Loads a model quantized by quantize_model.
+
+        :param model_dir: the directory of the exported model
+        :param mode: the quantization mode
+        :param num_threads: number of threads of the interpreter
+        :return: the classifier
+        """
+        metadata = inference.load_metadata(model_dir)
+        interpreter = Interpreter(model_path=str(get_tflite_model_file(model_dir, mode)),
+                                  num_threads=num_threads)
+
+        return cls(interpreter, metadata["categories"], metadata["target_img_dim"])
+
+    def predict(self, icons: np.ndarray) -> np.ndarray:
+        if self._input_shape != icons.shape:
+            self._model.resize_tensor_input(self._input, icons.shape)
+            self._model.allocate_tensors()
+            self._input_shape = icons.shape
+
+        self._model.set_tensor(self._input, icons.astype(np.uint8, copy=False))
+        self._model.invoke()
+        return self._model.get_tensor(self._output).copy()
+
+
+def compare_classifiers(classifiers: Dict[str, inference.IconClassifier],
+                        sequence: classifier_sequence.ClassifierSequence) -> pd.DataFrame:
+    """Compares the accuracy and latency of classifiers (e.g. the float
+    model and its quantized versions) on the same data set.
+
+    :param classifiers: the classifiers by name; the first one is the
+    reference of the agreement rates
+    :param sequence: the (unshuffled) data set
+    :return: a row per classifier with its accuracy, its agreement with
+    the first classifier, its median and 95th percentile batch latency
+    (in milliseconds) and its throughput (icons/s)
+    """
+    batches = [sequence[idx] for idx in range(len(sequence))]
+    expected = [sequence.category_id_to_name[category_id]
+                for _, batch_y in batches for category_id in batch_y]
+
+    rows = []
+    reference = None
+    for name, classifier in classifiers.items():
+        predicted = []
+        latencies = []
+        for batch_x, _ in batches:
+            start = time.perf_counter()
+            categories, _ = classifier.classify(batch_x.astype(np.uint8, copy=False))
+            latencies.append(time.perf_counter() - start)
+            predicted.extend(categories)
+
+        predicted = np.array(predicted)
+        reference = predicted if reference is None else reference
+
+        rows.append({
+            "classifier": name,
+            "accuracy": np.mean(predicted == np.array(expected)),
+            "agreement": np.mean(predicted == reference),
+            "p50_latency_ms": 1000 * np.percentile(latencies, 50),
+            "p95_latency_ms": 1000 * np.percentile(latencies, 95),
+            "icons_per_s": len(predicted) / sum(latencies)
+        })
+
+    return pd.DataFrame(rows)
@@ -0,0 +1,280 @@
+"""Packing of the data set directories into record shards: large TFRecord
+files of (encoded icon, category id, app id) records, with an index of
+the records, so that the icons are read without a listing of the
+directories nor a file opened per icon: with large sequential reads by
+the tf.data pipeline, and with a positioned read each by RecordSequence
+(sequential reads in listing order, random ones when shuffled).
+
+The shards are read by RecordSequence, a ClassifierSequence, and by the
+tf.data pipeline of build_record_dataset, which both produce the same
+batches as their counterparts over the exported directory.
+"""
+
+import io
+import os
+import json
+import math
+import pathlib
+from concurrent import futures
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+import tensorflow as tf
+from PIL import Image
+from betel import utils
+from betel import icon_tensor_cache
+from betel import classifier_sequence
+from betel import classifier_dataset
+
+RECORD_INDEX_FILE_NAME = "index.csv"
+RECORD_METADATA_FILE_NAME = "metadata.json"
+
+# a TFRecord is framed by its length (8 bytes) and the CRCs (4 bytes) of
+# its length and of its data
+_RECORD_HEADER_SIZE = 12
+_RECORD_FOOTER_SIZE = 4
+_EXPORT_CHUNK_SIZE = 1024  # icons read ahead by the exporter
+_READ_BUFFER_SIZE = 8 * 2 ** 20  # bytes of every read of the tf.data pipeline
+
+_FEATURES = {
+    "icon": tf.io.FixedLenFeature([], tf.string),
+    "label": tf.io.FixedLenFeature([], tf.int64)
+}
+
+
+def export_data_set(input_dir: pathlib.Path, output_dir: pathlib.Path,
+                    shard_size: int = 256 * 2 ** 20, num_threads: int = 16) -> int:
+    """Packs a data set directory (one subdirectory per category) into
+    record shards, in the directory listing order of ClassifierSequence.
+
+    :param input_dir: directory with input data
+    :param output_dir: directory of the shards, the index and the
+    metadata (replaced if it already holds an export)
+    :param shard_size: size (in bytes) from which a shard is closed and
+    the next one started
+    :param num_threads: number of threads reading the icons
+    :return: the number of exported icons
+    """
+    categories, app_icons = classifier_sequence.list_icons(input_dir)
+    category_name_to_id = {name: category_id for category_id, name in enumerate(categories)}
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    (output_dir / RECORD_METADATA_FILE_NAME).unlink(missing_ok=True)
+    for shard in output_dir.glob("*.tfrecord"):
+        shard.unlink()
+
+    shards: List[str] = []
+    index_rows = []
+    writer: Optional[tf.io.TFRecordWriter] = None
+    offset = 0
+
+    with futures.ThreadPoolExecutor(num_threads) as executor:
+        for start in range(0, len(app_icons), _EXPORT_CHUNK_SIZE):
+            chunk = app_icons[start:start + _EXPORT_CHUNK_SIZE]
+            contents = executor.map(lambda icon: (input_dir / icon[1] / icon[0]).read_bytes(),
+                                    chunk)
+
+            for (icon_name, category), content in zip(chunk, contents):
+                if writer is None or offset >= shard_size:
+                    if writer is not None:
+                        writer.close()
+                    shards.append(f"shard{len(shards):05d}.tfrecord")
+                    writer = tf.io.TFRecordWriter(str(output_dir / shards[-1]))
+                    offset = 0
+
+                record = _serialize_record(content, category_name_to_id[category],
+                                           icon_name.removeprefix(utils.get_app_icon_name("")))
+                writer.write(record)
+
+                index_rows.append((shards[-1], offset, len(record), category, icon_name))
+                offset += _RECORD_HEADER_SIZE + len(record) + _RECORD_FOOTER_SIZE
+
+    if writer is not None:
+        writer.close()
+
+    pd.DataFrame(index_rows, columns=["shard", "offset", "length", "category", "icon_name"]) \
+        .to_csv(output_dir / RECORD_INDEX_FILE_NAME, index=False)
+
+    # the metadata is written last: an export without it is incomplete
+    metadata = {"categories": categories, "shards": shards, "icons": len(app_icons)}
+    (output_dir / RECORD_METADATA_FILE_NAME).write_text(json.dumps(metadata, indent=2))
+
+    return len(app_icons)
+
+
+def read_metadata(records_dir: pathlib.Path) -> Dict:
+    """Reads the metadata of an export.
+
+    :param records_dir: directory of the shards
+    :return: the category names (in category id order), the shard file
+    names and the number of icons
+    """
+    metadata_file = records_dir / RECORD_METADATA_FILE_NAME
+    if not metadata_file.exists():
+        raise ValueError(f"No complete record export in: {records_dir}.")
+    return json.loads(metadata_file.read_text())
+
+
+class RecordSequence(classifier_sequence.ClassifierSequence):
+    """A ClassifierSequence over a data set exported to record shards:
+    every icon is read from its shard with a single positioned read, of
+    the next record when not shuffled and of a random one otherwise (the
+    shards then save opening a file per icon, not the random reads)."""
+
+    def __init__(self, records_dir: pathlib.Path, batch_size: int,
+                 target_img_dim: int, shuffle: bool = True,
+                 num_threads: int = 0, prefetch_batches: int = 0,
+                 cache_dir: Optional[pathlib.Path] = None,
+                 num_shards: int = 1, shard_index: int = 0):
+        """Constructor.
+
+        :param records_dir: directory of the shards (output of
+        export_data_set)
+        :param batch_size: the desired size of a batch
+        :param target_img_dim: target dimension (for square icons)
+        :param shuffle: whether the input data is shuffled on epoch end or not.
+        :param num_threads: number of threads decoding the icons of a batch
+        in parallel (into uint8 batches); 0 decodes them one at a time
+        :param prefetch_batches: number of following batches decoded in
+        the background (when num_threads > 0)
+        :param cache_dir: directory of a cache of the preprocessed (uint8)
+        icons, built on first use and rebuilt when the export changes
+        :param num_shards: number of shards the icons are split into (e.g.
+        one per worker of distributed training)
+        :param shard_index: the shard of icons sequenced
+        """
+        self._shard_files: Dict[str, io.BufferedReader] = {}
+        self._records: Dict[Tuple[str, str], Tuple[str, int, int]] = {}
+        super().__init__(records_dir, batch_size, target_img_dim, shuffle, num_threads,
+                         prefetch_batches, cache_dir, num_shards, shard_index)
+
+    def _get_categories(self) -> List[str]:
+        metadata = read_metadata(self._input_dir)
+        index = pd.read_csv(self._input_dir / RECORD_INDEX_FILE_NAME,
+                            dtype={"shard": str, "category": str, "icon_name": str})
+
+        self._app_icons = list(zip(index["icon_name"], index["category"]))
+        self._records = dict(zip(self._app_icons,
+                                 zip(index["shard"], index["offset"], index["length"])))
+        self._shard_files = {shard: open(self._input_dir / shard, "rb")
+                             for shard in metadata["shards"]}
+
+        return metadata["categories"]
+
+    def close(self) -> None:
+        """Closes the shard files; the sequence should not be used
+        afterwards."""
+        for shard_file in self._shard_files.values():
+            shard_file.close()
+        self._shard_files = {}
+
+    def __del__(self):
+        self.close()
+
+    def _compute_fingerprint(self) -> str:
+        return icon_tensor_cache.compute_fingerprint(
+            self._input_dir,
+            [RECORD_METADATA_FILE_NAME, RECORD_INDEX_FILE_NAME, *self._shard_files],
+            [f"{category}/{icon_name}" for icon_name, category in self._app_icons],
+            self._target_icon_size,
+            self.category_id_to_name
+        )
+
+    def _load_icon_into(self, batch_x: np.ndarray, position: int,
+                        icon_name: str, category: str) -> None:
+        batch_x[position] = self._read_icon(icon_name, category)
+
+    def _load_icon(self, icon_name: str, category: str) -> np.ndarray:
+        return self._read_icon(icon_name, category).astype(np.float32)
+
+    def _read_icon(self, icon_name: str, category: str) -> np.ndarray:
+        shard, offset, length = self._records[(icon_name, category)]
+        record = os.pread(self._shard_files[shard].fileno(), length,
+                          offset + _RECORD_HEADER_SIZE)
+        content = tf.train.Example.FromString(record).features.feature["icon"].bytes_list.value[0]
+
+        with Image.open(io.BytesIO(content)) as img:
+            return np.asarray(classifier_sequence.resize_icon(img.convert("RGB"),
+                                                              self._target_icon_size))
+
+
+def build_record_dataset(records_dir: pathlib.Path, batch_size: int, target_img_dim: int,
+                         shuffle: bool = True, cache: Optional[str] = None,
+                         num_parallel_calls: int = tf.data.AUTOTUNE, num_shards: int = 1,
+                         shard_index: int = 0, shuffle_buffer: int = 10000) -> tf.data.Dataset:
+    """Builds a dataset of (uint8 icons, category ids) batches read
+    sequentially from record shards.
+
+    The batches are the same as those of build_dataset over the exported
+    directory (without shuffling). Sharded, every dataset reads only a
+    contiguous range of the records (instead of every num_shards-th icon),
+    and the shards all have the same number of batches, as in
+    ClassifierSequence.
+
+    :param records_dir: directory of the shards (output of export_data_set)
+    :param batch_size: the desired size of a batch
+    :param target_img_dim: target dimension (for square icons)
+    :param shuffle: whether the icons are shuffled on every epoch or not
+    :param cache: file caching the decoded icons after the first epoch
+    ("" caches them in memory; None disables caching)
+    :param num_parallel_calls: number of icons decoded in parallel
+    :param num_shards: number of shards the icons are split into (e.g.
+    one per worker of distributed training)
+    :param shard_index: the shard of icons in the dataset
+    :param shuffle_buffer: number of icons the shuffling picks from
+    :return: the dataset
+    """
+    metadata = read_metadata(records_dir)
+    icons_no = metadata["icons"]
+
+    if num_shards > 1:
+        index = pd.read_csv(records_dir / RECORD_INDEX_FILE_NAME, usecols=["shard"],
+                            dtype={"shard": str})
+        # every shard has as many icons (the last one being completed with
+        # its first icons), as in ClassifierSequence
+        shard_size = math.ceil(icons_no / num_shards)
+        start = shard_index * shard_size % icons_no
+        dataset = _read_records(records_dir, index, start, min(start + shard_size, icons_no))
+        dataset = dataset.repeat().take(shard_size)
+        icons_no = shard_size
+    else:
+        files = [str(records_dir / shard) for shard in metadata["shards"]]
+        dataset = tf.data.TFRecordDataset(files, buffer_size=_READ_BUFFER_SIZE)
+
+    # every batch is full, as in ClassifierSequence
+    dataset = dataset.repeat().take(-icons_no % batch_size + icons_no)
+    dataset = dataset.map(lambda record: _parse_record(record, target_img_dim),
+                          num_parallel_calls=num_parallel_calls)
+
+    if cache is not None:
+        dataset = dataset.cache(cache)
+
+    if shuffle:
+        dataset = dataset.shuffle(shuffle_buffer, reshuffle_each_iteration=True)
+
+    return dataset.batch(batch_size, drop_remainder=True).prefetch(tf.data.AUTOTUNE)
+
+
+def _read_records(records_dir: pathlib.Path, index: pd.DataFrame, start: int,
+                  stop: int) -> tf.data.Dataset:
+    # only the shards holding the records are read, from the start of the
+    # first one
+    shards = index["shard"].iloc[start:stop].unique()
+    skipped = start - index["shard"].searchsorted(shards[0])
+    files = [str(records_dir / shard) for shard in shards]
+    return tf.data.TFRecordDataset(files, buffer_size=_READ_BUFFER_SIZE) \
+        .skip(skipped).take(stop - start)
+
+
+def _parse_record(record: tf.Tensor, target_img_dim: int) -> Tuple[tf.Tensor, tf.Tensor]:
+    features = tf.io.parse_single_example(record, _FEATURES)
+    icon = tf.io.decode_image(features["icon"], channels=3, expand_animations=False)
+    return classifier_dataset.resize_icon(icon, target_img_dim), features["label"]
+
+
+def _serialize_record(content: bytes, label: int, app_id: str) -> bytes:
+    return tf.train.Example(features=tf.train.Features(feature={
+        "icon": tf.train.Feature(bytes_list=tf.train.BytesList(value=[content])),
+        "label": tf.train.Feature(int64_list=tf.train.Int64List(value=[label])),
+        "app_id": tf.train.Feature(bytes_list=tf.train.BytesList(value=[app_id.encode()]))
+    })).SerializeToString()
@@ -0,0 +1,194 @@
+import os
+import time
+import fcntl
+import struct
+import random
+import asyncio
+import pathlib
+import datetime
+import dataclasses
+import email.utils
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+from betel import betel_errors
+
+T = TypeVar("T")
+
+# default maximum number of retries of the statuses worth retrying
+DEFAULT_STATUS_RETRIES = {429: 8, 500: 3, 502: 3, 503: 8, 504: 3}
+
+
+class TokenBucket:
+    """A token bucket rate limiter shared by every process using the same
+    state file (e.g. all the scraper's workers).
+
+    The bucket refills at `rate` tokens per second, up to `capacity`
+    tokens, and every request takes one token. The state is kept in a
+    small file updated under an exclusive lock.
+    """
+
+    _STATE = struct.Struct("dd")  # (available tokens, last refill time)
+
+    def __init__(self, file: pathlib.Path, rate: float, capacity: Optional[float] = None):
+        """Constructor.
+
+        :param file: file keeping the state of the bucket
+        :param rate: number of requests allowed per second
+        :param capacity: maximum number of requests allowed in a burst
+        (default: one second worth of requests)
+        """
+        self._file = file
+        self._rate = rate
+        self._capacity = max(1.0, rate) if capacity is None else capacity
+
+    def try_acquire(self) -> float:
+        """Takes a token if one is available.
+
+        :return: 0 if a token was taken; otherwise, the number of seconds
+        until the next token is available
+        """
+        with open(os.open(self._file, os.O_RDWR | os.O_CREAT), "r+b") as state_file:
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            try:
+                now = time.time()
+                tokens = self._get_tokens(state_file.read(self._STATE.size), now)
+
+                wait = 0.0
+                if tokens >= 1:
+                    tokens -= 1
+                else:
+                    wait = (1 - tokens) / self._rate
+
+                state_file.seek(0)
+                state_file.write(self._STATE.pack(tokens, now))
+                return wait
+            finally:
+                fcntl.flock(state_file, fcntl.LOCK_UN)
+
+    def _get_tokens(self, state: bytes, now: float) -> float:
+        if len(state) != self._STATE.size:
+            return self._capacity
+
+        tokens, last_refill = self._STATE.unpack(state)
+        elapsed = max(0.0, now - last_refill)
+        return min(self._capacity, tokens + elapsed * self._rate)
+
+    def acquire(self) -> None:
+        """Blocks until a token is taken."""
+        wait = self.try_acquire()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.try_acquire()
+
+    async def acquire_async(self) -> None:
+        """Waits (without blocking the event loop) until a token is taken."""
+        wait = self.try_acquire()
+        while wait > 0:
+            await asyncio.sleep(wait)
+            wait = self.try_acquire()
+
+
+@dataclasses.dataclass
+class RetryPolicy:
+    """When and after how long failed requests are retried.
+
+    Delays grow exponentially (with full jitter) from base_delay up to
+    max_delay, unless the response has a Retry-After header, which is
+    then honored.
+    """
+
+    max_retries: int = 5  # retries of errors without HTTP status (e.g. timeouts)
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+    status_retries: Dict[int, int] = dataclasses.field(
+        default_factory=lambda: dict(DEFAULT_STATUS_RETRIES))  # HTTP status -> max retries
+
+    def get_delay(self, attempt: int, exception: betel_errors.AccessError) -> Optional[float]:
+        """Computes how long to wait before retrying a failed request.
+
+        :param attempt: number of retries already done
+        :param exception: the error raised by the request
+        :return: the delay in seconds; None if the request shouldn't be
+        retried
+        """
+        if exception.status is None:
+            max_retries = self.max_retries
+        else:
+            max_retries = self.status_retries.get(exception.status, 0)
+
+        if attempt >= max_retries:
+            return None
+
+        retry_after = parse_retry_after(exception.headers)
+        if retry_after is not None:
+            return retry_after
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+
+def parse_retry_after(headers) -> Optional[float]:
+    """Reads the Retry-After header (in seconds or as an HTTP date).
+
+    :param headers: the response headers (may be None)
+    :return: the number of seconds to wait; None if missing or invalid
+    """
+    value = None if headers is None else headers.get("Retry-After")
+    if value is None:
+        return None
+
+    if value.strip().isdigit():
+        return float(value)
+
+    try:
+        date = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
+def call_with_retries(request: Callable[[], T], retry_policy: Optional[RetryPolicy] = None,
+                      rate_limiter: Optional[TokenBucket] = None) -> T:
+    """Calls a request function, waiting for the rate limiter before
+    every attempt and retrying on AccessError as allowed by retry_policy.
+
+    :param request: function doing the request
+    :param retry_policy: the retry policy (default: no retries)
+    :param rate_limiter: the rate limiter (default: no rate limiting)
+    :return: the result of the request
+    """
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        try:
+            return request()
+        except betel_errors.AccessError as exception:
+            delay = None if retry_policy is None else retry_policy.get_delay(attempt, exception)
+            if delay is None:
+                raise
+            time.sleep(delay)
+            attempt += 1
+
+
+async def call_with_retries_async(request: Callable[[], Awaitable[T]],
+                                  retry_policy: Optional[RetryPolicy] = None,
+                                  rate_limiter: Optional[TokenBucket] = None) -> T:
+    """Coroutine version of call_with_retries.
+
+    :param request: function returning a new awaitable request per call
+    :param retry_policy: the retry policy (default: no retries)
+    :param rate_limiter: the rate limiter (default: no rate limiting)
+    :return: the result of the request
+    """
+    attempt = 0
+    while True:
+        if rate_limiter is not None:
+            await rate_limiter.acquire_async()
+        try:
+            return await request()
+        except betel_errors.AccessError as exception:
+            delay = None if retry_policy is None else retry_policy.get_delay(attempt, exception)
+            if delay is None:
+                raise
+            await asyncio.sleep(delay)
+            attempt += 1
@@ -1,8 +1,13 @@
-import pandas as pd
+import hashlib
 
 SCRAPER_INFO_FILE_NAME = "apps"
 SCRAPER_LOG_FILE_NAME = "logs"
+SCRAPER_LEDGER_FILE_NAME = "ledger.db"
+SCRAPER_RATE_LIMITER_FILE_NAME = "rate_limiter"
+SCRAPER_ICON_CACHE_FILE_NAME = "icon_cache.db"
 CLASSIFIER_DATA_BUILDER_INFO_DIR = "info"
+CLASSIFIER_DATA_BUILDER_ICON_STORE_DIR = "icon_store"
+CLASSIFIER_DATA_BUILDER_MANIFEST_FILE_NAME = "manifest"
 
 
 def get_app_icon_name(app_id: str) -> str:
@@ -10,6 +15,6 @@ def get_app_icon_name(app_id: str) -> str:
     return f"icon_{app_id}"
 
 
-def get_app_search_data_frame(app_id: str) -> pd.DataFrame:
-    """Builds a DataFrame for the app to be found in info files."""
-    return pd.DataFrame([{"app_id": app_id}])
+def get_content_hash(content: bytes) -> str:
+    """Computes the hash identifying a file's content (e.g. an icon's)."""
+    return hashlib.sha256(content).hexdigest()
@@ -0,0 +1,159 @@
+import enum
+import time
+import sqlite3
+import pathlib
+from typing import Iterable, List, NamedTuple, Optional, Dict
+from betel import betel_errors
+
+
+class AppState(enum.Enum):
+    """The outcome of scraping an app."""
+
+    DONE = "done"  # stored in the data set
+    FILTERED = "filtered"  # its category is not part of the category filter
+    FAILED_RETRYABLE = "failed_retryable"  # transient error, to be tried again
+    FAILED_PERMANENT = "failed_permanent"  # the app page can't be used
+
+
+class LedgerEntry(NamedTuple):
+    """The outcome of one attempt at scraping an app."""
+
+    app_id: str
+    state: AppState
+    category: Optional[str] = None
+    message: Optional[str] = None
+
+
+_PERMANENT_STATUSES = {404, 410}  # HTTP statuses of apps missing from the store
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS apps (
+    app_id TEXT PRIMARY KEY,
+    state TEXT NOT NULL,
+    category TEXT,
+    message TEXT,
+    attempts INTEGER NOT NULL,
+    updated REAL NOT NULL
+)
+"""
+
+_UPSERT = """
+INSERT INTO apps (app_id, state, category, message, attempts, updated)
+VALUES (?, ?, ?, ?, 1, ?)
+ON CONFLICT (app_id) DO UPDATE SET
+    state = excluded.state,
+    category = excluded.category,
+    message = excluded.message,
+    attempts = apps.attempts + 1,
+    updated = excluded.updated
+"""
+
+
+class WorkLedger:
+    """A persistent (SQLite) record of the state of every app id the
+    scraper has attempted, so that an interrupted or repeated crawl only
+    schedules the remaining work.
+
+    The ledger can be shared by several processes: each one opens its
+    own connection on first use (connections are not pickled).
+    """
+
+    _TIMEOUT = 60  # seconds to wait for other processes' write locks
+
+    def __init__(self, file: pathlib.Path, max_attempts: int = 3):
+        """Constructor.
+
+        :param file: the SQLite database file
+        :param max_attempts: number of attempts after which apps failing
+        with retryable errors are not scheduled anymore
+        """
+        self._file = file
+        self._max_attempts = max_attempts
+        self._connection = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        return state
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            # the async scraper records the entries from another thread
+            self._connection = sqlite3.connect(self._file, timeout=self._TIMEOUT,
+                                               check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(_SCHEMA)
+        return self._connection
+
+    def record(self, entries: Iterable[LedgerEntry]) -> None:
+        """Records the outcome of scraping some apps, in one transaction.
+
+        :param entries: the outcomes to record
+        """
+        now = time.time()
+        rows = [(entry.app_id, entry.state.value, entry.category, entry.message, now)
+                for entry in entries]
+
+        with self._connect() as connection:
+            connection.executemany(_UPSERT, rows)
+
+    def get_state(self, app_id: str) -> Optional[AppState]:
+        """Looks up the last recorded state of an app.
+
+        :param app_id: the id of the app
+        :return: the state of the app; None if it was never attempted
+        """
+        row = self._connect().execute(
+            "SELECT state FROM apps WHERE app_id = ?", (app_id,)).fetchone()
+        return None if row is None else AppState(row[0])
+
+    def get_pending(self, app_ids: Iterable[str],
+                    category_filter: Optional[List[str]] = None) -> List[str]:
+        """Filters out the apps which don't need to be scraped again: the
+        stored ones, the permanently failed ones, the ones which failed
+        max_attempts times and the ones filtered out by a category which
+        is still not part of category_filter.
+
+        :param app_ids: the apps to be scraped
+        :param category_filter: the category filter of the current crawl
+        :return: the apps still to be scraped, in the original order
+        """
+        finished = set()
+        rows = self._connect().execute("SELECT app_id, state, category, attempts FROM apps")
+
+        for app_id, state, category, attempts in rows:
+            if _is_finished(AppState(state), category, attempts,
+                            self._max_attempts, category_filter):
+                finished.add(app_id)
+
+        return [app_id for app_id in app_ids if app_id not in finished]
+
+    def count_states(self) -> Dict[AppState, int]:
+        """Counts the apps in every state.
+
+        :return: a state to number of apps mapping
+        """
+        rows = self._connect().execute("SELECT state, COUNT(*) FROM apps GROUP BY state")
+        return {AppState(state): count for state, count in rows}
+
+
+def _is_finished(state: AppState, category: Optional[str], attempts: int,
+                 max_attempts: int, category_filter: Optional[List[str]]) -> bool:
+    if state == AppState.FAILED_RETRYABLE:
+        return attempts >= max_attempts
+    if state == AppState.FILTERED:
+        return category_filter is not None and category not in category_filter
+    return True
+
+
+def get_failure_state(exception: betel_errors.BetelError) -> AppState:
+    """Tells whether scraping an app is worth retrying after an error.
+
+    :param exception: the error raised while scraping the app
+    :return: the corresponding failure state
+    """
+    if isinstance(exception, betel_errors.AccessError):
+        if exception.status in _PERMANENT_STATUSES:
+            return AppState.FAILED_PERMANENT
+        return AppState.FAILED_RETRYABLE
+    return AppState.FAILED_PERMANENT
@@ -1,8 +1,13 @@
+import logging
 import pathlib
+import multiprocessing
+from test import play_store_stub
 import pytest
 from betel import app_page_scraper
 from betel import betel_errors
 from betel import utils
+from betel import info_files_helpers
+from betel import work_ledger
 
 ICON_HTML = """
 <img src="%s" class="T75of sHb2Xb">
@@ -69,6 +74,35 @@ class TestAppPageScraper:
 
         assert genre == EXPECTED_CATEGORY
 
+    def test_get_app_details(self, play_scraper, test_dir):
+        _create_html_file(test_dir, ICON_HTML + CATEGORY_HTML, icon_src=True)
+
+        details = play_scraper.get_app_details(APP_ID)
+
+        assert details.app_id == APP_ID
+        assert details.category == EXPECTED_CATEGORY
+        assert details.icon_url == FILE + str(test_dir / ICON_NAME)
+
+    def test_get_app_details_missing_fields(self, play_scraper, test_dir):
+        _create_html_file(test_dir, SIMPLE_HTML)
+
+        details = play_scraper.get_app_details(APP_ID)
+
+        assert details.category is None
+        assert details.icon_url is None
+
+    def test_app_page_is_downloaded_once(self, play_scraper, test_dir, monkeypatch):
+        downloaded_urls = _count_downloads(monkeypatch)
+
+        _create_html_file(test_dir, ICON_HTML + CATEGORY_HTML, icon_src=True)
+        _create_icon(test_dir)
+
+        play_scraper.store_app_info(APP_ID)
+        play_scraper.get_app_category(APP_ID)
+        play_scraper.get_app_icon(APP_ID)
+
+        assert len(downloaded_urls) == 1
+
     def test_missing_icon_class(self, play_scraper, test_dir):
         _create_html_file(test_dir, SIMPLE_HTML)
 
@@ -118,6 +152,103 @@ class TestAppPageScraper:
         assert rand_icon.read_text() == retrieved_icon.read_text()
         assert expected_info in info_file.read_text()
 
+    def test_store_app_info_skips_stored_app(self, play_scraper, test_dir, icon_dir):
+        info_file = icon_dir / utils.SCRAPER_INFO_FILE_NAME
+        info_file.write_text(f"app_id,category\n{APP_ID},{EXPECTED_CATEGORY}\n")
+
+        _create_html_file(test_dir, ICON_HTML + CATEGORY_HTML, icon_src=True)
+        _create_icon(test_dir)
+
+        play_scraper.store_app_info(APP_ID)
+
+        assert not (icon_dir / ICON_NAME).exists()
+
+    def test_store_app_info_records_state(self, play_scraper, test_dir, icon_dir):
+        _create_html_file(test_dir, ICON_HTML + CATEGORY_HTML, icon_src=True)
+        _create_icon(test_dir)
+
+        play_scraper.store_app_info(APP_ID)
+
+        ledger = work_ledger.WorkLedger(icon_dir / utils.SCRAPER_LEDGER_FILE_NAME)
+
+        assert ledger.get_state(APP_ID) == work_ledger.AppState.DONE
+
+    def test_store_apps_info_skips_finished_apps(self, play_scraper, test_dir, icon_dir):
+        _create_html_file(test_dir, ICON_HTML + FILTERED_CATEGORY_HTML, icon_src=True)
+        _create_icon(test_dir)
+
+        play_scraper.store_apps_info([APP_ID])
+
+        _create_html_file(test_dir, ICON_HTML + CATEGORY_HTML, icon_src=True)
+
+        play_scraper.store_apps_info([APP_ID])
+
+        ledger = work_ledger.WorkLedger(icon_dir / utils.SCRAPER_LEDGER_FILE_NAME)
+
+        assert ledger.get_state(APP_ID) == work_ledger.AppState.FILTERED
+        assert not (icon_dir / ICON_NAME).exists()
+
+    def test_summary_counts_the_apps_of_the_run(self, icon_dir, caplog):
+        caplog.set_level(logging.INFO)
+
+        with play_store_stub.PlayStoreStub() as stub:
+            play_scraper = app_page_scraper.PlayAppPageScraper(stub.store_url, icon_dir)
+            play_scraper.store_apps_info([APP_ID])
+            caplog.clear()
+            play_scraper.store_apps_info([APP_ID, "com.other"])
+
+        assert "done apps: 1" in caplog.text
+        assert "done apps in total: 2" in caplog.text
+
+    def test_summary_is_logged_whatever_the_root_level(self, icon_dir, caplog):
+        # e.g. logging configured before the scraper, at the default level
+        root_logger = logging.getLogger()
+        root_level = root_logger.level
+        root_logger.setLevel(logging.WARNING)
+
+        try:
+            with play_store_stub.PlayStoreStub() as stub:
+                play_scraper = app_page_scraper.PlayAppPageScraper(stub.store_url, icon_dir)
+                play_scraper.store_apps_info([APP_ID])
+        finally:
+            root_logger.setLevel(root_level)
+
+        assert "done apps: 1" in caplog.text
+        assert "filtered apps: 0" in caplog.text
+        assert "icon cache: 0 hits (0 not modified, 0 unchanged), 1 misses" in caplog.text
+
+    def test_store_apps_info_reads_info_file_once(self, icon_dir, monkeypatch):
+        # shared with the forked worker processes
+        reads = multiprocessing.Value("i", 0)
+        read_column = info_files_helpers._read_column
+
+        def counting_read_column(file, key):
+            with reads.get_lock():
+                reads.value += 1
+            return read_column(file, key)
+
+        monkeypatch.setattr(info_files_helpers, "_read_column", counting_read_column)
+        app_ids = [f"com.example{index}" for index in range(400)]
+
+        with play_store_stub.PlayStoreStub() as stub:
+            play_scraper = app_page_scraper.PlayAppPageScraper(stub.store_url, icon_dir)
+            play_scraper.store_apps_info(app_ids)
+
+        assert reads.value == 1
+        assert len(play_scraper._info_index) == 400
+
+    def test_refresh_icons(self, icon_dir, caplog):
+        caplog.set_level(logging.INFO)
+
+        with play_store_stub.PlayStoreStub() as stub:
+            play_scraper = app_page_scraper.PlayAppPageScraper(stub.store_url, icon_dir)
+
+            play_scraper.store_apps_info([APP_ID])
+            play_scraper.refresh_icons([APP_ID, "com.not.stored"])
+
+        assert "icon cache: 1 hits (1 not modified, 0 unchanged), 0 misses" in caplog.text
+        assert (icon_dir / ICON_NAME).read_bytes() == play_store_stub.ICON_BYTES
+
     def test_store_app_info_filter(self, play_scraper, test_dir, icon_dir):
         _create_html_file(test_dir, ICON_HTML + FILTERED_CATEGORY_HTML, icon_src=True)
         _create_icon(test_dir)
@@ -139,6 +270,19 @@ def _create_html_file(test_dir, text, icon_src=False):
     html_file.write_text(text)
 
 
+def _count_downloads(monkeypatch):
+    downloaded_urls = []
+    get_html = app_page_scraper._get_html
+
+    def counting_get_html(url):
+        downloaded_urls.append(url)
+        return get_html(url)
+
+    monkeypatch.setattr(app_page_scraper, "_get_html", counting_get_html)
+
+    return downloaded_urls
+
+
 def _create_icon(test_dir):
     rand_array = str([15, 934, 8953, 409, 32])
     rand_icon = test_dir / ICON_NAME
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+from test import play_store_stub
+import pytest
+import pandas as pd
+from betel import async_app_page_scraper
+from betel import app_page_scraper
+from betel import utils
+from betel import request_throttling
+
+APP_IDS = ["com.example", "com.test", "com.play", "com.store"]
+MISSING_APP_ID = "com.missing"
+
+
+@pytest.fixture
+def storage_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp("storage_dir")
+
+
+@pytest.fixture
+def stub():
+    with play_store_stub.PlayStoreStub(missing_app_ids=[MISSING_APP_ID]) as server:
+        yield server
+
+
+def _get_scraper(stub, storage_dir, category_filter=None):
+    return async_app_page_scraper.AsyncPlayAppPageScraper(
+        stub.store_url, storage_dir, category_filter, max_concurrency=3, per_host_limit=2
+    )
+
+
+class TestAsyncAppPageScraper:
+    def test_store_apps_info(self, stub, storage_dir):
+        scraper = _get_scraper(stub, storage_dir)
+
+        scraper.store_apps_info(APP_IDS)
+
+        info = pd.read_csv(storage_dir / utils.SCRAPER_INFO_FILE_NAME)
+
+        assert sorted(info["app_id"]) == sorted(APP_IDS)
+        assert (info["category"] == "example").all()
+
+        for app_id in APP_IDS:
+            icon = storage_dir / utils.get_app_icon_name(app_id)
+            assert icon.read_bytes() == play_store_stub.ICON_BYTES
+
+    def test_store_apps_info_filter(self, stub, storage_dir):
+        scraper = _get_scraper(stub, storage_dir, ["filtered"])
+
+        scraper.store_apps_info(APP_IDS)
+
+        assert not (storage_dir / utils.SCRAPER_INFO_FILE_NAME).exists()
+        assert not (storage_dir / utils.get_app_icon_name(APP_IDS[0])).exists()
+
+    def test_missing_app_is_skipped(self, stub, storage_dir, caplog):
+        scraper = _get_scraper(stub, storage_dir)
+
+        scraper.store_apps_info([APP_IDS[0], MISSING_APP_ID])
+
+        info = pd.read_csv(storage_dir / utils.SCRAPER_INFO_FILE_NAME)
+
+        assert list(info["app_id"]) == [APP_IDS[0]]
+        assert "Can not open URL." in caplog.text
+
+    def test_workers_record_shared_batches_off_the_event_loop(self, stub, storage_dir,
+                                                               monkeypatch):
+        scraper = _get_scraper(stub, storage_dir)
+        monkeypatch.setattr(scraper, "_BATCH_SIZE", 2)
+        record = scraper._record
+        batches = []
+
+        def recording_record(entries):
+            batches.append((len(entries), threading.get_ident()))
+            record(entries)
+
+        monkeypatch.setattr(scraper, "_record", recording_record)
+
+        scraper.store_apps_info(APP_IDS + [MISSING_APP_ID])
+
+        # the 3 workers fill the same batches, written in another thread
+        assert [size for size, _ in batches] == [2, 2, 1]
+        assert all(thread != threading.get_ident() for _, thread in batches)
+        assert pd.read_csv(storage_dir / utils.SCRAPER_INFO_FILE_NAME)["app_id"].count() == 4
+
+    def test_cache_hit_is_evicted_last(self, stub, storage_dir, monkeypatch):
+        scraper = _get_scraper(stub, storage_dir)
+        monkeypatch.setattr(scraper, "_DETAILS_CACHE_SIZE", 2)
+        for app_id in APP_IDS[:2]:
+            scraper._cache_app_details(app_page_scraper.AppDetails(app_id))
+
+        asyncio.run(scraper._get_app_details_async(None, APP_IDS[0]))
+        scraper._cache_app_details(app_page_scraper.AppDetails(APP_IDS[2]))
+
+        assert list(scraper._details_cache) == [APP_IDS[0], APP_IDS[2]]
+
+    def test_stored_apps_are_not_fetched_again(self, stub, storage_dir):
+        scraper = _get_scraper(stub, storage_dir)
+
+        scraper.store_apps_info(APP_IDS)
+        requests_no = len(stub.requests)
+        scraper.store_apps_info(APP_IDS)
+
+        assert len(stub.requests) == requests_no
+
+    def test_throttled_requests_are_retried(self, storage_dir):
+        retry_policy = request_throttling.RetryPolicy(base_delay=0.01)
+
+        with play_store_stub.PlayStoreStub(throttled_requests=3) as stub:
+            scraper = async_app_page_scraper.AsyncPlayAppPageScraper(
+                stub.store_url, storage_dir, retry_policy=retry_policy
+            )
+
+            scraper.store_apps_info(APP_IDS)
+
+        info = pd.read_csv(storage_dir / utils.SCRAPER_INFO_FILE_NAME)
+
+        assert sorted(info["app_id"]) == sorted(APP_IDS)
@@ -0,0 +1,20 @@
+import numpy as np
+import pytest
+from betel import backbones
+from betel import model_training
+
+
+class TestBackbones:
+    def test_unknown_backbone(self):
+        with pytest.raises(ValueError):
+            backbones.get_backbone("vgg16")
+
+    @pytest.mark.parametrize("name", ["mobilenet_v2", "efficientnet_b0"])
+    def test_define_model(self, name):
+        model, base_model = model_training.define_model(backbone=name, input_dim=64,
+                                                        weights=None)
+
+        predictions = model.predict_on_batch(np.zeros((2, 64, 64, 3), dtype=np.uint8))
+
+        assert predictions.shape == (2, 1)
+        assert base_model.input_shape == (None, 64, 64, 3)
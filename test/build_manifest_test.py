@@ -0,0 +1,79 @@
+import pytest
+import pandas as pd
+from betel import build_manifest
+
+BUILT_APPS = pd.DataFrame({
+    "app_id": ["com.kept", "com.moved", "com.changed", "com.removed"],
+    "data_set": ["train", "validation", "test", "train"],
+    "category": ["example", "example", "play", "play"],
+    "content_hash": ["hash0", "hash1", "hash2", "hash3"],
+    "icon_size": [10, 11, 12, 13],
+    "icon_mtime_ns": [1792000000000000001, 1792000000000000002, 1792000000000000003,
+                      1792000000000000004],
+    "perceptual_hash": ["dhash:00000000000000ff", "", "", ""]
+})
+
+CURRENT_APPS = pd.DataFrame({
+    "app_id": ["com.kept", "com.moved", "com.changed", "com.added"],
+    "category": ["example", "play", "play", "example"],
+    "icon_size": [10, 11, 12, 14],
+    "icon_mtime_ns": [1792000000000000001, 1792000000000000002, 1792000000000000013,
+                      1792000000000000005]
+})
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    return build_manifest.BuildManifest(tmp_path / "manifest")
+
+
+class TestBuildManifest:
+    def test_save_and_load(self, manifest):
+        assert not manifest.exists()
+
+        manifest.save(BUILT_APPS)
+
+        assert manifest.exists()
+        assert manifest.load().equals(BUILT_APPS)
+
+        manifest.discard()
+
+        assert not manifest.exists()
+
+    def test_update(self, manifest):
+        manifest.save(BUILT_APPS)
+        manifest.load()
+
+        apps = pd.concat([BUILT_APPS.iloc[1:], BUILT_APPS.iloc[:1].assign(data_set="test")])
+        manifest.update(apps, pd.Series(["com.kept", "com.missing"]))
+        rows_no = len(manifest._file.read_text().splitlines())
+
+        # the changed rows are appended, and the removed app is forgotten
+        assert rows_no == 1 + 4 + 2
+        assert manifest.load().sort_values("app_id", ignore_index=True).equals(
+            apps.sort_values("app_id", ignore_index=True))
+
+    def test_manifest_without_perceptual_hashes(self, manifest):
+        manifest.save(BUILT_APPS)
+        rows = pd.read_csv(manifest._file).drop(columns=build_manifest.PERCEPTUAL_HASH_COLUMN)
+        rows.to_csv(manifest._file, index=False)
+
+        apps = manifest.load()
+        assert (apps[build_manifest.PERCEPTUAL_HASH_COLUMN] == "").all()
+
+        # the first update rewrites the manifest (instead of appending rows with another header)
+        manifest.update(apps.iloc[:3], pd.Series(["com.removed"]))
+        assert manifest.load().equals(apps.iloc[:3])
+        assert len(manifest._file.read_text().splitlines()) == 1 + 3
+
+    def test_diff(self):
+        changes = build_manifest.diff(BUILT_APPS, CURRENT_APPS)
+
+        assert changes.added["app_id"].tolist() == ["com.added"]
+        assert changes.removed["app_id"].tolist() == ["com.removed"]
+        assert changes.updated["app_id"].tolist() == ["com.moved", "com.changed"]
+        assert changes.updated["category"].tolist() == ["play", "play"]
+        assert changes.updated["data_set"].tolist() == ["validation", "test"]
+        # the exact modification time is kept
+        assert changes.updated["icon_mtime_ns"].tolist()[1] == 1792000000000000013
+        assert changes.previous_categories.tolist() == ["example", "play"]
@@ -1,8 +1,13 @@
+import os
 import csv
 import pytest
 import pandas as pd
+from betel import build_manifest
 from betel import classifier_data_set_builder
+from betel import data_set_builder
+from betel import icon_store
 from betel import utils
+from test.near_duplicates_test import create_icon
 
 CSV = """app_id,category
 com.example,example
@@ -115,6 +120,295 @@ class TestClassifierDataSetBuilder:
         for info in expected_info:
             assert info["info"] in info["file"].read_text()
 
+    def test_identical_icons_are_stored_once(self, classifier_builder, input_dir,
+                                             expected_icons):
+        input_file = input_dir / utils.SCRAPER_INFO_FILE_NAME
+        input_file.write_text(CSV)
+
+        _create_icons(APP_LIST, input_dir)
+
+        classifier_builder.split_and_build_data_sets()
+
+        assert len({icon.stat().st_ino for icon in expected_icons}) == 1
+
+    @pytest.mark.parametrize("classes", [None, CLASSES])
+    def test_bulk_build_matches_row_build(self, input_dir, tmp_path_factory, classes):
+        input_file = input_dir / utils.SCRAPER_INFO_FILE_NAME
+        input_file.write_text(CSV)
+
+        _create_icons(APP_LIST.iloc[1:], input_dir)  # com.example has no icon
+
+        storage_dirs = []
+        for bulk in [False, True]:
+            storage_dir = tmp_path_factory.mktemp("storage_dir")
+            classifier_builder = classifier_data_set_builder.ClassifierDataSetBuilder(
+                input_dir, storage_dir, classes=classes, bulk=bulk
+            )
+            classifier_builder.split_and_build_data_sets()
+            classifier_builder.split_and_build_data_sets()  # nothing is added twice
+            storage_dirs.append(storage_dir)
+
+        row_files, bulk_files = [_list_files(storage_dir) for storage_dir in storage_dirs]
+
+        assert row_files == bulk_files
+        for info_file in (storage_dirs[0] / "info").iterdir():
+            bulk_info_file = storage_dirs[1] / "info" / info_file.name
+            assert sorted(info_file.read_text().splitlines()) == \
+                sorted(bulk_info_file.read_text().splitlines())
+
+    def test_split_keeps_groups_together(self, classifier_builder):
+        app_list = pd.DataFrame({"app_id": [f"com.app{index}" for index in range(1000)],
+                                 "category": "example",
+                                 data_set_builder.GROUP_COLUMN: [f"group{index // 7}"
+                                                                 for index in range(1000)]})
+
+        split = classifier_builder.split(app_list)
+
+        groups = [set(split[data_set][data_set_builder.GROUP_COLUMN]) for data_set in split]
+        assert sum(len(elements) for elements in split.values()) == 1000
+        assert not (groups[0] & groups[1] or groups[0] & groups[2] or groups[1] & groups[2])
+        assert len(split["train"]) == pytest.approx(700, abs=7)
+        assert len(split["validation"]) == pytest.approx(150, abs=7)
+
+    def test_hash_split_is_stable(self, input_dir, storage_dir):
+        app_list = pd.DataFrame({"app_id": [f"com.app{index}" for index in range(1000)],
+                                 "category": "example"})
+        classifier_builder = classifier_data_set_builder.ClassifierDataSetBuilder(
+            input_dir, storage_dir, split_method="hash"
+        )
+
+        split = classifier_builder.split(app_list)
+        # apps added later do not move the others
+        later_split = classifier_builder.split(app_list.iloc[::-1].iloc[:600])
+
+        assert len(split["train"]) == pytest.approx(700, abs=50)
+        assert len(split["validation"]) == pytest.approx(150, abs=40)
+        for data_set in split:
+            assert set(later_split[data_set]["app_id"]) <= set(split[data_set]["app_id"])
+
+    @pytest.mark.parametrize("classes", [None, ["example"]])
+    def test_stratified_hash_split(self, input_dir, storage_dir, classes):
+        categories = ["example"] * 900 + ["rare"] * 7 + ["play"] * 13 + ["store"] * 80
+        app_list = pd.DataFrame({"app_id": [f"com.app{index}" for index in range(1000)],
+                                 "category": categories})
+        classifier_builder = classifier_data_set_builder.ClassifierDataSetBuilder(
+            input_dir, storage_dir, classes=classes, split_method="hash", stratify=True
+        )
+
+        split = classifier_builder.split(app_list)
+
+        for data_set, ratio in [("train", 0.7), ("validation", 0.15), ("test", 0.15)]:
+            counts = split[data_set]["category"].value_counts()
+            assert counts["example"] == pytest.approx(900 * ratio, abs=1)
+            if classes is None:
+                assert counts["rare"] >= 1
+                assert counts["store"] == pytest.approx(80 * ratio, abs=1)
+            else:
+                others = counts.drop("example").sum()
+                assert others == pytest.approx(100 * ratio, abs=1)
+
+    def test_incremental_stratified_hash_split(self, input_dir, storage_dir):
+        categories = ["example"] * 900 + ["rare"] * 7 + ["play"] * 13 + ["store"] * 80
+        app_list = pd.DataFrame({"app_id": [f"com.app{index}" for index in range(1000)],
+                                 "category": categories}).sample(frac=1, random_state=0)
+        classifier_builder = classifier_data_set_builder.ClassifierDataSetBuilder(
+            input_dir, storage_dir, split_method="hash", stratify=True
+        )
+
+        split = classifier_builder.split(app_list)
+        # the apps are added a few at a time, every split counting the placed ones
+        placed = pd.DataFrame(columns=["app_id", "category", "data_set"])
+        for start in range(0, 1000, 3):
+            part_split = classifier_builder.split(app_list.iloc[start:start + 3], placed)
+            placed = pd.concat([placed] + [elements.assign(data_set=data_set)
+                                           for data_set, elements in part_split.items()])
+
+        for data_set in split:
+            counts = split[data_set]["category"].value_counts()
+            placed_counts = placed.loc[placed["data_set"] == data_set, "category"].value_counts()
+            assert placed_counts.sort_index().equals(counts.sort_index())
+            assert counts["rare"] >= 1
+            assert counts["store"] == pytest.approx(80 * len(split[data_set]) / 1000, abs=2)
+
+    def test_hash_split_keeps_groups_together(self, input_dir, storage_dir):
+        app_list = pd.DataFrame({"app_id": [f"com.app{index}" for index in range(1000)],
+                                 "category": ["example", "play"] * 500,
+                                 data_set_builder.GROUP_COLUMN: [f"group{index // 7}"
+                                                                 for index in range(1000)]})
+        classifier_builder = classifier_data_set_builder.ClassifierDataSetBuilder(
+            input_dir, storage_dir, split_method="hash", stratify=True
+        )
+
+        split = classifier_builder.split(app_list)
+
+        groups = [set(split[data_set][data_set_builder.GROUP_COLUMN]) for data_set in split]
+        assert sum(len(elements) for elements in split.values()) == 1000
+        assert not (groups[0] & groups[1] or groups[0] & groups[2] or groups[1] & groups[2])
+
+    def test_unknown_split_method(self, input_dir, storage_dir):
+        with pytest.raises(ValueError):
+            classifier_data_set_builder.ClassifierDataSetBuilder(input_dir, storage_dir,
+                                                                 split_method="random")
+
+    @pytest.mark.parametrize("deduplicate", [False, True])
+    def test_near_duplicates(self, input_dir, storage_dir, deduplicate):
+        app_list = pd.DataFrame({"app_id": [f"com.app{index}" for index in range(40)],
+                                 "category": "example"})
+        info_file = input_dir / utils.SCRAPER_INFO_FILE_NAME
+        app_list.to_csv(info_file, index=False)
+
+        # every app has a near duplicate (its icon at another size)
+        for index, app_id in enumerate(app_list["app_id"]):
+            create_icon(index // 2, 180 if index % 2 else 96).save(
+                input_dir / utils.get_app_icon_name(app_id), "png")
+
+        classifier_builder = classifier_data_set_builder.ClassifierDataSetBuilder(
+            input_dir, storage_dir, near_duplicate_distance=4, deduplicate=deduplicate,
+            num_threads=2
+        )
+        classifier_builder.split_and_build_data_sets()
+
+        data_sets = {icon.name: data_set for data_set in ("train", "validation", "test")
+                     for icon in (storage_dir / data_set).rglob("icon_*")}
+        pairs = [(utils.get_app_icon_name(f"com.app{index}"),
+                  utils.get_app_icon_name(f"com.app{index + 1}")) for index in range(0, 40, 2)]
+        if deduplicate:
+            assert sorted(data_sets) == sorted(first for first, _ in pairs)
+        else:
+            assert len(data_sets) == 40
+            assert all(data_sets[first] == data_sets[second] for first, second in pairs)
+
+    @pytest.mark.parametrize("deduplicate", [False, True])
+    def test_update_places_near_duplicates_of_built_icons(self, input_dir, storage_dir,
+                                                          deduplicate):
+        input_file = input_dir / utils.SCRAPER_INFO_FILE_NAME
+        app_list = pd.DataFrame({"app_id": [f"com.app{index}" for index in range(40)],
+                                 "category": "example"})
+        # the second half of the apps are near duplicates of the first half
+        for index, app_id in enumerate(app_list["app_id"]):
+            create_icon(index % 20, 180 if index >= 20 else 96).save(
+                input_dir / utils.get_app_icon_name(app_id), "png")
+
+        classifier_builder = classifier_data_set_builder.ClassifierDataSetBuilder(
+            input_dir, storage_dir, near_duplicate_distance=4, deduplicate=deduplicate,
+            num_threads=2
+        )
+        app_list.iloc[:20].to_csv(input_file, index=False)
+        classifier_builder.split_and_build_data_sets()
+        # the built icons are hashed by the first update
+        app_list.to_csv(input_file, index=False)
+        classifier_builder.update_data_sets()
+
+        data_sets = {icon.name: data_set for data_set in data_set_builder.DATA_SETS
+                     for icon in (storage_dir / data_set).rglob("icon_*")}
+        pairs = [(utils.get_app_icon_name(f"com.app{index}"),
+                  utils.get_app_icon_name(f"com.app{index + 20}")) for index in range(20)]
+        if deduplicate:
+            assert sorted(data_sets) == sorted(built for built, _ in pairs)
+        else:
+            assert len(data_sets) == 40
+            assert all(data_sets[built] == data_sets[added] for built, added in pairs)
+
+        # the hashes are recorded, so that the next updates don't hash the icons again
+        manifest = build_manifest.BuildManifest(
+            storage_dir / utils.CLASSIFIER_DATA_BUILDER_MANIFEST_FILE_NAME).load()
+        built = manifest[manifest["data_set"] != build_manifest.EXCLUDED]
+        assert len(built) == len(data_sets)
+        assert built[build_manifest.PERCEPTUAL_HASH_COLUMN].str.startswith("dhash:").all()
+
+    def test_update_matches_full_build(self, input_dir, tmp_path_factory):
+        input_file = input_dir / utils.SCRAPER_INFO_FILE_NAME
+        input_file.write_text(CSV)
+
+        _create_icons(APP_LIST, input_dir)
+
+        storage_dirs = [tmp_path_factory.mktemp("storage_dir") for _ in range(2)]
+        classifier_data_set_builder.ClassifierDataSetBuilder(
+            input_dir, storage_dirs[0], bulk=True).split_and_build_data_sets()
+        counts = classifier_data_set_builder.ClassifierDataSetBuilder(
+            input_dir, storage_dirs[1]).update_data_sets()
+
+        assert counts == {"added": 5, "updated": 0, "removed": 0}
+        assert _list_files(storage_dirs[0]) == _list_files(storage_dirs[1])
+
+    def test_update_handles_changes_only(self, classifier_builder, input_dir, storage_dir):
+        input_file = input_dir / utils.SCRAPER_INFO_FILE_NAME
+        input_file.write_text(CSV)
+        _create_icons(APP_LIST, input_dir)
+        (input_dir / utils.get_app_icon_name("com.page")).write_bytes(b"page icon")
+        (input_dir / utils.get_app_icon_name("com.test")).write_bytes(b"test icon")
+
+        classifier_builder.update_data_sets()
+        files = _list_files(storage_dir)
+
+        # com.page is removed, com.store moves to "play", com.test has a new
+        # icon and com.new is added
+        input_file.write_text(CSV.replace("com.page,page", "com.new,page")
+                              .replace("com.store,store", "com.store,play"))
+        # the scraper replaces the icons (which are linked into the store)
+        test_icon = input_dir / utils.get_app_icon_name("com.test")
+        test_icon.unlink()
+        test_icon.write_bytes(b"new icon")
+        os.utime(test_icon, ns=(0, 1))
+        (input_dir / utils.get_app_icon_name("com.new")).touch()
+        (input_dir / utils.get_app_icon_name("com.page")).unlink()
+
+        counts = classifier_builder.update_data_sets()
+        new_files = _list_files(storage_dir)
+
+        assert counts == {"added": 1, "updated": 2, "removed": 1}
+        assert "train/page/icon_com.page" not in new_files
+        assert "test/store/icon_com.store" not in new_files
+        assert "test/play/icon_com.store" in new_files
+        assert len(new_files) == len(files)
+        assert (storage_dir / "validation" / "example" / "icon_com.test").read_bytes() == \
+            b"new icon"
+        assert "com.page" not in (storage_dir / "info" / "page").read_text()
+        assert "com.store" not in (storage_dir / "info" / "store").read_text()
+        assert "com.store,test" in (storage_dir / "info" / "play").read_text()
+        # the blobs of com.page's icon and of com.test's previous one are deleted
+        store = icon_store.IconStore(storage_dir / utils.CLASSIFIER_DATA_BUILDER_ICON_STORE_DIR)
+        assert not store.get_blob(utils.get_content_hash(b"page icon")).exists()
+        assert not store.get_blob(utils.get_content_hash(b"test icon")).exists()
+        assert store.get_blob(utils.get_content_hash(b"new icon")).exists()
+
+        assert classifier_builder.update_data_sets() == {"added": 0, "updated": 0, "removed": 0}
+
+    def test_updates_keep_stratified_ratios(self, input_dir, storage_dir):
+        input_file = input_dir / utils.SCRAPER_INFO_FILE_NAME
+        classifier_builder = classifier_data_set_builder.ClassifierDataSetBuilder(
+            input_dir, storage_dir, split_method="hash", stratify=True
+        )
+
+        # every update adds a single app
+        for index in range(20):
+            app_list = pd.DataFrame({"app_id": [f"com.app{index}" for index in range(index + 1)],
+                                     "category": "example"})
+            app_list.to_csv(input_file, index=False)
+            _create_icons(app_list.iloc[-1:], input_dir)
+            classifier_builder.update_data_sets()
+
+        data_sets = [file.split("/")[0] for file in _list_files(storage_dir)]
+        assert [data_sets.count(data_set) for data_set in data_set_builder.DATA_SETS] == \
+            [14, 3, 3]
+
+    def test_first_update_of_full_build(self, classifier_builder, input_dir, storage_dir):
+        input_file = input_dir / utils.SCRAPER_INFO_FILE_NAME
+        input_file.write_text(CSV)
+        _create_icons(APP_LIST, input_dir)
+
+        classifier_builder.split_and_build_data_sets()
+        files = _list_files(storage_dir)
+
+        # the icons of data sets built without manifest are relinked once
+        assert classifier_builder.update_data_sets() == {"added": 0, "updated": 5, "removed": 0}
+        assert classifier_builder.update_data_sets() == {"added": 0, "updated": 0, "removed": 0}
+        assert _list_files(storage_dir) == files
+
+
+def _list_files(storage_dir):
+    return {str(path.relative_to(storage_dir)) for path in storage_dir.rglob("icon_*")}
+
 
 def _create_icons(app_list, input_dir):
     for _, app in app_list.iterrows():
@@ -0,0 +1,61 @@
+import collections
+import numpy as np
+import pytest
+from test import icon_builder as ib
+from betel import classifier_dataset
+from betel import classifier_sequence
+
+
+@pytest.fixture
+def input_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp("input_dir")
+
+
+class TestClassifierDataset:
+    @pytest.mark.parametrize("image_size", [(180, 180), (200, 220), (192, 150), (170, 230)])
+    def test_batches_match_sequence(self, input_dir, image_size):
+        ib.IconBuilder(input_dir, image_size, random_content=True).create_icons(
+            num_icons=7, num_categories=2)
+
+        sequence = classifier_sequence.ClassifierSequence(input_dir, 3, 192, shuffle=False,
+                                                          num_threads=2)
+        dataset = classifier_dataset.build_dataset(input_dir, 3, 192, shuffle=False)
+
+        batches = list(dataset.as_numpy_iterator())
+
+        assert len(batches) == len(sequence)
+        for idx, (batch_x, batch_y) in enumerate(batches):
+            expected_x, expected_y = sequence[idx]
+
+            assert batch_x.dtype == np.uint8
+            assert np.array_equal(batch_x, expected_x)
+            assert np.array_equal(batch_y, expected_y)
+
+    @pytest.mark.parametrize("cache", [None, ""])
+    def test_shuffled_epochs_keep_every_icon(self, input_dir, cache):
+        ib.IconBuilder(input_dir).create_icons(num_icons=12, num_categories=3)
+
+        dataset = classifier_dataset.build_dataset(input_dir, 5, 192, cache=cache,
+                                                   shuffle_buffer=4)
+
+        for _ in range(2):
+            labels = np.concatenate([batch_y for _, batch_y in dataset.as_numpy_iterator()])
+
+            assert len(labels) == 15  # 3 full batches
+            assert sorted(collections.Counter(labels).values()) == [4, 4, 7]  # 3 padding icons
+
+    def test_cache_file(self, input_dir, tmp_path):
+        ib.IconBuilder(input_dir, random_content=True).create_icons(num_icons=4)
+        cache = tmp_path / "cache"
+
+        dataset = classifier_dataset.build_dataset(input_dir, 2, 192, shuffle=False,
+                                                   cache=str(cache))
+        first_epoch = [batch_x for batch_x, _ in dataset.as_numpy_iterator()]
+        second_epoch = [batch_x for batch_x, _ in dataset.as_numpy_iterator()]
+
+        assert list(tmp_path.glob("cache*"))
+        assert all(np.array_equal(a, b) for a, b in zip(first_epoch, second_epoch))
+
+    def test_missing_input_dir(self, tmp_path):
+        with pytest.raises(ValueError):
+            classifier_dataset.build_dataset(tmp_path / "missing", 2, 192)
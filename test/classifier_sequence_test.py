@@ -1,4 +1,5 @@
 import collections
+import numpy as np
 from test import icon_builder as ib
 import pytest
 from betel import classifier_sequence
@@ -66,3 +67,124 @@ def _get_sequence(icon_builder, batch_size, num_icons, num_categories=1):
 
     sequence = classifier_sequence.ClassifierSequence(icon_builder.input_dir, batch_size, 192)
     return sequence
+
+
+class TestParallelClassifierSequence:
+    @pytest.mark.parametrize("image_size", [(180, 180), (200, 220), (192, 150)])
+    def test_batches_match_sequential_loading(self, input_dir, image_size):
+        ib.IconBuilder(input_dir, image_size, random_content=True).create_icons(
+            num_icons=7, num_categories=2)
+
+        sequential = classifier_sequence.ClassifierSequence(input_dir, 3, 192, shuffle=False)
+        parallel = classifier_sequence.ClassifierSequence(input_dir, 3, 192, shuffle=False,
+                                                          num_threads=4, prefetch_batches=2)
+
+        for idx in range(len(sequential)):
+            expected_x, expected_y = sequential[idx]
+            batch_x, batch_y = parallel[idx]
+
+            assert batch_x.dtype == np.uint8
+            assert np.array_equal(batch_x, expected_x)
+            assert np.array_equal(batch_y, expected_y)
+
+    def test_batches_are_prefetched(self, icon_builder):
+        icon_builder.create_icons(num_icons=8)
+
+        sequence = classifier_sequence.ClassifierSequence(icon_builder.input_dir, 2, 192,
+                                                          num_threads=2, prefetch_batches=2)
+        sequence[0]
+
+        assert sorted(sequence._pending_batches) == [1, 2]
+
+    def test_out_of_order_requests_discard_prefetched_batches(self, icon_builder):
+        icon_builder.create_icons(num_icons=16)
+
+        sequence = classifier_sequence.ClassifierSequence(icon_builder.input_dir, 2, 192,
+                                                          num_threads=2, prefetch_batches=2)
+        for idx in [0, 5, 2, 7]:
+            sequence[idx]
+
+        assert sorted(sequence._pending_batches) == []
+
+        sequence[3]
+
+        assert sorted(sequence._pending_batches) == [4, 5]
+
+    def test_epoch_end_discards_prefetched_batches(self, icon_builder):
+        icon_builder.create_icons(num_icons=8)
+
+        sequence = classifier_sequence.ClassifierSequence(icon_builder.input_dir, 2, 192,
+                                                          num_threads=2, prefetch_batches=2)
+        sequence[0]
+        sequence.on_epoch_end()
+
+        assert not sequence._pending_batches
+
+
+class TestCachedClassifierSequence:
+    @pytest.mark.parametrize("num_threads", [0, 2])
+    def test_batches_match_uncached_loading(self, input_dir, tmp_path, num_threads):
+        ib.IconBuilder(input_dir, (200, 170), random_content=True).create_icons(
+            num_icons=7, num_categories=2)
+
+        uncached = classifier_sequence.ClassifierSequence(input_dir, 3, 192, shuffle=False,
+                                                          num_threads=2)
+        cached = classifier_sequence.ClassifierSequence(input_dir, 3, 192, shuffle=False,
+                                                        num_threads=num_threads,
+                                                        cache_dir=tmp_path / "cache")
+
+        for idx in range(len(uncached)):
+            expected_x, expected_y = uncached[idx]
+            batch_x, batch_y = cached[idx]
+
+            assert np.array_equal(batch_x, expected_x)
+            assert np.array_equal(batch_y, expected_y)
+
+    def test_consecutive_icons_are_not_copied(self, icon_builder, tmp_path):
+        icon_builder.create_icons(num_icons=4)
+
+        sequence = classifier_sequence.ClassifierSequence(icon_builder.input_dir, 2, 192,
+                                                          shuffle=False,
+                                                          cache_dir=tmp_path / "cache")
+
+        assert isinstance(sequence[0][0].base, np.memmap)
+
+    def test_shuffled_batches_keep_labels(self, input_dir, tmp_path):
+        ib.IconBuilder(input_dir, random_content=True).create_icons(num_icons=6,
+                                                                    num_categories=2)
+        uncached = classifier_sequence.ClassifierSequence(input_dir, 6, 192, shuffle=False,
+                                                          num_threads=2)
+        cached = classifier_sequence.ClassifierSequence(input_dir, 6, 192,
+                                                        cache_dir=tmp_path / "cache")
+        cached.on_epoch_end()
+
+        expected = {icon.tobytes(): label for icon, label in zip(*uncached[0])}
+        batch_x, batch_y = cached[0]
+
+        assert {icon.tobytes(): label for icon, label in zip(batch_x, batch_y)} == expected
+
+    def test_cache_is_reused(self, icon_builder, tmp_path):
+        icon_builder.create_icons(num_icons=3)
+        cache_dir = tmp_path / "cache"
+
+        classifier_sequence.ClassifierSequence(icon_builder.input_dir, 2, 192, cache_dir=cache_dir)
+        shard_mtime = next(cache_dir.glob("shard_*.npy")).stat().st_mtime_ns
+        classifier_sequence.ClassifierSequence(icon_builder.input_dir, 2, 192, cache_dir=cache_dir)
+
+        assert next(cache_dir.glob("shard_*.npy")).stat().st_mtime_ns == shard_mtime
+
+    def test_cache_is_rebuilt_when_icons_change(self, input_dir, tmp_path):
+        icon_builder = ib.IconBuilder(input_dir, random_content=True)
+        icon_builder.create_icons(num_icons=3)
+        cache_dir = tmp_path / "cache"
+        classifier_sequence.ClassifierSequence(input_dir, 3, 192, cache_dir=cache_dir)
+
+        icon = next((input_dir / "category0").iterdir())
+        icon_builder._create_image().save(icon, "png")
+        icon_builder._create_image().save(input_dir / "category0" / "new_icon", "png")
+
+        uncached = classifier_sequence.ClassifierSequence(input_dir, 4, 192, shuffle=False)
+        cached = classifier_sequence.ClassifierSequence(input_dir, 4, 192, shuffle=False,
+                                                        cache_dir=cache_dir)
+
+        assert np.array_equal(cached[0][0], uncached[0][0])
@@ -0,0 +1,61 @@
+"""A distributed training worker on a tiny model, run (as a cluster of
+processes) by distribution_test.py.
+
+Usage: python test/distributed_worker.py <input_dir> <output_dir>
+"""
+
+import sys
+import json
+import pathlib
+from tensorflow.keras import layers
+from tensorflow.keras import ops
+from tensorflow.keras.models import Model
+from betel import distribution
+from betel import classifier_dataset
+from betel import model_training
+
+BATCH_SIZE = 2
+TARGET_IMG_DIM = 16
+
+
+def build_model():
+    i = layers.Input([None, None, 3], dtype="uint8")
+    x = ops.cast(i, "float32") / 255
+    base_model = Model(i, layers.Conv2D(4, 3)(x))
+    x = layers.GlobalAveragePooling2D(name=model_training.EMBEDDING_LAYER_NAME)(base_model.output)
+    predictions = model_training.define_head(x.shape[-1])(x)
+
+    return Model(inputs=[i], outputs=predictions), base_model
+
+
+def main(input_dir: pathlib.Path, output_dir: pathlib.Path) -> None:
+    strategy = distribution.create_strategy()
+
+    with strategy.scope():
+        model, base_model = build_model()
+
+    shards = []
+
+    def build_shard(batch_size, num_shards, shard_index):
+        shards.append([num_shards, shard_index])
+        return classifier_dataset.build_dataset(input_dir, batch_size, TARGET_IMG_DIM,
+                                                num_shards=num_shards, shard_index=shard_index)
+
+    dataset = distribution.distribute_input(strategy, BATCH_SIZE * strategy.num_replicas_in_sync,
+                                            build_shard)
+    config = model_training.TrainingConfig(frozen_epochs=1, epochs=2, tensorboard=False)
+    model_training.train_model(model, base_model, dataset, dataset, config)
+
+    result = {
+        "replicas": strategy.num_replicas_in_sync,
+        "shards": shards,
+        "is_chief": distribution.is_chief(),
+        "weights": [float(weights.numpy().sum()) for weights in model.trainable_weights],
+        "logs": {name: values[-1] for name, values in model.history.history.items()}
+    }
+    output_file = output_dir / f"worker{distribution.get_worker_index()}.json"
+    output_file.write_text(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main(pathlib.Path(sys.argv[1]), pathlib.Path(sys.argv[2]))
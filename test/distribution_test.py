@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import pathlib
+import numpy as np
+import pytest
+import tensorflow as tf
+from test import icon_builder as ib
+from betel import distribution
+from betel import classifier_sequence
+
+
+class TestShardIcons:
+    def test_shards_are_disjoint_and_equal_sized(self):
+        icons = list(range(7))
+
+        shards = [classifier_sequence.shard_icons(icons, 3, index) for index in range(3)]
+
+        assert [len(shard) for shard in shards] == [3, 3, 3]
+        assert sorted(set().union(*shards)) == icons
+        assert shards[1] == [1, 4, 1]  # completed with its first icon
+
+    def test_sequence_shard(self, tmp_path):
+        ib.IconBuilder(tmp_path).create_icons(num_icons=5, num_categories=1)
+
+        sequences = [classifier_sequence.ClassifierSequence(tmp_path, 2, 192, shuffle=False,
+                                                            num_shards=2, shard_index=index)
+                     for index in range(2)]
+
+        assert [len(sequence) for sequence in sequences] == [2, 2]
+
+
+class TestDistribution:
+    def test_sequence_to_dataset(self, tmp_path):
+        ib.IconBuilder(tmp_path, random_content=True).create_icons(num_icons=5, num_categories=2)
+        sequence = classifier_sequence.ClassifierSequence(tmp_path, 2, 192, shuffle=False)
+
+        batches = list(distribution.sequence_to_dataset(sequence).as_numpy_iterator())
+
+        assert len(batches) == len(sequence)
+        for idx, (batch_x, batch_y) in enumerate(batches):
+            expected_x, expected_y = sequence[idx]
+            assert np.array_equal(batch_x, expected_x)
+            assert np.array_equal(batch_y, expected_y)
+
+    def test_jit_compile_needs_gpus(self):
+        if tf.config.list_physical_devices("GPU"):
+            pytest.skip("XLA compiles the collectives on GPUs")
+        model = tf.keras.Sequential([tf.keras.Input([2]), tf.keras.layers.Dense(1)])
+        model.compile(optimizer="sgd", loss="mse", jit_compile=True)
+
+        with pytest.raises(ValueError):
+            distribution.fit(model, tf.data.Dataset.from_tensor_slices(([[0.0, 0.0]], [0.0])))
+
+    def test_tf_config(self, monkeypatch):
+        tf_config = distribution.build_tf_config(["localhost:1", "localhost:2"], 1)
+        monkeypatch.setenv("TF_CONFIG", tf_config)
+
+        assert json.loads(tf_config)["cluster"]["worker"] == ["localhost:1", "localhost:2"]
+        assert distribution.get_worker_index() == 1
+        assert not distribution.is_chief()
+
+    def test_no_tf_config(self, monkeypatch):
+        monkeypatch.delenv("TF_CONFIG", raising=False)
+
+        assert distribution.is_chief()
+
+    def test_two_local_workers(self, tmp_path):
+        input_dir = tmp_path / "input_dir"
+        output_dir = tmp_path / "output_dir"
+        input_dir.mkdir()
+        output_dir.mkdir()
+        ib.IconBuilder(input_dir, (16, 16), random_content=True).create_icons(
+            num_icons=10, num_categories=2)
+
+        worker_file = pathlib.Path(__file__).parent / "distributed_worker.py"
+        env = dict(os.environ)
+        env["PYTHONPATH"] = os.pathsep.join([str(worker_file.parent.parent), *sys.path])
+
+        exit_codes = distribution.launch_local_workers(
+            2, [str(worker_file), str(input_dir), str(output_dir)], env)
+
+        assert exit_codes == [0, 0]
+
+        results = [json.loads((output_dir / f"worker{index}.json").read_text())
+                   for index in range(2)]
+
+        assert [result["replicas"] for result in results] == [2, 2]
+        assert [result["shards"] for result in results] == [[[2, 0]], [[2, 1]]]
+        assert [result["is_chief"] for result in results] == [True, False]
+        # the metrics are pooled over the replicas: the 12 validation icons
+        # (5 per shard, completed to 3 batches of 2) are all counted
+        for logs in [result["logs"] for result in results]:
+            assert logs["val_loss"] == results[0]["logs"]["val_loss"]
+            errors = logs["val_false_positives"] + logs["val_false_negatives"]
+            assert errors == pytest.approx((1 - logs["val_accuracy"]) * 12)
+        # the trainable weights of the replicas stay in sync
+        assert np.allclose(results[0]["weights"], results[1]["weights"])
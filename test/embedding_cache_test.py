@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from tensorflow.keras import layers
+from tensorflow.keras import ops
+from tensorflow.keras.models import Model
+from test import icon_builder as ib
+from betel import embedding_cache
+from betel import classifier_sequence
+
+
+@pytest.fixture
+def input_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp("input_dir")
+
+
+@pytest.fixture
+def feature_extractor():
+    i = layers.Input([None, None, 3], dtype="uint8")
+    x = layers.GlobalAveragePooling2D()(ops.cast(i, "float32"))
+    return Model(inputs=[i], outputs=x)
+
+
+class TestEmbeddingCache:
+    def test_load_checks_fingerprint(self, tmp_path):
+        cache = embedding_cache.EmbeddingCache(tmp_path)
+        cache.save("fingerprint", np.ones((2, 3)), np.array([0, 1]))
+
+        embeddings, labels = cache.load("fingerprint")
+
+        assert np.array_equal(embeddings, np.ones((2, 3)))
+        assert np.array_equal(labels, [0, 1])
+        assert cache.load("other fingerprint") is None
+
+    def test_get_embeddings(self, input_dir, tmp_path, feature_extractor):
+        ib.IconBuilder(input_dir, random_content=True).create_icons(num_icons=5,
+                                                                    num_categories=2)
+
+        embeddings, labels = embedding_cache.get_embeddings(
+            feature_extractor, "test", input_dir, tmp_path / "cache", 2, 192)
+
+        sequence = classifier_sequence.ClassifierSequence(input_dir, 5, 192, shuffle=False,
+                                                          num_threads=1)
+        batch_x, batch_y = sequence[0]
+
+        assert np.allclose(embeddings, batch_x.mean(axis=(1, 2)), atol=1e-4)
+        assert np.array_equal(labels, batch_y)
+
+    def test_embeddings_are_computed_once(self, input_dir, tmp_path, feature_extractor,
+                                          monkeypatch):
+        ib.IconBuilder(input_dir).create_icons(num_icons=3)
+        embedding_cache.get_embeddings(feature_extractor, "test", input_dir, tmp_path, 2, 192)
+
+        monkeypatch.setattr(feature_extractor, "predict", None)
+        embeddings, _ = embedding_cache.get_embeddings(feature_extractor, "test", input_dir,
+                                                       tmp_path, 2, 192)
+
+        assert embeddings.shape == (3, 3)
+
+    def test_embeddings_are_recomputed_for_another_backbone(self, input_dir, tmp_path,
+                                                            feature_extractor, monkeypatch):
+        ib.IconBuilder(input_dir).create_icons(num_icons=3)
+        embedding_cache.get_embeddings(feature_extractor, "test", input_dir, tmp_path, 2, 192)
+
+        monkeypatch.setattr(feature_extractor, "predict", lambda *args, **kwargs: np.zeros((4, 1)))
+        embeddings, _ = embedding_cache.get_embeddings(feature_extractor, "other", input_dir,
+                                                       tmp_path, 2, 192)
+
+        assert embeddings.shape == (3, 1)
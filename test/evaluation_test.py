@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+from betel import evaluation
+from betel import inference
+
+
+class ScoreModel:
+    """Stands for a model: every icon's output is stored in its first pixel."""
+
+    def __init__(self, outputs_no: int):
+        self._outputs_no = outputs_no
+
+    def predict_on_batch(self, icons):
+        return icons[:, 0, 0, :self._outputs_no] / 100
+
+
+def make_batches(outputs, labels, batch_size):
+    icons = np.zeros((len(outputs), 4, 4, 3), dtype=np.uint8)
+    icons[:, 0, 0, :outputs.shape[1]] = np.round(100 * outputs)
+
+    # the last batch is completed with the first icons
+    padding = -len(outputs) % batch_size
+    icons = np.concatenate([icons, icons[:padding]])
+    labels = np.concatenate([labels, labels[:padding]])
+
+    return [(icons[start:start + batch_size], labels[start:start + batch_size])
+            for start in range(0, len(icons), batch_size)]
+
+
+class TestEvaluation:
+    def test_sigmoid_classifier(self):
+        outputs = np.array([[0.9], [0.8], [0.3], [0.1], [0.6]])
+        labels = np.array([1, 1, 0, 0, 0])
+        classifier = inference.IconClassifier(ScoreModel(1), ["other", "music"], 4)
+
+        report = evaluation.evaluate_classifier(classifier, make_batches(outputs, labels, 2), 5)
+
+        assert report["icons"] == 5
+        assert report["accuracy"] == pytest.approx(0.8)
+        assert report["confusion_matrix"] == [[2, 1], [0, 2]]
+        assert report["categories"]["music"]["precision"] == pytest.approx(2 / 3)
+        assert report["categories"]["music"]["recall"] == 1
+        assert report["categories"]["other"]["support"] == 3
+        assert report["categories"]["music"]["average_precision"] == 1
+        assert set(report["latency_ms"]) == {"p50", "p90", "p95", "p99"}
+        assert report["icons_per_s"] > 0
+
+    def test_softmax_classifier(self):
+        outputs = np.array([[0.7, 0.2, 0.1], [0.1, 0.8, 0.1], [0.2, 0.2, 0.6], [0.5, 0.3, 0.2]])
+        labels = np.array([0, 1, 2, 2])
+        classifier = inference.IconClassifier(ScoreModel(3), ["a", "b", "c"], 4)
+
+        report = evaluation.evaluate_classifier(classifier, make_batches(outputs, labels, 3), 4)
+
+        assert report["accuracy"] == pytest.approx(0.75)
+        assert report["confusion_matrix"] == [[1, 0, 0], [0, 1, 0], [1, 0, 1]]
+
+    def test_pr_curve_points(self):
+        outputs = np.random.randint(100, size=(200, 1)) / 100
+        labels = np.random.randint(2, size=200)
+        classifier = inference.IconClassifier(ScoreModel(1), ["other", "music"], 4)
+
+        report = evaluation.evaluate_classifier(classifier, make_batches(outputs, labels, 32),
+                                                200, curve_points=11)
+
+        curve = report["categories"]["music"]["pr_curve"]
+        assert 1 < len(curve["thresholds"]) <= 11
+        assert len(curve["precision"]) == len(curve["recall"]) == len(curve["thresholds"])
+        assert curve["thresholds"] == sorted(curve["thresholds"])
+
+    def test_category_missing_from_data_set(self):
+        outputs = np.array([[0.2], [0.1]])
+        classifier = inference.IconClassifier(ScoreModel(1), ["other", "music"], 4)
+
+        report = evaluation.evaluate_classifier(classifier,
+                                                make_batches(outputs, np.array([0, 0]), 2), 2)
+
+        assert report["categories"]["music"]["average_precision"] is None
+        assert report["categories"]["music"]["pr_curve"]["precision"] == []
+
+    def test_data_set_categories_are_mapped_by_name(self):
+        outputs = np.array([[0.7, 0.2, 0.1], [0.1, 0.8, 0.1], [0.2, 0.2, 0.6], [0.5, 0.3, 0.2]])
+        classifier = inference.IconClassifier(ScoreModel(3), ["a", "b", "c"], 4)
+        # the data set lists its categories in another order
+        labels = np.array([2, 0, 1, 1])
+
+        report = evaluation.evaluate_classifier(classifier, make_batches(outputs, labels, 3), 4,
+                                                categories=["b", "c", "a"])
+
+        assert report["accuracy"] == pytest.approx(0.75)
+        assert report["confusion_matrix"] == [[1, 0, 0], [0, 1, 0], [1, 0, 1]]
+
+    def test_category_unknown_to_classifier(self):
+        outputs = np.array([[0.2], [0.1]])
+        classifier = inference.IconClassifier(ScoreModel(1), ["other", "music"], 4)
+
+        with pytest.raises(ValueError):
+            evaluation.evaluate_classifier(classifier, make_batches(outputs, np.array([0, 1]), 2),
+                                           2, categories=["other", "games"])
@@ -1,4 +1,5 @@
 import pathlib
+import numpy as np
 from PIL import Image
 
 
@@ -7,8 +8,10 @@ class IconBuilder:
 
     input_dir: pathlib.Path
 
-    def __init__(self, input_dir: pathlib.Path, image_size: (int, int) = (180, 180)):
+    def __init__(self, input_dir: pathlib.Path, image_size: (int, int) = (180, 180),
+                 random_content: bool = False):
         self._image_size = image_size
+        self._random_content = random_content
         self.input_dir = input_dir
 
     def create_icons(self, num_icons: int, num_categories: int = 1):
@@ -29,5 +32,12 @@ class IconBuilder:
             for icon_index in range(icons_no[category_index]):
                 icon = category_dir / f"icon_{category_index}.{icon_index}"
                 icon.touch()
-                image = Image.new('RGBA', size=self._image_size)
+                image = self._create_image()
                 image.save(icon, 'png')
+
+    def _create_image(self) -> Image:
+        if not self._random_content:
+            return Image.new('RGBA', size=self._image_size)
+
+        pixels = np.random.randint(256, size=(*self._image_size[::-1], 4), dtype=np.uint8)
+        return Image.fromarray(pixels, 'RGBA')
@@ -0,0 +1,77 @@
+import pytest
+from betel import icon_cache
+from betel import utils
+
+URL = "https://example.com/icon"
+ICON = b"icon"
+NEW_ICON = b"new icon"
+HEADERS = {"ETag": '"v1"', "Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT"}
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return icon_cache.IconCache(tmp_path / "icon_cache.db")
+
+
+@pytest.fixture
+def destination(tmp_path):
+    return tmp_path / "icon_com.example"
+
+
+class TestIconCache:
+    def test_save_new_icon(self, cache, destination):
+        cache.save(URL, destination, ICON, HEADERS)
+
+        assert destination.read_bytes() == ICON
+        assert cache.get(URL) == icon_cache.CachedIcon(HEADERS["ETag"], HEADERS["Last-Modified"],
+                                                       utils.get_content_hash(ICON))
+        assert cache.stats == {icon_cache.IconCache.DOWNLOADED: 1}
+
+    def test_unchanged_icon_is_not_written(self, cache, destination):
+        cache.save(URL, destination, ICON, HEADERS)
+        destination.write_bytes(b"marker")
+
+        cache.save(URL, destination, ICON, HEADERS)
+
+        assert destination.read_bytes() == b"marker"
+        assert cache.stats[icon_cache.IconCache.UNCHANGED] == 1
+
+    def test_changed_icon_is_written(self, cache, destination):
+        cache.save(URL, destination, ICON, HEADERS)
+        cache.save(URL, destination, NEW_ICON, {})
+
+        assert destination.read_bytes() == NEW_ICON
+        assert cache.stats[icon_cache.IconCache.DOWNLOADED] == 2
+
+    def test_conditional_headers(self, cache, destination):
+        assert cache.get_conditional_headers(URL, destination) == {}
+
+        cache.save(URL, destination, ICON, HEADERS)
+
+        assert cache.get_conditional_headers(URL, destination) == {
+            "If-None-Match": HEADERS["ETag"],
+            "If-Modified-Since": HEADERS["Last-Modified"]
+        }
+
+    def test_no_conditional_headers_for_missing_file(self, cache, destination):
+        cache.save(URL, destination, ICON, HEADERS)
+        destination.unlink()
+
+        assert cache.get_conditional_headers(URL, destination) == {}
+
+    def test_entries_are_persisted_on_flush(self, cache, destination, tmp_path):
+        cache.save(URL, destination, ICON, HEADERS)
+
+        reopened = icon_cache.IconCache(tmp_path / "icon_cache.db")
+        assert reopened.get(URL) is None
+
+        cache.flush()
+        assert reopened.get(URL).content_hash == utils.get_content_hash(ICON)
+
+    def test_pop_stats(self, cache, destination):
+        cache.save(URL, destination, ICON, HEADERS)
+        cache.mark_not_modified()
+
+        assert cache.pop_stats() == {icon_cache.IconCache.DOWNLOADED: 1,
+                                     icon_cache.IconCache.NOT_MODIFIED: 1}
+        assert not cache.stats
@@ -0,0 +1,88 @@
+import pytest
+from betel import icon_store
+from betel import utils
+
+ICON = b"icon"
+OTHER_ICON = b"other icon"
+
+
+@pytest.fixture
+def store(tmp_path):
+    return icon_store.IconStore(tmp_path / "store")
+
+
+@pytest.fixture
+def input_dir(tmp_path):
+    directory = tmp_path / "input"
+    directory.mkdir()
+    return directory
+
+
+class TestIconStore:
+    def test_ingest(self, store, input_dir):
+        icon = input_dir / "icon_com.example"
+        icon.write_bytes(ICON)
+
+        content_hash, duplicate = store.ingest(icon)
+
+        assert content_hash == utils.get_content_hash(ICON)
+        assert not duplicate
+        assert store.get_blob(content_hash).read_bytes() == ICON
+
+    def test_ingested_icon_is_not_copied(self, store, input_dir):
+        icon = input_dir / "icon_com.example"
+        icon.write_bytes(ICON)
+
+        content_hash, _ = store.ingest(icon)
+
+        assert store.get_blob(content_hash).stat().st_ino == icon.stat().st_ino
+        assert not list(store._root.glob(".*"))
+
+    def test_duplicates_are_detected(self, store, input_dir):
+        icons = [input_dir / "icon_com.example", input_dir / "icon_com.test",
+                 input_dir / "icon_com.play"]
+        for icon, content in zip(icons, [ICON, ICON, OTHER_ICON]):
+            icon.write_bytes(content)
+
+        duplicates = [store.ingest(icon)[1] for icon in icons]
+
+        assert duplicates == [False, True, False]
+
+    def test_links_share_the_blob(self, store, input_dir, tmp_path):
+        icon = input_dir / "icon_com.example"
+        icon.write_bytes(ICON)
+        content_hash, _ = store.ingest(icon)
+
+        first = tmp_path / "train" / "example" / "icon_com.example"
+        second = tmp_path / "test" / "example" / "icon_com.test"
+        store.link(content_hash, first)
+        store.link(content_hash, second)
+
+        assert first.read_bytes() == ICON
+        assert first.stat().st_ino == second.stat().st_ino == \
+            store.get_blob(content_hash).stat().st_ino
+
+    def test_link_replaces_existing_file(self, store, input_dir, tmp_path):
+        icon = input_dir / "icon_com.example"
+        icon.write_bytes(ICON)
+        content_hash, _ = store.ingest(icon)
+
+        destination = tmp_path / "icon_com.example"
+        destination.write_bytes(OTHER_ICON)
+        store.link(content_hash, destination)
+
+        assert destination.read_bytes() == ICON
+
+    def test_release(self, store, input_dir, tmp_path):
+        icons = [input_dir / "icon_com.example", input_dir / "icon_com.test"]
+        for icon, content in zip(icons, [ICON, OTHER_ICON]):
+            icon.write_bytes(content)
+        content_hashes = [store.ingest(icon)[0] for icon in icons]
+        store.link(content_hashes[0], tmp_path / "icon_com.example")
+
+        # the second icon is only left in the store
+        icons[1].unlink()
+
+        assert store.release(content_hashes + [""]) == 1
+        assert store.get_blob(content_hashes[0]).exists()
+        assert not store.get_blob(content_hashes[1]).exists()
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from betel import icon_tensor_cache
+
+
+@pytest.fixture
+def icons():
+    return np.random.randint(256, size=(10, 4, 4, 3), dtype=np.uint8)
+
+
+@pytest.fixture
+def tensor_cache(tmp_path, icons):
+    cache = icon_tensor_cache.IconTensorCache(tmp_path)
+    cache.build("fingerprint", np.arange(len(icons)), icons.shape[1:],
+                lambda shard, positions: shard.__setitem__(slice(None), icons[positions.start:
+                                                                              positions.stop]),
+                shard_size=4)
+    cache.open()
+    return cache
+
+
+class TestIconTensorCache:
+    @pytest.mark.parametrize("positions", [[0, 1, 2], [2, 3, 4, 5], [9, 0, 5], [7]])
+    def test_get_batch(self, tensor_cache, icons, positions):
+        assert np.array_equal(tensor_cache.get_batch(np.array(positions)), icons[positions])
+
+    def test_labels(self, tensor_cache):
+        assert np.array_equal(tensor_cache.labels, np.arange(10))
+
+    def test_consecutive_icons_in_a_shard_are_a_view(self, tensor_cache):
+        assert isinstance(tensor_cache.get_batch(np.array([4, 5, 6])).base, np.memmap)
+
+    def test_validity(self, tmp_path, tensor_cache):
+        assert tensor_cache.is_valid("fingerprint")
+        assert not tensor_cache.is_valid("other fingerprint")
+        assert not icon_tensor_cache.IconTensorCache(tmp_path / "missing").is_valid("fingerprint")
+
+    def test_fingerprint_changes_with_files(self, tmp_path):
+        (tmp_path / "icon").write_bytes(b"a")
+        fingerprint = icon_tensor_cache.compute_fingerprint(tmp_path, ["icon"], 192)
+
+        assert icon_tensor_cache.compute_fingerprint(tmp_path, ["icon"], 192) == fingerprint
+        assert icon_tensor_cache.compute_fingerprint(tmp_path, ["icon"], 128) != fingerprint
+
+        (tmp_path / "icon").write_bytes(b"ab")
+        assert icon_tensor_cache.compute_fingerprint(tmp_path, ["icon"], 192) != fingerprint
@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import pytest
+from tensorflow.keras import layers
+from tensorflow.keras import ops
+from tensorflow.keras.models import Model
+from test import icon_builder as ib
+from betel import inference
+from betel import classifier_sequence
+
+
+@pytest.fixture
+def input_dir(tmp_path_factory):
+    return tmp_path_factory.mktemp("input_dir")
+
+
+@pytest.fixture
+def model():
+    i = layers.Input([None, None, 3], dtype="uint8")
+    x = layers.GlobalAveragePooling2D()(ops.cast(i, "float32"))
+    predictions = layers.Dense(1, activation="sigmoid")(x)
+    return Model(inputs=[i], outputs=predictions)
+
+
+@pytest.fixture
+def classifier(model):
+    return inference.IconClassifier(model, ["other", "music"], 192)
+
+
+class TestInference:
+    def test_export_and_load(self, model, tmp_path, input_dir):
+        ib.IconBuilder(input_dir, random_content=True).create_icons(num_icons=3)
+        icons = np.random.randint(256, size=(3, 192, 192, 3), dtype=np.uint8)
+
+        inference.export_model(model, tmp_path, ["other", "music"], 192)
+        classifier = inference.IconClassifier.load(tmp_path)
+
+        assert (tmp_path / inference.SAVED_MODEL_DIR_NAME).is_dir()
+        assert classifier.categories == ["other", "music"]
+        assert classifier.target_img_dim == 192
+        assert np.allclose(classifier.predict(icons), model.predict_on_batch(icons))
+
+    def test_classify(self, classifier, model):
+        icons = np.random.randint(256, size=(4, 192, 192, 3), dtype=np.uint8)
+        outputs = model.predict_on_batch(icons)[:, 0]
+
+        categories, scores = classifier.classify(icons)
+
+        assert categories == ["music" if output >= 0.5 else "other" for output in outputs]
+        assert np.allclose(scores, np.maximum(outputs, 1 - outputs))
+
+    @pytest.mark.parametrize("batch_size, prefetch_batches", [(2, 0), (3, 2), (10, 1)])
+    def test_load_batches_matches_sequence(self, input_dir, batch_size, prefetch_batches):
+        ib.IconBuilder(input_dir, (200, 170), random_content=True).create_icons(num_icons=5)
+        _, app_icons = classifier_sequence.list_icons(input_dir)
+        icons = [(icon_name, input_dir / category / icon_name)
+                 for icon_name, category in app_icons]
+
+        batches = list(inference.load_batches(icons, batch_size, 192, 2, prefetch_batches))
+
+        sequence = classifier_sequence.ClassifierSequence(input_dir, 5, 192, shuffle=False,
+                                                          num_threads=1)
+        assert [key for keys, _ in batches for key in keys] == [key for key, _ in icons]
+        assert np.array_equal(np.concatenate([batch for _, batch in batches]), sequence[0][0])
+
+    def test_unreadable_icons_are_skipped(self, input_dir, tmp_path):
+        ib.IconBuilder(input_dir).create_icons(num_icons=3)
+        (input_dir / "category0" / "broken").write_bytes(b"not an icon")
+        icons = sorted(inference.list_icon_files(input_dir))
+
+        batches = list(inference.load_batches(icons, 2, 192))
+
+        assert sorted(key for keys, _ in batches for key in keys) == [
+            "category0/icon_0.0", "category0/icon_0.1", "category0/icon_0.2"]
+        assert sum(len(batch) for _, batch in batches) == 3
+
+    def test_classify_app_icons_to_csv(self, classifier, tmp_path):
+        app_ids = ["com.example.a", "com.example.b", "com.example.c"]
+        for app_id in app_ids:
+            ib.IconBuilder(tmp_path)._create_image().save(tmp_path / f"icon_{app_id}", "png")
+        output_file = tmp_path / "predictions.csv"
+
+        icons_no = inference.classify_icons(
+            classifier, inference.list_app_icon_files(app_ids, tmp_path), output_file, "app_id",
+            batch_size=2)
+
+        predictions = pd.read_csv(output_file)
+        assert icons_no == 3
+        assert list(predictions.columns) == ["app_id", "category", "score"]
+        assert list(predictions["app_id"]) == app_ids
+
+    def test_prediction_writer_appends_batches_to_csv(self, tmp_path):
+        output_file = tmp_path / "predictions.csv"
+        output_file.write_text("stale\n")
+        batches = [pd.DataFrame({"icon": [f"icon_{i}"], "category": ["a"], "score": [0.5]})
+                   for i in range(3)]
+
+        with inference.PredictionWriter(output_file) as writer:
+            for batch in batches:
+                writer.write(batch)
+
+        predictions = pd.read_csv(output_file)
+        assert list(predictions.columns) == ["icon", "category", "score"]
+        assert list(predictions["icon"]) == ["icon_0", "icon_1", "icon_2"]
+
+    def test_prediction_writer_streams_parquet(self, tmp_path):
+        pytest.importorskip("pyarrow")
+        output_file = tmp_path / "predictions.parquet"
+        batches = [pd.DataFrame({"icon": [f"icon_{i}"], "category": ["a"], "score": [0.5]})
+                   for i in range(3)]
+
+        with inference.PredictionWriter(output_file) as writer:
+            for batch in batches:
+                writer.write(batch)
+
+        assert list(pd.read_parquet(output_file)["icon"]) == ["icon_0", "icon_1", "icon_2"]
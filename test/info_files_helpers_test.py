@@ -1,3 +1,5 @@
+import pickle
+import multiprocessing
 import pytest
 import pandas as pd
 from betel import info_files_helpers
@@ -23,16 +25,47 @@ class TestInfoFilesHelpers:
         assert HEADER in file.read_text()
         assert ROWS[0] in file.read_text()
 
-    def test_part_of_data_set(self, test_dir):
+    def test_add_to_data_appends_rows(self, test_dir):
         file = test_dir / "info"
 
-        file.write_text(f"{HEADER}\n{ROWS[0]}")
+        for dictionary in DICTIONARIES:
+            info_files_helpers.add_to_data(file, pd.DataFrame([dictionary]))
+
+        assert file.read_text() == f"{HEADER}\n{ROWS[0]}\n{ROWS[1]}\n"
+
+    def test_add_to_data_after_torn_row(self, test_dir):
+        file = test_dir / "info"
+
+        file.write_text(f"{HEADER}\n{ROWS[0]}\ne,")
 
-        present_data_frame = pd.DataFrame([DICTIONARIES[0]])
-        missing_data_frame = pd.DataFrame([DICTIONARIES[1]])
+        info_files_helpers.add_to_data(file, pd.DataFrame([DICTIONARIES[1]]))
 
-        assert info_files_helpers.part_of_data_set(file, present_data_frame)
-        assert not info_files_helpers.part_of_data_set(file, missing_data_frame)
+        assert file.read_text() == f"{HEADER}\n{ROWS[0]}\ne,\n{ROWS[1]}\n"
+
+    def test_remove_from_data(self, test_dir):
+        file = test_dir / "info"
+
+        file.write_text(f"{HEADER}\n{ROWS[0]}\n{ROWS[1]}\n")
+
+        info_files_helpers.remove_from_data(file, ["c", "g"], key="a")
+
+        assert file.read_text() == f"{HEADER}\n{ROWS[1]}\n"
+
+    def test_rows_added_while_removing_are_kept(self, test_dir):
+        file = test_dir / "info"
+        file.write_text(f"{HEADER}\n{ROWS[0]}\n")
+        processes_no = 3
+        rows_no = 100
+
+        with multiprocessing.Pool(processes_no + 1) as pool:
+            removal = pool.apply_async(_remove_rows, (file, rows_no))
+            pool.starmap(_add_rows, [(file, index, rows_no) for index in range(processes_no)])
+            removal.get()
+
+        lines = file.read_text().splitlines()
+
+        assert lines.count(HEADER) == 1
+        assert len(lines) == processes_no * rows_no + 1
 
     def test_read_list(self, test_dir):
         file = test_dir / "info"
@@ -42,3 +75,151 @@ class TestInfoFilesHelpers:
         content = info_files_helpers.read_csv_file(file)
 
         assert content.equals(pd.DataFrame(DICTIONARIES))
+
+
+class TestInfoFileIndex:
+    def test_contains(self, test_dir):
+        file = test_dir / "info"
+
+        file.write_text(f"{HEADER}\n{ROWS[0]}\n{ROWS[1]}")
+
+        index = info_files_helpers.InfoFileIndex(file, key="a")
+
+        assert "c" in index
+        assert "e" in index
+        assert "d" not in index
+        assert len(index) == 2
+
+    def test_missing_file(self, test_dir):
+        index = info_files_helpers.InfoFileIndex(test_dir / "missing")
+
+        assert "c" not in index
+        assert len(index) == 0
+
+    def test_add(self, test_dir):
+        index = info_files_helpers.InfoFileIndex(test_dir / "missing")
+
+        assert "c" not in index
+
+        index.add("c")
+        index.update(["e"])
+
+        assert "c" in index
+        assert "e" in index
+
+    def test_add_to_unloaded_index(self, test_dir, monkeypatch):
+        reads = []
+        monkeypatch.setattr(info_files_helpers, "_read_column",
+                            lambda file, key: reads.append(file) or set())
+
+        index = info_files_helpers.InfoFileIndex(test_dir / "missing")
+        index.add("c")
+        index.update(["e"])
+
+        assert not reads
+
+    def test_index_is_loaded_once(self, test_dir):
+        file = test_dir / "info"
+
+        file.write_text(f"{HEADER}\n{ROWS[0]}")
+
+        index = info_files_helpers.InfoFileIndex(file, key="a")
+
+        assert "c" in index
+
+        file.write_text(f"{HEADER}\n{ROWS[1]}")
+
+        assert "c" in index
+        assert "e" not in index
+
+    def test_invalidate(self, test_dir):
+        file = test_dir / "info"
+
+        file.write_text(f"{HEADER}\n{ROWS[0]}")
+
+        index = info_files_helpers.InfoFileIndex(file, key="a")
+
+        assert "e" not in index
+
+        file.write_text(f"{HEADER}\n{ROWS[0]}\n{ROWS[1]}")
+        index.invalidate()
+
+        assert "e" in index
+
+    def test_unpickled_index_reloads_file(self, test_dir):
+        file = test_dir / "info"
+
+        file.write_text(f"{HEADER}\n{ROWS[0]}")
+
+        index = info_files_helpers.InfoFileIndex(file, key="a")
+        index.add("x")
+
+        file.write_text(f"{HEADER}\n{ROWS[0]}\n{ROWS[1]}")
+
+        copy = pickle.loads(pickle.dumps(index))
+
+        assert "e" in copy
+        assert "x" not in copy
+
+
+class TestBufferedInfoWriter:
+    def test_rows_are_buffered(self, test_dir):
+        file = test_dir / "info"
+
+        writer = info_files_helpers.BufferedInfoWriter(file, buffer_size=10)
+        writer.add(DICTIONARIES[0])
+
+        assert not file.exists()
+
+        writer.close()
+
+        assert file.read_text() == f"{HEADER}\n{ROWS[0]}\n"
+
+    def test_full_buffer_is_flushed(self, test_dir):
+        file = test_dir / "info"
+
+        writer = info_files_helpers.BufferedInfoWriter(file, buffer_size=2)
+
+        for dictionary in DICTIONARIES:
+            writer.add(dictionary)
+
+        assert file.read_text() == f"{HEADER}\n{ROWS[0]}\n{ROWS[1]}\n"
+
+    def test_context_manager_flushes(self, test_dir):
+        file = test_dir / "info"
+
+        with info_files_helpers.BufferedInfoWriter(file) as writer:
+            writer.add(DICTIONARIES[0])
+
+        assert file.read_text() == f"{HEADER}\n{ROWS[0]}\n"
+
+    def test_concurrent_writers(self, test_dir):
+        file = test_dir / "info"
+        processes_no = 4
+        rows_no = 500
+
+        with multiprocessing.Pool(processes_no) as pool:
+            pool.starmap(_write_rows, [(file, index, rows_no) for index in range(processes_no)])
+
+        lines = file.read_text().splitlines()
+
+        assert lines.count(HEADER) == 1
+        assert len(lines) == processes_no * rows_no + 1
+        assert len(set(lines)) == len(lines)
+
+
+def _add_rows(file, writer_index, rows_no):
+    for row_index in range(rows_no):
+        info_files_helpers.add_to_data(file, pd.DataFrame([{"a": str(writer_index),
+                                                            "b": str(row_index)}]))
+
+
+def _remove_rows(file, rows_no):
+    for _ in range(rows_no):
+        info_files_helpers.remove_from_data(file, ["c"], key="a")
+
+
+def _write_rows(file, writer_index, rows_no):
+    with info_files_helpers.BufferedInfoWriter(file, buffer_size=7) as writer:
+        for row_index in range(rows_no):
+            writer.add({"a": str(writer_index), "b": str(row_index)})
@@ -0,0 +1,154 @@
+import logging
+import numpy as np
+import pytest
+import tensorflow as tf
+from tensorflow.keras import layers
+from tensorflow.keras import mixed_precision
+from tensorflow.keras.models import Model
+from betel import model_training
+
+
+@pytest.fixture
+def mixed_policy():
+    mixed_precision.set_global_policy("mixed_bfloat16")
+    yield
+    mixed_precision.set_global_policy("float32")
+
+
+def build_tiny_model():
+    i = layers.Input([8, 8, 3], dtype="uint8")
+    base_model = Model(i, layers.Conv2D(4, 3)(layers.Rescaling(1 / 255)(i)))
+    x = layers.GlobalAveragePooling2D(name=model_training.EMBEDDING_LAYER_NAME)(base_model.output)
+    predictions = model_training.define_head(x.shape[-1])(x)
+
+    return Model(inputs=[i], outputs=predictions), base_model
+
+
+@pytest.fixture
+def dataset():
+    icons = np.random.randint(256, size=(8, 8, 8, 3), dtype=np.uint8)
+    return tf.data.Dataset.from_tensor_slices((icons, np.arange(8) % 2)).batch(4)
+
+
+class RecordingSequence(tf.keras.utils.Sequence):
+    """A sequence of random batches recording the requested batch indices."""
+
+    def __init__(self):
+        super().__init__()
+        self.requested = []
+
+    def __len__(self):
+        return 6
+
+    def __getitem__(self, idx):
+        self.requested.append(idx)
+        return np.random.randint(256, size=(2, 8, 8, 3), dtype=np.uint8), np.arange(2)
+
+
+class TestModelTraining:
+    def test_head_output_stays_float32(self, mixed_policy):
+        head = model_training.define_head(16)
+
+        assert head.layers[1].compute_dtype == "bfloat16"
+        assert head.output.dtype == "float32"
+
+    def test_epoch_timer_records_step_time(self):
+        head = model_training.define_head(16)
+        head.compile(optimizer="sgd", loss="binary_crossentropy")
+
+        history = head.fit(np.random.rand(12, 16), np.random.randint(2, size=12), batch_size=4,
+                           epochs=2, verbose=0, callbacks=[model_training.EpochTimer()])
+
+        assert len(history.history["epoch_time"]) == 2
+        assert all(step_time > 0 for step_time in history.history["step_time"])
+        assert history.history["step_time"][0] <= history.history["epoch_time"][0]
+
+    def test_checkpoints_and_best_weights(self, dataset, tmp_path):
+        model, base_model = build_tiny_model()
+        config = model_training.TrainingConfig(frozen_epochs=1, epochs=3, tensorboard=False,
+                                               checkpoint_dir=str(tmp_path))
+
+        model_training.train_model(model, base_model, dataset, dataset, config)
+
+        checkpoint = model_training.TrainingCheckpoint(tmp_path, model)
+        assert checkpoint.load_state() == (model_training.FINE_TUNING_PHASE, 3)
+        assert checkpoint.best_checkpoint.with_suffix(".index").exists()
+        assert tf.train.latest_checkpoint(str(tmp_path)).endswith("ckpt-3")
+
+    # interrupted in the frozen phase, between the phases and in the fine-tuning phase
+    @pytest.mark.parametrize("first_epochs", [1, 2, 3])
+    def test_resume(self, dataset, tmp_path, caplog, first_epochs):
+        model, base_model = build_tiny_model()
+        config = model_training.TrainingConfig(frozen_epochs=min(2, first_epochs),
+                                               epochs=first_epochs, tensorboard=False,
+                                               checkpoint_dir=str(tmp_path))
+        model_training.train_model(model, base_model, dataset, dataset, config)
+
+        model, base_model = build_tiny_model()
+        config.frozen_epochs = 2
+        config.epochs = 4
+        with caplog.at_level(logging.INFO):
+            model_training.train_model(model, base_model, dataset, dataset, config)
+
+        assert f"epoch {first_epochs})" in caplog.text
+        epochs = [record.message for record in caplog.records if "ms/step" in record.message]
+        assert len(epochs) == 4 - first_epochs  # the completed epochs are not trained again
+        assert model_training.TrainingCheckpoint(tmp_path, model).load_state() == \
+            (model_training.FINE_TUNING_PHASE, 4)
+
+    def test_resume_after_early_stopped_frozen_phase(self, dataset, tmp_path):
+        model, base_model = build_tiny_model()
+        # the frozen phase stops after 2 epochs, and the training right after the switch
+        config = model_training.TrainingConfig(frozen_epochs=5, epochs=2, tensorboard=False,
+                                               frozen_patience=1, min_delta=1000,
+                                               checkpoint_dir=str(tmp_path))
+        model_training.train_model(model, base_model, dataset, dataset, config)
+        assert model_training.TrainingCheckpoint(tmp_path, model).load_state() == \
+            (model_training.FINE_TUNING_PHASE, 2)
+
+        model, base_model = build_tiny_model()
+        config.epochs = 4
+        summary = model_training.train_model(model, base_model, dataset, dataset, config)
+
+        assert "frozen" not in summary  # the frozen phase is not resumed
+        assert summary["fine_tuning"]["trained_epochs"] == 2
+        assert model_training.TrainingCheckpoint(tmp_path, model).load_state() == \
+            (model_training.FINE_TUNING_PHASE, 4)
+
+    def test_batches_are_requested_in_order(self, dataset):
+        model, base_model = build_tiny_model()
+        config = model_training.TrainingConfig(frozen_epochs=1, epochs=2, tensorboard=False)
+        sequence = RecordingSequence()
+
+        model_training.train_model(model, base_model, sequence, dataset, config)
+
+        # the sequence's prefetching relies on the order (it shuffles itself)
+        assert sequence.requested[-6:] == list(range(6))
+
+    def test_early_stopping_hands_off_to_fine_tuning(self, dataset):
+        model, base_model = build_tiny_model()
+        # the loss can not improve by 1000 (stopping after the first epoch)
+        config = model_training.TrainingConfig(frozen_epochs=5, epochs=10, tensorboard=False,
+                                               frozen_patience=1, patience=1, min_delta=1000,
+                                               reduce_lr_patience=1)
+
+        summary = model_training.train_model(model, base_model, dataset, dataset, config)
+
+        assert summary["frozen"]["scheduled_epochs"] == 5
+        assert summary["frozen"]["trained_epochs"] == 2
+        assert summary["frozen"]["stopped_early"]
+        # the fine-tuning starts at epoch 2 and may last until the 10th
+        assert summary["fine_tuning"]["scheduled_epochs"] == 8
+        assert summary["fine_tuning"]["trained_epochs"] == 2
+        assert summary["saved_time"] > 0
+        assert float(model.optimizer.learning_rate) < config.learning_rate
+
+    def test_summary_without_early_stopping(self, dataset):
+        model, base_model = build_tiny_model()
+        config = model_training.TrainingConfig(frozen_epochs=1, epochs=2, tensorboard=False)
+
+        summary = model_training.train_model(model, base_model, dataset, dataset, config)
+
+        assert not summary["frozen"]["stopped_early"]
+        assert not summary["fine_tuning"]["stopped_early"]
+        assert summary["saved_time"] == 0
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from PIL import Image
+from betel import near_duplicates
+
+
+def create_icon(seed: int, size: int = 180) -> Image.Image:
+    # smooth random content, whose hashes are stable under resizing
+    pixels = np.random.default_rng(seed).integers(256, size=(6, 6, 3), dtype=np.uint8)
+    return Image.fromarray(pixels).resize((size, size), Image.Resampling.BICUBIC)
+
+
+@pytest.fixture
+def icons(tmp_path):
+    files = []
+    for index, (seed, size) in enumerate([(0, 180), (0, 96), (1, 180), (2, 180)]):
+        file = tmp_path / f"icon_{index}"
+        create_icon(seed, size).save(file, "png")
+        files.append(file)
+    return files
+
+
+class TestNearDuplicates:
+    @pytest.mark.parametrize("hash_function", list(near_duplicates.HASH_FUNCTIONS))
+    def test_hash_icons(self, icons, hash_function):
+        hashes = near_duplicates.hash_icons(icons, hash_function, num_threads=2)
+
+        # a resized icon is a near duplicate, other icons are not
+        assert hashes.dtype == np.uint64
+        assert near_duplicates.get_distances(hashes[0], hashes[1]) <= 4
+        assert near_duplicates.get_distances(hashes[0], hashes[2]) > 10
+        assert near_duplicates.get_distances(hashes[2], hashes[3]) > 10
+
+    def test_find_duplicate_groups(self):
+        rng = np.random.default_rng(0)
+        hashes = rng.integers(np.iinfo(np.int64).max, size=1000).astype(np.uint64)
+        # 3 bits flipped, a copy, and a chain of 2 near duplicates 4 bits apart
+        near = hashes[:10] ^ np.uint64(0b10101)
+        chain = hashes[10:20] ^ np.uint64(0b1111 << 20)
+        chain_end = chain ^ np.uint64(0b1111 << 40)
+        groups = near_duplicates.find_duplicate_groups(
+            np.concatenate([hashes, near, hashes[:10], chain, chain_end]))
+
+        assert (groups[1000:1010] == groups[:10]).all()
+        assert (groups[1010:1020] == groups[:10]).all()
+        assert (groups[1020:1030] == groups[10:20]).all()
+        assert (groups[1030:1040] == groups[10:20]).all()
+        assert len(np.unique(groups)) == 1000
+
+    def test_find_duplicate_groups_without_duplicates(self):
+        hashes = np.array([0, 0xFF, 0xFF00, 0xFFFF0000], dtype=np.uint64)
+
+        groups = near_duplicates.find_duplicate_groups(hashes, max_distance=4)
+
+        assert len(np.unique(groups)) == 4
+
+    def test_get_group_representatives(self):
+        groups = np.array([1, 0, 1, 2, 0])
+        app_ids = np.array(["com.d", "com.c", "com.a", "com.e", "com.b"])
+
+        representatives = near_duplicates.get_group_representatives(groups, app_ids)
+
+        assert representatives.tolist() == ["com.a", "com.b", "com.a", "com.e", "com.b"]
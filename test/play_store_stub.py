@@ -0,0 +1,102 @@
+import time
+import threading
+import http.server
+import urllib.parse
+
+PAGE_HTML = """
+<img src="%s" class="T75of sHb2Xb">
+<a itemprop="genre">%s</a>
+"""
+
+ICON_BYTES = bytes(range(256)) * 16
+ICON_ETAG = '"icon-v1"'
+
+
+class PlayStoreStub:
+    """A local HTTP server imitating the Play Store app details pages
+    and icon URLs (for tests and benchmarks).
+
+    Every app id is served with the same category and icon, except for
+    the ids in missing_app_ids, which get a 404 response. The first
+    throttled_requests requests get a 429 response.
+    """
+
+    def __init__(self, category: str = "Example", latency: float = 0.0,
+                 missing_app_ids: [str] = (), throttled_requests: int = 0):
+        """Constructor.
+
+        :param category: category shown on every details page
+        :param latency: seconds to wait before answering each request
+        (to imitate network latency)
+        :param missing_app_ids: app ids that are not found in the store
+        :param throttled_requests: number of requests answered with
+        "429 Too Many Requests" before serving the pages
+        """
+        stub = self
+        self.category = category
+        self.latency = latency
+        self.missing_app_ids = set(missing_app_ids)
+        self.throttled_requests = throttled_requests
+        self.requests = []
+        lock = threading.Lock()
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive connections
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                with lock:
+                    stub.requests.append(self.path)
+                    throttled = len(stub.requests) <= stub.throttled_requests
+                time.sleep(stub.latency)
+
+                if throttled:
+                    self._respond(429, b"", {"Retry-After": "0"})
+                    return
+
+                url = urllib.parse.urlparse(self.path)
+                app_id = urllib.parse.parse_qs(url.query).get("id", [""])[0]
+
+                if url.path == "/store/apps/details" and app_id not in stub.missing_app_ids:
+                    icon_url = f"{stub.base_url}/icons/{app_id}"
+                    self._respond(200, (PAGE_HTML % (icon_url, stub.category)).encode())
+                elif url.path.startswith("/icons/"):
+                    if self.headers.get("If-None-Match") == ICON_ETAG:
+                        self._respond(304, b"")
+                    else:
+                        self._respond(200, ICON_BYTES, {"ETag": ICON_ETAG})
+                else:
+                    self._respond(404, b"")
+
+            def _respond(self, status, body, headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):  # pylint: disable=arguments-differ
+                pass
+
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        """Root URL of the server."""
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def store_url(self) -> str:
+        """URL to use as the scrapers' base_url."""
+        return self.base_url + "/store/apps"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+from tensorflow.keras import layers
+from tensorflow.keras import ops
+from tensorflow.keras.models import Model
+from test import icon_builder as ib
+from betel import inference
+from betel import quantization
+from betel import classifier_sequence
+
+
+@pytest.fixture(scope="module")
+def input_dir(tmp_path_factory):
+    input_dir = tmp_path_factory.mktemp("input_dir")
+    ib.IconBuilder(input_dir, random_content=True).create_icons(num_icons=8, num_categories=2)
+    return input_dir
+
+
+@pytest.fixture(scope="module")
+def model_dir(tmp_path_factory):
+    i = layers.Input([None, None, 3], dtype="uint8")
+    x = layers.Rescaling(1 / 255)(ops.cast(i, "float32"))
+    x = layers.Conv2D(4, 3, strides=8, activation="relu")(x)
+    x = layers.GlobalAveragePooling2D()(x)
+    predictions = layers.Dense(1, activation="sigmoid")(x)
+
+    model_dir = tmp_path_factory.mktemp("model")
+    inference.export_model(Model(inputs=[i], outputs=predictions), model_dir,
+                           ["category0", "category1"], 192)
+    return model_dir
+
+
+@pytest.fixture
+def sequence(input_dir):
+    return classifier_sequence.ClassifierSequence(input_dir, 4, 192, shuffle=False,
+                                                  num_threads=2)
+
+
+class TestQuantization:
+    @pytest.mark.parametrize("mode, tolerance", [("float16", 1e-2), ("dynamic", 5e-2),
+                                                 ("int8", 5e-2)])
+    def test_quantized_model_matches_float_model(self, model_dir, sequence, mode, tolerance):
+        quantization.quantize_model(model_dir, mode, sequence)
+
+        float_classifier = inference.IconClassifier.load(model_dir)
+        quantized_classifier = quantization.TFLiteIconClassifier.load(model_dir, mode)
+
+        for idx in range(len(sequence)):
+            batch_x, _ = sequence[idx]
+            assert np.allclose(quantized_classifier.predict(batch_x),
+                               float_classifier.predict(batch_x), atol=tolerance)
+
+    def test_batch_size_can_change(self, model_dir, sequence):
+        quantization.quantize_model(model_dir, "float16")
+        classifier = quantization.TFLiteIconClassifier.load(model_dir, "float16")
+        batch_x, _ = sequence[0]
+
+        assert classifier.predict(batch_x).shape == (4, 1)
+        assert classifier.predict(batch_x[:3]).shape == (3, 1)
+
+    def test_int8_needs_calibration(self, model_dir):
+        with pytest.raises(ValueError):
+            quantization.quantize_model(model_dir, "int8")
+
+    def test_unknown_mode(self, model_dir):
+        with pytest.raises(ValueError):
+            quantization.quantize_model(model_dir, "int4")
+
+    def test_compare_classifiers(self, model_dir, sequence):
+        quantization.quantize_model(model_dir, "dynamic")
+        comparison = quantization.compare_classifiers({
+            "float": inference.IconClassifier.load(model_dir),
+            "dynamic": quantization.TFLiteIconClassifier.load(model_dir, "dynamic")
+        }, sequence)
+
+        assert list(comparison["classifier"]) == ["float", "dynamic"]
+        assert comparison["agreement"][0] == 1
+        assert comparison["accuracy"].between(0, 1).all()
+        assert (comparison["icons_per_s"] > 0).all()
@@ -0,0 +1,118 @@
+import math
+import numpy as np
+import pytest
+from test import icon_builder as ib
+from betel import classifier_dataset
+from betel import classifier_sequence
+from betel import record_shards
+
+
+@pytest.fixture
+def input_dir(tmp_path_factory):
+    input_dir = tmp_path_factory.mktemp("input_dir")
+    ib.IconBuilder(input_dir, (200, 170), random_content=True).create_icons(
+        num_icons=11, num_categories=3)
+    return input_dir
+
+
+@pytest.fixture
+def records_dir(input_dir, tmp_path_factory):
+    records_dir = tmp_path_factory.mktemp("records_dir")
+    # small shards, so that the icons span several of them
+    record_shards.export_data_set(input_dir, records_dir, shard_size=200000, num_threads=2)
+    return records_dir
+
+
+def _assert_same_batches(batches, expected_batches):
+    assert len(batches) == len(expected_batches)
+    for (batch_x, batch_y), (expected_x, expected_y) in zip(batches, expected_batches):
+        assert np.array_equal(batch_x, expected_x)
+        assert np.array_equal(batch_y, expected_y)
+
+
+class TestRecordShards:
+    def test_export(self, input_dir, records_dir):
+        metadata = record_shards.read_metadata(records_dir)
+        categories, _ = classifier_sequence.list_icons(input_dir)
+
+        assert metadata["icons"] == 11
+        assert metadata["categories"] == categories
+        assert len(metadata["shards"]) > 1
+        assert sorted(path.name for path in records_dir.glob("*.tfrecord")) == metadata["shards"]
+
+    def test_export_replaces_previous_export(self, input_dir, records_dir):
+        record_shards.export_data_set(input_dir, records_dir, num_threads=2)
+
+        assert len(list(records_dir.glob("*.tfrecord"))) == 1
+
+    @pytest.mark.parametrize("num_threads", [0, 2])
+    @pytest.mark.parametrize("num_shards,shard_index", [(1, 0), (2, 1), (3, 0)])
+    def test_sequence_matches_sequence(self, input_dir, records_dir, num_threads, num_shards,
+                                       shard_index):
+        sequence = classifier_sequence.ClassifierSequence(
+            input_dir, 4, 192, shuffle=False, num_threads=num_threads, num_shards=num_shards,
+            shard_index=shard_index)
+        record_sequence = record_shards.RecordSequence(
+            records_dir, 4, 192, shuffle=False, num_threads=num_threads, num_shards=num_shards,
+            shard_index=shard_index)
+
+        assert record_sequence.category_id_to_name == sequence.category_id_to_name
+        assert record_sequence.icons_no == sequence.icons_no
+        _assert_same_batches([record_sequence[idx] for idx in range(len(record_sequence))],
+                             [sequence[idx] for idx in range(len(sequence))])
+
+    def test_dataset_matches_dataset(self, input_dir, records_dir):
+        dataset = classifier_dataset.build_dataset(input_dir, 4, 192, shuffle=False)
+        record_dataset = record_shards.build_record_dataset(records_dir, 4, 192, shuffle=False)
+
+        _assert_same_batches(list(record_dataset.as_numpy_iterator()),
+                             list(dataset.as_numpy_iterator()))
+
+    @pytest.mark.parametrize("num_shards", [2, 3, 4])
+    def test_sharded_dataset_reads_contiguous_records(self, records_dir, num_shards):
+        dataset = record_shards.build_record_dataset(records_dir, 1, 192, shuffle=False)
+        icons = [batch_x for batch_x, _ in dataset.as_numpy_iterator()]
+        shard_size = math.ceil(len(icons) / num_shards)
+
+        for shard_index in range(num_shards):
+            shard = record_shards.build_record_dataset(records_dir, 1, 192, shuffle=False,
+                                                       num_shards=num_shards,
+                                                       shard_index=shard_index)
+            shard_icons = [batch_x for batch_x, _ in shard.as_numpy_iterator()]
+            # the last shard is completed with its first icons
+            expected_icons = icons[shard_index * shard_size:(shard_index + 1) * shard_size]
+            expected_icons += expected_icons[:shard_size - len(expected_icons)]
+
+            assert len(shard_icons) == shard_size
+            assert all(np.array_equal(icon, expected_icon)
+                       for icon, expected_icon in zip(shard_icons, expected_icons))
+
+    def test_shuffled_dataset_keeps_every_icon(self, records_dir):
+        dataset = record_shards.build_record_dataset(records_dir, 4, 192, cache="")
+
+        for _ in range(2):
+            labels = np.concatenate([batch_y for _, batch_y in dataset.as_numpy_iterator()])
+
+            assert len(labels) == 12  # 3 full batches
+            assert sorted(np.bincount(labels)) == [3, 4, 5]  # 1 padding icon
+
+    def test_sequence_tensor_cache(self, records_dir, tmp_path):
+        sequence = record_shards.RecordSequence(records_dir, 4, 192, shuffle=False)
+        cached_sequence = record_shards.RecordSequence(records_dir, 4, 192, shuffle=False,
+                                                       cache_dir=tmp_path / "cache")
+
+        _assert_same_batches([cached_sequence[idx] for idx in range(len(cached_sequence))],
+                             [sequence[idx] for idx in range(len(sequence))])
+
+    def test_sequence_close(self, records_dir):
+        sequence = record_shards.RecordSequence(records_dir, 4, 16, shuffle=False)
+        shard_files = list(sequence._shard_files.values())
+
+        sequence.close()
+        sequence.close()
+
+        assert shard_files and all(shard_file.closed for shard_file in shard_files)
+
+    def test_incomplete_export(self, tmp_path):
+        with pytest.raises(ValueError):
+            record_shards.RecordSequence(tmp_path, 4, 192)
@@ -0,0 +1,143 @@
+import time
+import asyncio
+import datetime
+import email.utils
+import multiprocessing
+import urllib.error
+import pytest
+from betel import request_throttling
+from betel import betel_errors
+
+
+@pytest.fixture
+def state_file(tmp_path):
+    return tmp_path / "rate_limiter"
+
+
+class TestTokenBucket:
+    def test_burst_is_allowed(self, state_file):
+        bucket = request_throttling.TokenBucket(state_file, rate=1, capacity=3)
+
+        waits = [bucket.try_acquire() for _ in range(4)]
+
+        assert waits[:3] == [0, 0, 0]
+        assert waits[3] > 0
+
+    def test_rate_is_respected(self, state_file):
+        bucket = request_throttling.TokenBucket(state_file, rate=50, capacity=1)
+
+        start = time.perf_counter()
+        for _ in range(11):
+            bucket.acquire()
+        elapsed = time.perf_counter() - start
+
+        assert elapsed >= 0.19  # 10 tokens after the first one at 50 tokens/s
+
+    def test_async_acquire(self, state_file):
+        bucket = request_throttling.TokenBucket(state_file, rate=50, capacity=1)
+
+        async def acquire_all():
+            for _ in range(6):
+                await bucket.acquire_async()
+
+        start = time.perf_counter()
+        asyncio.run(acquire_all())
+
+        assert time.perf_counter() - start >= 0.09
+
+    def test_bucket_is_shared_by_processes(self, state_file):
+        bucket = request_throttling.TokenBucket(state_file, rate=100, capacity=1)
+
+        start = time.perf_counter()
+        with multiprocessing.Pool(4) as pool:
+            pool.map(_acquire_tokens, [(bucket, 10)] * 4)
+        elapsed = time.perf_counter() - start
+
+        assert elapsed >= 0.39  # 40 tokens shared at 100 tokens/s
+
+
+def _acquire_tokens(args):
+    bucket, tokens_no = args
+    for _ in range(tokens_no):
+        bucket.acquire()
+
+
+class TestRetryPolicy:
+    def test_statuses_are_retried_up_to_their_limit(self):
+        policy = request_throttling.RetryPolicy(status_retries={503: 2})
+        error = _http_error(503)
+
+        assert policy.get_delay(0, error) is not None
+        assert policy.get_delay(1, error) is not None
+        assert policy.get_delay(2, error) is None
+
+    def test_other_statuses_are_not_retried(self):
+        policy = request_throttling.RetryPolicy()
+
+        assert policy.get_delay(0, _http_error(404)) is None
+
+    def test_network_errors_use_max_retries(self):
+        policy = request_throttling.RetryPolicy(max_retries=1)
+        error = betel_errors.AccessError("Can not open URL.", urllib.error.URLError("timeout"))
+
+        assert policy.get_delay(0, error) is not None
+        assert policy.get_delay(1, error) is None
+
+    def test_delay_is_bounded(self):
+        policy = request_throttling.RetryPolicy(base_delay=1, max_delay=4,
+                                                status_retries={503: 10})
+
+        delays = [policy.get_delay(attempt, _http_error(503)) for attempt in range(10)]
+
+        assert all(0 <= delay <= 4 for delay in delays)
+
+    def test_retry_after_is_honored(self):
+        policy = request_throttling.RetryPolicy()
+
+        assert policy.get_delay(0, _http_error(429, {"Retry-After": "7"})) == 7
+
+
+class TestParseRetryAfter:
+    def test_seconds(self):
+        assert request_throttling.parse_retry_after({"Retry-After": "12"}) == 12
+
+    def test_date(self):
+        date = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=30)
+        header = {"Retry-After": email.utils.format_datetime(date, usegmt=True)}
+
+        assert 25 < request_throttling.parse_retry_after(header) <= 30
+
+    @pytest.mark.parametrize("headers", [None, {}, {"Retry-After": "soon"}])
+    def test_missing_or_invalid(self, headers):
+        assert request_throttling.parse_retry_after(headers) is None
+
+
+class TestCallWithRetries:
+    def test_retries_until_success(self):
+        results = [_http_error(503), _http_error(503), "page"]
+        policy = request_throttling.RetryPolicy(base_delay=0.001)
+
+        assert request_throttling.call_with_retries(_replay(results), policy) == "page"
+
+    def test_error_is_raised_without_policy(self):
+        results = [_http_error(503), "page"]
+
+        with pytest.raises(betel_errors.AccessError):
+            request_throttling.call_with_retries(_replay(results))
+
+
+def _replay(results):
+    results = iter(results)
+
+    def request():
+        result = next(results)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    return request
+
+
+def _http_error(status, headers=None):
+    exception = urllib.error.HTTPError("url", status, "message", headers or {}, None)
+    return betel_errors.AccessError("Can not open URL.", exception)
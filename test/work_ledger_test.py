@@ -0,0 +1,92 @@
+import pickle
+import urllib.error
+import pytest
+from betel import work_ledger
+from betel import betel_errors
+
+AppState = work_ledger.AppState
+LedgerEntry = work_ledger.LedgerEntry
+
+APP_IDS = ["com.done", "com.filtered", "com.retryable", "com.permanent", "com.new"]
+
+ENTRIES = [
+    LedgerEntry("com.done", AppState.DONE, "example"),
+    LedgerEntry("com.filtered", AppState.FILTERED, "filtered"),
+    LedgerEntry("com.retryable", AppState.FAILED_RETRYABLE, message="timeout"),
+    LedgerEntry("com.permanent", AppState.FAILED_PERMANENT, message="not found")
+]
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return work_ledger.WorkLedger(tmp_path / "ledger.db", max_attempts=2)
+
+
+class TestWorkLedger:
+    def test_get_state(self, ledger):
+        ledger.record(ENTRIES)
+
+        for entry in ENTRIES:
+            assert ledger.get_state(entry.app_id) == entry.state
+
+        assert ledger.get_state("com.new") is None
+
+    def test_get_pending(self, ledger):
+        ledger.record(ENTRIES)
+
+        assert ledger.get_pending(APP_IDS, ["example"]) == ["com.retryable", "com.new"]
+
+    def test_retryable_apps_stop_after_max_attempts(self, ledger):
+        ledger.record(ENTRIES)
+        ledger.record([ENTRIES[2]])
+
+        assert ledger.get_pending(APP_IDS, ["example"]) == ["com.new"]
+
+    def test_filtered_apps_pending_after_filter_change(self, ledger):
+        ledger.record(ENTRIES)
+
+        assert "com.filtered" not in ledger.get_pending(APP_IDS, ["example"])
+        assert "com.filtered" in ledger.get_pending(APP_IDS, ["example", "filtered"])
+        assert "com.filtered" in ledger.get_pending(APP_IDS)
+
+    def test_later_outcome_replaces_state(self, ledger):
+        ledger.record([ENTRIES[2]])
+        ledger.record([LedgerEntry("com.retryable", AppState.DONE, "example")])
+
+        assert ledger.get_state("com.retryable") == AppState.DONE
+
+    def test_count_states(self, ledger):
+        ledger.record(ENTRIES)
+
+        assert ledger.count_states() == {state: 1 for state in AppState}
+
+    def test_ledger_is_persistent(self, ledger, tmp_path):
+        ledger.record(ENTRIES)
+
+        reopened = work_ledger.WorkLedger(tmp_path / "ledger.db", max_attempts=2)
+
+        assert reopened.get_state("com.done") == AppState.DONE
+
+    def test_pickled_ledger(self, ledger):
+        ledger.record(ENTRIES)
+
+        copy = pickle.loads(pickle.dumps(ledger))
+
+        assert copy.get_state("com.done") == AppState.DONE
+
+
+class TestGetFailureState:
+    @pytest.mark.parametrize("exception, expected_state", [
+        (urllib.error.HTTPError("url", 404, "Not Found", {}, None), AppState.FAILED_PERMANENT),
+        (urllib.error.HTTPError("url", 503, "Unavailable", {}, None), AppState.FAILED_RETRYABLE),
+        (urllib.error.URLError("timeout"), AppState.FAILED_RETRYABLE),
+    ])
+    def test_access_errors(self, exception, expected_state):
+        error = betel_errors.AccessError("Can not open URL.", exception)
+
+        assert work_ledger.get_failure_state(error) == expected_state
+
+    def test_scraping_error(self):
+        error = betel_errors.PlayScrapingError("Icon class not found in html.")
+
+        assert work_ledger.get_failure_state(error) == AppState.FAILED_PERMANENT